@@ -1,14 +1,19 @@
+import asyncio
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status, Query, Header
+from fastapi import Depends, HTTPException, status, Query, Header, Request
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from .database import get_db
+from .database import get_db, read_session
 from .models import User
 from .config import settings
+from .revocation import revocation_list
+from .rate_limit import allow_user
 
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = settings.ALGORITHM
@@ -17,14 +22,45 @@ ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
 # We set auto_error=False to manually handle the case where token might be in query param
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 
-def verify_password(plain_password: str, hashed_password: str):
+# bcrypt releases the GIL, so these threads hash in parallel without stalling the event loop
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_jobs = 0
+
+async def _run_hash_job(fn, *args):
+    global _hash_jobs
+    if _hash_jobs >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts in progress, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    _hash_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_jobs -= 1
+
+def _checkpw(plain_password: str, hashed_password: str) -> bool:
     try:
         return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
     except Exception:
         return False
 
-def get_password_hash(password: str):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def _hashpw(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(settings.BCRYPT_ROUNDS)).decode('utf-8')
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hash_job(_checkpw, plain_password, hashed_password)
+
+async def get_password_hash(password: str) -> str:
+    return await _run_hash_job(_hashpw, password)
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    # $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, token_type: str = "access"):
     to_encode = data.copy()
@@ -36,39 +72,74 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None, t
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+@dataclass(frozen=True)
+class CurrentUser:
+    """Identity proven by an access token; nothing is loaded from the database."""
+    id: int
+    username: str
+    session_id: str
+    expires_at: Optional[datetime] = None
+
+def decode_access_token(token: str) -> Optional[CurrentUser]:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    user_id = payload.get("user_id")
+    username = payload.get("sub")
+    session_id = payload.get("sid")
+    # Tokens without a session predate refresh rotation and can't be revoked
+    if payload.get("type") != "access" or user_id is None or username is None or session_id is None:
+        return None
+    if revocation_list.is_revoked(session_id):
+        return None
+    exp = payload.get("exp")
+    expires_at = datetime.fromtimestamp(exp, timezone.utc) if exp is not None else None
+    return CurrentUser(id=user_id, username=username, session_id=session_id, expires_at=expires_at)
+
 async def get_current_user(
+    request: Request,
     token: Optional[str] = Depends(oauth2_scheme), 
     token_query: Optional[str] = Query(None, alias="token"),
-    db: AsyncSession = Depends(get_db)
-):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
+) -> CurrentUser:
     # Try query param if header is missing
     actual_token = token or token_query
-    
-    if not actual_token:
-        raise credentials_exception
-        
-    try:
-        payload = jwt.decode(actual_token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        token_type = payload.get("type", "access")
-        if username is None or token_type != "access":
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    result = await db.execute(select(User).where(User.username == username))
+    user = decode_access_token(actual_token) if actual_token else None
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    # Before the endpoint gets to touch the database
+    if not await allow_user(user.id):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests",
+            headers={"Retry-After": "1"},
+        )
+    # Lets the read-your-writes middleware know whose request this was
+    request.state.user_id = user.id
+    return user
+
+async def get_current_db_user(current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)) -> User:
+    """The full user row, for endpoints that need more than the token's identity."""
+    result = await db.execute(select(User).where(User.id == current_user.id))
     user = result.scalars().first()
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
-async def get_current_admin_user(current_user: User = Depends(get_current_user)):
+async def get_read_db(current_user: CurrentUser = Depends(get_current_user)):
+    """Session for read-only endpoints; may be served by a replica."""
+    async with read_session(current_user.id) as session:
+        yield session
+
+async def get_current_admin_user(current_user: User = Depends(get_current_db_user)):
     if not current_user.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -1,14 +1,83 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
 
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=False,
-    pool_size=10,
-    max_overflow=20,
-    pool_recycle=3600,
-)
+logger = logging.getLogger(__name__)
+
+
+class PoolWaitStats:
+    """How long requests waited for a pooled connection, across all engines."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+
+    def record(self, waited: float):
+        self.checkouts += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def snapshot(self, reset: bool = False) -> dict:
+        data = {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+        if reset:
+            self.__init__()
+        return data
+
+pool_wait_stats = PoolWaitStats()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            pool_wait_stats.timeouts += 1
+            raise
+        finally:
+            pool_wait_stats.record(time.perf_counter() - started)
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    connect_args = {}
+    if settings.DB_PGBOUNCER:
+        # Transaction-mode poolers hand each transaction a different server
+        # connection, so asyncpg must neither cache nor reuse statement names.
+        connect_args = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return create_async_engine(
+        url,
+        echo=False,
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+engine = _create_engine(settings.DATABASE_URL)
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
     class_=AsyncSession,
@@ -23,3 +92,110 @@ async def get_db():
             yield session
         finally:
             await session.close()
+
+def pool_status() -> dict:
+    engines = {"primary": engine, **{f"replica_{i}": e for i, e in enumerate(replica_engines)}}
+    pools = {}
+    for name, e in engines.items():
+        pool = e.pool
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            pools[name] = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+            }
+    return {"pools": pools, "wait": pool_wait_stats.snapshot()}
+
+
+# --- read replicas -------------------------------------------------------------
+
+replica_engines: List[AsyncEngine] = [_create_engine(url) for url in settings.DATABASE_REPLICA_URLS]
+# Replicas start out healthy; the health check takes them out of rotation
+_healthy_replicas = set(replica_engines)
+_replica_cycle = itertools.cycle(replica_engines)
+# user_id -> monotonic time of that user's last write
+_recent_writes: Dict[int, float] = {}
+
+def mark_write(user_id: int):
+    """Pin the user's reads to the primary while replicas may not have the write yet."""
+    now = time.monotonic()
+    _recent_writes[user_id] = now
+    if len(_recent_writes) > 10000:
+        cutoff = now - settings.READ_YOUR_WRITES_SECONDS
+        for uid in [u for u, t in _recent_writes.items() if t < cutoff]:
+            del _recent_writes[uid]
+
+def read_engine(user_id: Optional[int] = None) -> AsyncEngine:
+    if user_id is not None:
+        wrote_at = _recent_writes.get(user_id)
+        if wrote_at is not None and time.monotonic() - wrote_at < settings.READ_YOUR_WRITES_SECONDS:
+            return engine
+    for _ in range(len(replica_engines)):
+        replica = next(_replica_cycle)
+        if replica in _healthy_replicas:
+            return replica
+    return engine
+
+@asynccontextmanager
+async def read_session(user_id: Optional[int] = None):
+    """Session for read-only work, on a healthy replica unless the user just wrote."""
+    bind = read_engine(user_id)
+    async with AsyncSessionLocal(bind=bind) as session:
+        try:
+            yield session
+        except DBAPIError as e:
+            if bind is not engine and e.connection_invalidated:
+                _healthy_replicas.discard(bind)
+                logger.warning(f"Replica {bind.url.render_as_string(hide_password=True)} lost, routing reads to the primary")
+            raise
+        finally:
+            await session.close()
+
+async def _primary_lsn() -> Optional[str]:
+    try:
+        async with engine.connect() as conn:
+            return (await conn.execute(text("SELECT pg_current_wal_lsn()::text"))).scalar()
+    except Exception as e:
+        logger.debug(f"Could not read the primary's WAL position: {e}")
+        return None
+
+async def _replica_lag(replica: AsyncEngine, primary_lsn: Optional[str]) -> Optional[float]:
+    """Seconds the replica is behind, or None when it isn't streaming from the primary."""
+    async with replica.connect() as conn:
+        # A replica that has replayed up to the primary's position from before
+        # the check is current, however old its last replayed commit is (idle
+        # primary). Otherwise the age of that commit is the lag. Without a live
+        # WAL receiver nothing new arrives, so no lag figure can be trusted.
+        result = await conn.execute(
+            text(
+                "SELECT (SELECT status FROM pg_stat_wal_receiver) = 'streaming', "
+                "pg_last_wal_replay_lsn() >= CAST(:primary_lsn AS pg_lsn), "
+                "extract(epoch FROM now() - pg_last_xact_replay_timestamp())"
+            ),
+            {"primary_lsn": primary_lsn},
+        )
+        streaming, caught_up, behind = result.one()
+        if not streaming:
+            return None
+        return 0.0 if caught_up else behind
+
+async def run_replica_health_checks():
+    while replica_engines:
+        primary_lsn = await _primary_lsn()
+        for replica in replica_engines:
+            try:
+                lag = await asyncio.wait_for(
+                    _replica_lag(replica, primary_lsn), settings.REPLICA_HEALTH_CHECK_INTERVAL_SECONDS
+                )
+                healthy = lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS
+            except Exception as e:
+                lag, healthy = None, False
+                logger.debug(f"Replica {replica.url.render_as_string(hide_password=True)} health check failed: {e}")
+            if healthy != (replica in _healthy_replicas):
+                logger.warning(f"Replica {replica.url.render_as_string(hide_password=True)} is now {'healthy' if healthy else 'unhealthy'} (lag {lag})")
+            if healthy:
+                _healthy_replicas.add(replica)
+            else:
+                _healthy_replicas.discard(replica)
+        await asyncio.sleep(settings.REPLICA_HEALTH_CHECK_INTERVAL_SECONDS)
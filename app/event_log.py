@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select
+
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import UserEvent
+from .ws_types import WSEventType
+
+logger = logging.getLogger(__name__)
+
+# Events a reconnecting client needs to rebuild its state. Presence and typing are
+# ephemeral and are covered by the online_list sent on every connect.
+REPLAYABLE_EVENTS = {
+    WSEventType.NEW_MESSAGE,
+    WSEventType.DELETE_MESSAGE,
+    WSEventType.MESSAGE_READ,
+    WSEventType.MESSAGE_READ_COUNT,
+    WSEventType.MESSAGE_REACTION,
+    WSEventType.NEW_CHAT,
+    WSEventType.CHAT_UPDATED,
+    WSEventType.CHAT_DELETED,
+}
+
+# (seq, monotonic time, message) - the message dict is shared by all recipients
+LogEntry = Tuple[int, float, dict]
+
+
+def is_replayable(message: dict) -> bool:
+    try:
+        return WSEventType(message.get("type")) in REPLAYABLE_EVENTS
+    except ValueError:
+        return False
+
+
+class EventLog:
+    """Bounded, sequence-numbered log of the chat events each user received.
+
+    Sequence numbers are global and start from the boot time in microseconds, so
+    they keep increasing across restarts and every recipient of an event sees the
+    same seq. With EVENT_LOG_SPILL_ENABLED, entries pushed out of the in-memory
+    ring are written to the user_events table and replay can reach past it.
+    """
+
+    def __init__(self):
+        self.boot_seq = time.time_ns() // 1000
+        self.last_seq = self.boot_seq
+        self._events: Dict[int, Deque[LogEntry]] = {}
+        # user_id -> highest seq that is no longer held in memory for that user
+        self._floor: Dict[int, int] = {}
+        # Highest floor of the users whose logs expired; stands in for theirs
+        self._idle_floor = self.boot_seq
+        self._spill_queue: List[Tuple[int, LogEntry]] = []
+        # Batch being written by flush(); still only in memory until it commits
+        self._spilling: List[Tuple[int, LogEntry]] = []
+        # user_id -> (highest seq lost by a failed spill, when); replays from before it resync
+        self._unspilled: Dict[int, Tuple[int, float]] = {}
+        self._last_prune = 0.0
+
+    def next_seq(self) -> int:
+        self.last_seq += 1
+        return self.last_seq
+
+    def append(self, user_ids: List[int], seq: int, message: dict):
+        now = time.monotonic()
+        entry = (seq, now, message)
+        for user_id in user_ids:
+            events = self._events.get(user_id)
+            if events is None:
+                events = self._events[user_id] = deque()
+                self._floor.setdefault(user_id, self._idle_floor)
+            if len(events) >= settings.EVENT_LOG_MAX_EVENTS_PER_USER:
+                self._drop(user_id, events.popleft())
+            events.append(entry)
+
+    def _drop(self, user_id: int, entry: LogEntry):
+        self._floor[user_id] = entry[0]
+        if settings.EVENT_LOG_SPILL_ENABLED:
+            self._spill_queue.append((user_id, entry))
+
+    async def replay(self, user_id: int, since: int) -> Optional[List[dict]]:
+        """Return the events after `since`, or None when the client must resync."""
+        if since >= self.last_seq:
+            return []
+
+        events = self._events.get(user_id, ())
+        floor = self._floor.get(user_id, self._idle_floor)
+        in_memory = [entry[2] for entry in events if entry[0] > since]
+
+        if since >= floor:
+            missed = in_memory
+        elif settings.EVENT_LOG_SPILL_ENABLED:
+            if since < self._unspilled.get(user_id, (0, 0.0))[0]:
+                return None
+            spilled = await self._load_spilled(user_id, since, floor)
+            if spilled is None:
+                return None
+            missed = spilled + in_memory
+        else:
+            return None
+
+        if len(missed) > settings.EVENT_LOG_MAX_REPLAY:
+            return None
+        return missed
+
+    async def _load_spilled(self, user_id: int, since: int, floor: int) -> Optional[List[dict]]:
+        # Dropped entries waiting for the next flush continue the table's rows.
+        # Taken before querying: a flush committing meanwhile then shows up in
+        # both, never in neither.
+        pending = [entry for uid, entry in self._spilling + self._spill_queue if uid == user_id]
+        async with AsyncSessionLocal() as db:
+            # Spilled entries are contiguous per user, so a row at or before `since`
+            # proves nothing between it and the memory floor was pruned.
+            if not any(entry[0] <= since for entry in pending):
+                covered = await db.execute(
+                    select(UserEvent.id).where(UserEvent.user_id == user_id, UserEvent.seq <= since).limit(1)
+                )
+                if covered.scalar() is None:
+                    return None
+
+            stmt = (
+                select(UserEvent.seq, UserEvent.payload)
+                .where(UserEvent.user_id == user_id, UserEvent.seq > since, UserEvent.seq <= floor)
+                .order_by(UserEvent.seq.asc())
+                .limit(settings.EVENT_LOG_MAX_REPLAY + 1)
+            )
+            spilled = dict((await db.execute(stmt)).all())
+        for seq, _, message in pending:
+            if since < seq <= floor:
+                spilled.setdefault(seq, message)
+        return [spilled[seq] for seq in sorted(spilled)]
+
+    def _expire_idle(self):
+        """Drop the logs of users who haven't received anything within the retention window.
+
+        Their floors fold into one shared floor: replays for them stay correct,
+        at worst reading the spill table or resyncing when they didn't need to.
+        """
+        cutoff = time.monotonic() - settings.EVENT_LOG_RETENTION_SECONDS
+        for user_id in [u for u, events in self._events.items() if not events or events[-1][1] < cutoff]:
+            for entry in self._events.pop(user_id):
+                self._drop(user_id, entry)
+            self._idle_floor = max(self._idle_floor, self._floor.pop(user_id, self._idle_floor))
+
+        # Spilled rows from before a lost batch are past retention by now, so
+        # replays from before it fail the coverage check on their own
+        cutoff = time.time() - settings.EVENT_LOG_SPILL_RETENTION_HOURS * 3600
+        for user_id in [u for u, (_, at) in self._unspilled.items() if at < cutoff]:
+            del self._unspilled[user_id]
+
+    async def flush(self, everything: bool = False):
+        if everything:
+            for user_id in list(self._events):
+                for entry in self._events.pop(user_id):
+                    self._drop(user_id, entry)
+
+        if not self._spill_queue:
+            return
+        batch, self._spill_queue = self._spill_queue, []
+        self._spilling = batch
+        rows = [{"user_id": user_id, "seq": entry[0], "payload": entry[2]} for user_id, entry in batch]
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(UserEvent), rows)
+                if time.monotonic() - self._last_prune > 300:
+                    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.EVENT_LOG_SPILL_RETENTION_HOURS)
+                    await db.execute(delete(UserEvent).where(UserEvent.created_at < cutoff))
+                    self._last_prune = time.monotonic()
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Failed to spill {len(rows)} WS events: {e}")
+            # The rows are gone; replays that needed them must resync
+            now = time.time()
+            for user_id, entry in batch:
+                self._unspilled[user_id] = (max(self._unspilled.get(user_id, (0, 0.0))[0], entry[0]), now)
+        finally:
+            self._spilling = []
+
+    async def run_maintenance(self):
+        while True:
+            await asyncio.sleep(settings.EVENT_LOG_SPILL_INTERVAL_SECONDS)
+            self._expire_idle()
+            await self.flush()
+
+
+event_log = EventLog()
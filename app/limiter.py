@@ -1,4 +1,16 @@
+from fastapi import Request
 from slowapi import Limiter
 from slowapi.util import get_remote_address
+from .auth import decode_access_token
+from .config import settings
 
-limiter = Limiter(key_func=get_remote_address)
+def rate_limit_key(request: Request) -> str:
+    """Signed-in callers are limited per user, everyone else per address."""
+    authorization = request.headers.get("authorization", "")
+    token = authorization[7:] if authorization.lower().startswith("bearer ") else request.query_params.get("token")
+    user = decode_access_token(token) if token else None
+    if user is not None:
+        return f"user:{user.id}"
+    return get_remote_address(request)
+
+limiter = Limiter(key_func=rate_limit_key, storage_uri=settings.RATE_LIMIT_STORAGE_URI)
@@ -2,16 +2,25 @@ from fastapi import FastAPI, Depends, WebSocket, WebSocketDisconnect, Query, Req
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+import asyncio
 import os
 import logging
-from jose import jwt, JWTError
+from typing import Optional
 
 from .config import settings
-from .database import engine, Base, AsyncSessionLocal
+from .database import engine, Base, AsyncSessionLocal, mark_write, run_replica_health_checks
 from .websockets import manager
-from .auth import SECRET_KEY, ALGORITHM, get_current_user
+from .event_log import event_log
+from .outbox import dispatcher as outbox_dispatcher
+from .read_receipts import read_counter
+from .services import archive_service, unread_service
+from . import ws_protocol
+from .ws_types import WSCloseCode, WSEventType
+from .auth import decode_access_token
+from .revocation import revocation_list
+from .rate_limit import allow_user
 from .routers import auth, chats, messages, files, admin
-import json
 
 # Configure logging
 logging.basicConfig(
@@ -20,9 +29,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await revocation_list.load()
+    background_tasks = [
+        asyncio.create_task(revocation_list.run_sync()),
+        asyncio.create_task(manager.run_heartbeat()),
+        asyncio.create_task(event_log.run_maintenance()),
+        asyncio.create_task(archive_service.run_partition_maintenance()),
+        asyncio.create_task(unread_service.run_reconciliation()),
+        asyncio.create_task(read_counter.run()),
+        asyncio.create_task(run_replica_health_checks()),
+    ]
+    outbox_task = asyncio.create_task(outbox_dispatcher.run())
+    yield
+    try:
+        await read_counter.flush()
+    except Exception as e:
+        logger.error(f"Failed to flush read counts: {e}")
+    # Send what is already committed before the event log is flushed
+    outbox_dispatcher.stop()
+    await outbox_task
+    for task in background_tasks:
+        task.cancel()
+    # Persist what's still only in memory so replay survives the restart
+    await event_log.flush(everything=True)
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
+    lifespan=lifespan,
 )
 
 # CORS — allows frontend and admin panel dev servers to reach the backend
@@ -34,6 +70,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+    # Any non-GET request may have written; keep this user's reads off the replicas for a bit
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        user_id = getattr(request.state, "user_id", None)
+        if user_id is not None:
+            mark_write(user_id)
+    return response
+
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from .limiter import limiter
@@ -80,35 +126,63 @@ async def root():
     }
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("user_id")
-        if user_id is None:
-            await websocket.close(code=4003)
-            return
-    except (JWTError, Exception) as e:
-        logger.warning(f"WS auth failed: {str(e)}")
-        await websocket.close(code=4003)
+async def websocket_endpoint(websocket: WebSocket, token: str = Query(...), since: Optional[int] = Query(None)):
+    user = decode_access_token(token)
+    if user is None:
+        logger.warning("WS auth failed: invalid, expired or revoked token")
+        await websocket.close(code=WSCloseCode.AUTH_FAILED)
+        return
+    user_id = user.id
+    if not await allow_user(user_id):
+        logger.warning(f"WS for user {user_id} rejected: rate limit exceeded")
+        await websocket.close(code=WSCloseCode.RATE_LIMITED)
         return
 
     logger.info(f"WS authorized: user {user_id}")
-    await manager.connect(user_id, websocket)
+    subprotocol, encoding = ws_protocol.negotiate(websocket.scope.get("subprotocols", []))
+    if not await manager.connect(user_id, websocket, subprotocol, encoding, user.session_id, user.expires_at):
+        return
     
     try:
         # Initial state
-        await manager.send_personal_message({
+        await manager.send_to_connection(user_id, websocket, {
             "type": "online_list",
-            "data": manager.get_online_users()
-        }, user_id)
+            "data": manager.get_online_users(),
+            "seq": event_log.last_seq
+        })
+
+        # Resuming client: send only what it missed, or ask it to refetch everything
+        if since is not None:
+            missed = await event_log.replay(user_id, since)
+            if missed is None:
+                await manager.send_to_connection(user_id, websocket, {
+                    "type": WSEventType.RESYNC_REQUIRED,
+                    "data": {"seq": event_log.last_seq}
+                })
+            else:
+                for event in missed:
+                    await manager.send_to_connection(user_id, websocket, event)
+                await manager.send_to_connection(user_id, websocket, {
+                    "type": WSEventType.REPLAY_COMPLETE,
+                    "data": {"seq": event_log.last_seq, "count": len(missed)}
+                })
 
         while True:
-            data = await websocket.receive_text()
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            manager.touch(websocket)
+            if not manager.allow_frame(websocket):
+                logger.warning(f"Closing WS of user {user_id}: frame rate limit exceeded")
+                await manager.disconnect(user_id, websocket)
+                await websocket.close(code=WSCloseCode.RATE_LIMITED)
+                return
+            try:
+                msg = ws_protocol.decode(frame)
+            except ValueError:
+                continue
             try:
-                msg = json.loads(data)
                 await manager.handle_message(user_id, msg, websocket)
-            except json.JSONDecodeError:
-                pass
             except Exception as e:
                 logger.error(f"Error processing WS message: {e}")
     except WebSocketDisconnect:
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, BigInteger, Table, Boolean, UniqueConstraint
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, BigInteger, Table, Boolean, UniqueConstraint, Index, JSON, Float
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -7,6 +7,7 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
+    # Postgres also has a pg_trgm GIN index on username for substring search
     username = Column(String, unique=True, index=True, nullable=False)
     email = Column(String, unique=True, index=True, nullable=True)
     password_hash = Column(String, nullable=False)
@@ -28,6 +29,8 @@ class Chat(Base):
     avatar_path = Column(String, nullable=True)
     is_group = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # When the chat last changed for all its members (see sync_service)
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
 
     members = relationship("ChatMember", back_populates="chat", cascade="all, delete-orphan")
     messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan")
@@ -36,33 +39,51 @@ class ChatMember(Base):
     __tablename__ = "chat_members"
     __table_args__ = (
         UniqueConstraint("chat_id", "user_id", name="uq_chat_user"),
+        Index("ix_chat_members_user_id_version", "user_id", "version"),
     )
 
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"))
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
     is_admin = Column(Boolean, default=False)
     is_owner = Column(Boolean, default=False)
+    # When this chat last changed for this member only (see sync_service)
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
+    # Messages from others not read yet (see unread_service)
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Newest message id when the member last marked the whole chat read
+    read_through = Column(Integer, nullable=False, default=0, server_default="0")
 
     chat = relationship("Chat", back_populates="members")
     user = relationship("User", back_populates="chats")
 
 class Message(Base):
+    # On Postgres this is partitioned by id range (see archive_service); old
+    # partitions are moved to message_archive_segments files.
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"))
     sender_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     text = Column(String, nullable=True)
     file_id = Column(Integer, ForeignKey("files.id", ondelete="SET NULL"), nullable=True)
+    # Not enforced on the partitioned table: the target may have been archived
     reply_to_id = Column(Integer, ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Number of message_reads rows, refreshed in batches by read_receipts
+    read_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # There is also a generated "search_vector" tsvector column (GIN indexed),
+    # left unmapped because only search_service reads it.
 
     chat = relationship("Chat", back_populates="messages")
     sender = relationship("User", back_populates="messages")
     file = relationship("File", back_populates="message")
     read_by = relationship("MessageRead", back_populates="message", cascade="all, delete-orphan")
     reactions = relationship("MessageReaction", back_populates="message", cascade="all, delete-orphan")
+    reaction_counts = relationship("MessageReactionCount", back_populates="message", cascade="all, delete-orphan")
     reply_to = relationship("Message", remote_side=[id], backref="replies")
 
 class MessageRead(Base):
@@ -94,6 +115,16 @@ class MessageReaction(Base):
     message = relationship("Message", back_populates="reactions")
     user = relationship("User")
 
+class MessageReactionCount(Base):
+    """Per-emoji reaction totals, kept in step with message_reactions by reaction_service."""
+    __tablename__ = "message_reaction_counts"
+
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True)
+    emoji = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    message = relationship("Message", back_populates="reaction_counts")
+
 class File(Base):
     __tablename__ = "files"
 
@@ -105,3 +136,92 @@ class File(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     message = relationship("Message", back_populates="file", uselist=False)
+
+class MessageArchiveSegment(Base):
+    """One chat's messages from an archived partition, stored as gzipped NDJSON."""
+    __tablename__ = "message_archive_segments"
+    __table_args__ = (
+        Index("ix_message_archive_segments_chat_first", "chat_id", "first_message_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
+    first_message_id = Column(Integer, nullable=False)
+    last_message_id = Column(Integer, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    # Relative to MESSAGE_ARCHIVE_DIR
+    path = Column(String, nullable=False)
+    # The file is a series of gzip members of block_lines records each, starting
+    # at these byte offsets, so a page can be read without decompressing what
+    # comes before it. NULL for segments written before blocks existed.
+    block_lines = Column(Integer, nullable=True)
+    block_offsets = Column(JSON, nullable=True)
+    # JSON of the newest record, for chat lists
+    last_message = Column(String, nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UserEvent(Base):
+    """WS event spilled from the in-memory replay log (see app/event_log.py)."""
+    __tablename__ = "user_events"
+    __table_args__ = (
+        Index("ix_user_events_user_seq", "user_id", "seq"),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(BigInteger, nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class OutboxEvent(Base):
+    """Chat event committed with the change it describes (see app/outbox.py)."""
+    __tablename__ = "outbox_events"
+
+    id = Column(BigInteger, primary_key=True)
+    payload = Column(JSON, nullable=False)
+    member_ids = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RefreshToken(Base):
+    """Current (and just rotated) refresh token of a login session."""
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    # Shared by every token of one login; access tokens carry it as "sid"
+    session_id = Column(String, nullable=False, index=True)
+    # sha256 of the token, the token itself is never stored
+    token_hash = Column(String, nullable=False, unique=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    used_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RevokedSession(Base):
+    """Logged-out session whose access tokens may not have expired yet (see app/revocation.py)."""
+    __tablename__ = "revoked_sessions"
+
+    session_id = Column(String, primary_key=True)
+    # No FK: deleting the user must not un-revoke tokens that are still valid
+    user_id = Column(Integer, nullable=False)
+    # Once every access token of the session has expired the row can go
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class RateLimitBucket(Base):
+    """Shared token bucket for RATE_LIMIT_BACKEND=postgres (see app/rate_limit.py)."""
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)
+    # Epoch seconds at which the bucket is full again
+    tat = Column(Float, nullable=False)
+
+class ChatTombstone(Base):
+    """A chat the user was removed from or that was deleted, for GET /chats?since."""
+    __tablename__ = "chat_tombstones"
+    __table_args__ = (
+        Index("ix_chat_tombstones_user_id_version", "user_id", "version"),
+    )
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    # No FK: the chat is usually gone
+    chat_id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False)
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from typing import Iterable
+
+from sqlalchemy import delete, event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import OutboxEvent
+from .websockets import manager
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(db: AsyncSession, message: dict, member_ids: Iterable[int]):
+    """Stage a chat event in the caller's transaction.
+
+    Nothing is sent until the transaction commits, and a rollback drops the
+    event together with the change it describes.
+    """
+    db.add(OutboxEvent(payload=message, member_ids=list(member_ids)))
+    db.info["outbox_pending"] = True
+
+
+class OutboxDispatcher:
+    """Drains outbox_events in id order into the ConnectionManager.
+
+    Rows are deleted only after their batch has been handed to the sockets, so a
+    crash in between delivers those events again on restart (at-least-once). Every
+    frame carries its row id as "event_id" for clients to drop such duplicates.
+    The ConnectionManager is per process, so run a single worker (or put a
+    backplane behind broadcast_to_chat) - the outbox doesn't fan out across them.
+    """
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self):
+        """Let run() finish its current drain, do a last one and return."""
+        self._stopping = True
+        self.wake()
+
+    async def dispatch_pending(self) -> int:
+        async with AsyncSessionLocal() as db:
+            stmt = (
+                select(OutboxEvent.id, OutboxEvent.payload, OutboxEvent.member_ids)
+                .order_by(OutboxEvent.id.asc())
+                .limit(settings.OUTBOX_BATCH_SIZE)
+            )
+            events = (await db.execute(stmt)).all()
+            # Don't hold a connection while sending to slow sockets
+            await db.rollback()
+            if not events:
+                return 0
+
+            for row in events:
+                try:
+                    await manager.broadcast_to_chat({**row.payload, "event_id": row.id}, row.member_ids)
+                except Exception as e:
+                    # Retrying wouldn't help a frame that can't be built; don't block the queue
+                    logger.error(f"Outbox event {row.id} could not be dispatched: {e}")
+
+            await db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_([row.id for row in events])))
+            await db.commit()
+        return len(events)
+
+    async def run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.OUTBOX_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while await self.dispatch_pending() >= settings.OUTBOX_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {e}")
+
+
+dispatcher = OutboxDispatcher()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_dispatcher(session: Session):
+    if session.info.pop("outbox_pending", False):
+        dispatcher.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_pending(session: Session):
+    session.info.pop("outbox_pending", None)
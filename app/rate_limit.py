@@ -0,0 +1,106 @@
+import logging
+import time
+from typing import Dict
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket kept as a GCRA "theoretical arrival time": one float per bucket.
+
+    Allows `burst` back-to-back takes, then one every 1/rate seconds.
+    """
+
+    __slots__ = ("interval", "tolerance", "tat")
+
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        tat = max(self.tat, now)
+        if tat - now > self.tolerance:
+            return False
+        self.tat = tat + self.interval
+        return True
+
+
+class MemoryBucketStore:
+    """Buckets held by this worker; with several workers each enforces its own limit."""
+
+    def __init__(self):
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._last_prune = time.monotonic()
+
+    async def hit(self, key: str, rate: float, burst: int) -> bool:
+        now = time.monotonic()
+        if now - self._last_prune > 60:
+            # A bucket whose arrival time has passed is full again, same as a new one
+            self._buckets = {k: b for k, b in self._buckets.items() if b.tat > now}
+            self._last_prune = now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket.take()
+
+
+# Same algorithm as TokenBucket in one upsert on the database clock. The WHERE
+# clause skips the update when the bucket is empty, so no row comes back.
+_HIT_SQL = text("""
+INSERT INTO rate_limit_buckets (key, tat)
+VALUES (:key, extract(epoch FROM clock_timestamp()) + :interval)
+ON CONFLICT (key) DO UPDATE
+SET tat = greatest(rate_limit_buckets.tat + :interval, EXCLUDED.tat)
+WHERE greatest(rate_limit_buckets.tat + :interval, EXCLUDED.tat) - EXCLUDED.tat <= :tolerance
+RETURNING tat
+""")
+
+
+_PRUNE_SQL = text("DELETE FROM rate_limit_buckets WHERE tat < extract(epoch FROM clock_timestamp())")
+
+
+class PostgresBucketStore:
+    """Buckets in the rate_limit_buckets table, shared by every worker and host.
+
+    Each hit is a write and a commit on the primary.
+    """
+
+    async def hit(self, key: str, rate: float, burst: int) -> bool:
+        interval = 1.0 / rate
+        params = {"key": key, "interval": interval, "tolerance": (burst - 1) * interval}
+        try:
+            async with AsyncSessionLocal() as db:
+                allowed = (await db.execute(_HIT_SQL, params)).first() is not None
+                await db.commit()
+            return allowed
+        except Exception as e:
+            # Don't turn a database hiccup into an outage for every user
+            logger.error(f"Rate limit check failed for {key}: {e}")
+            return True
+
+
+def _create_store():
+    if settings.RATE_LIMIT_BACKEND == "postgres":
+        return PostgresBucketStore()
+    return MemoryBucketStore()
+
+rate_limiter = _create_store()
+
+
+async def prune_buckets(db: AsyncSession):
+    """Drop shared buckets that have refilled; a missing row is a full bucket."""
+    if settings.RATE_LIMIT_BACKEND == "postgres":
+        await db.execute(_PRUNE_SQL)
+
+
+async def allow_user(user_id: int) -> bool:
+    """Charge one authenticated REST call, WS handshake or WS command to the user."""
+    return await rate_limiter.hit(f"user:{user_id}", settings.USER_RATE_LIMIT_PER_SECOND, settings.USER_RATE_LIMIT_BURST)
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Set, Tuple
+
+from .config import settings
+
+
+class ReadCache:
+    """Merges concurrent identical reads and optionally keeps their results briefly.
+
+    A caller asking for a key that is already being loaded waits for that load
+    instead of running its own (single flight). With READ_CACHE_TTL_SECONDS > 0
+    the result is then served until it expires or one of its tags is invalidated;
+    services invalidate after committing a change. Waiters share the same result
+    object, so it must not be mutated. State is per process: other workers only
+    see a change once their own entries expire.
+    """
+
+    def __init__(self):
+        # key -> (load task, tags)
+        self._inflight: Dict[Hashable, Tuple[asyncio.Task, Tuple[str, ...]]] = {}
+        # key -> (expires at, value, tags), oldest first
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, Tuple[str, ...]]]" = OrderedDict()
+        self._tagged: Dict[str, Set[Hashable]] = {}
+
+    async def get(self, key: Hashable, tags: Iterable[str], load: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+            self._drop(key)
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            tags = tuple(tags)
+            inflight = (asyncio.create_task(self._load(key, tags, load)), tags)
+            self._inflight[key] = inflight
+        # One caller going away must not cancel the load the others wait for
+        return await asyncio.shield(inflight[0])
+
+    async def _load(self, key: Hashable, tags: Tuple[str, ...], load: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await load()
+        finally:
+            inflight = self._inflight.get(key)
+            # Invalidated meanwhile: the result may predate the change, hand it out but don't keep it
+            current = inflight is not None and inflight[0] is asyncio.current_task()
+            if current:
+                del self._inflight[key]
+        if current and settings.READ_CACHE_TTL_SECONDS > 0:
+            self._store(key, tags, value)
+        return value
+
+    def _store(self, key: Hashable, tags: Tuple[str, ...], value: Any):
+        self._entries[key] = (time.monotonic() + settings.READ_CACHE_TTL_SECONDS, value, tags)
+        for tag in tags:
+            self._tagged.setdefault(tag, set()).add(key)
+        while len(self._entries) > settings.READ_CACHE_MAX_ENTRIES:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    def invalidate(self, *tags: str):
+        for tag in tags:
+            for key in list(self._tagged.get(tag, ())):
+                self._drop(key)
+        wanted = set(tags)
+        for key in [k for k, (_, t) in self._inflight.items() if wanted.intersection(t)]:
+            del self._inflight[key]
+
+    def invalidate_chat(self, chat_id: int, member_ids: Iterable[int]):
+        """A chat changed: its message pages and its members' chat lists."""
+        self.invalidate(f"chat:{chat_id}", *(f"user:{user_id}" for user_id in member_ids))
+
+    def clear(self):
+        self._entries.clear()
+        self._tagged.clear()
+        self._inflight.clear()
+
+
+read_cache = ReadCache()
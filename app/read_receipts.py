@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List
+
+from sqlalchemy import func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import noload, selectinload
+
+from . import outbox
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import ChatMember, Message, MessageRead
+from .read_cache import read_cache
+from .recent_messages import recent_messages
+from .ws_types import WSEventType
+
+logger = logging.getLogger(__name__)
+
+
+def is_large_group(member_count: int) -> bool:
+    """Past LARGE_GROUP_THRESHOLD members, per-user read receipts stay out of
+    broadcasts and message payloads; members get read_count instead."""
+    return member_count > settings.LARGE_GROUP_THRESHOLD
+
+
+async def is_large_chat(db: AsyncSession, chat_id: int) -> bool:
+    stmt = select(func.count(ChatMember.user_id)).where(ChatMember.chat_id == chat_id)
+    return is_large_group((await db.execute(stmt)).scalar())
+
+
+def read_by_loader(large: bool):
+    return noload(Message.read_by) if large else selectinload(Message.read_by)
+
+
+async def recount(db: AsyncSession, message_ids: List[int]):
+    """Set read_count of these messages from message_reads."""
+    count = (
+        select(func.count(MessageRead.id))
+        .where(MessageRead.message_id == Message.id)
+        .correlate_except(MessageRead)
+        .scalar_subquery()
+    )
+    await db.execute(
+        update(Message)
+        .where(Message.id.in_(message_ids))
+        .values(read_count=count)
+        .execution_options(synchronize_session=False)
+    )
+
+
+class ReadCounter:
+    """Keeps messages.read_count up to date and announces it in large groups.
+
+    Reads only mark the message dirty. Every READ_COUNT_FLUSH_INTERVAL_SECONDS
+    the dirty messages are recounted from message_reads in one statement, and
+    each large group gets a single message_read_count event with the new counts
+    of its messages. However many members read a message in that window, the
+    group receives one frame per member instead of one per reader per member.
+    """
+
+    def __init__(self):
+        # message_id -> chat_id
+        self._dirty: Dict[int, int] = {}
+
+    def touch(self, chat_id: int, message_ids: Iterable[int]):
+        for message_id in message_ids:
+            self._dirty[message_id] = chat_id
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await self._flush(dirty)
+        except Exception:
+            # Recount them next time
+            for message_id, chat_id in dirty.items():
+                self._dirty.setdefault(message_id, chat_id)
+            raise
+
+    async def _flush(self, dirty: Dict[int, int]):
+        message_ids = list(dirty)
+        chat_ids = set(dirty.values())
+        async with AsyncSessionLocal() as db:
+            await recount(db, message_ids)
+            rows = (await db.execute(
+                select(Message.id, Message.chat_id, Message.read_count).where(Message.id.in_(message_ids))
+            )).all()
+
+            stmt = select(ChatMember.chat_id, ChatMember.user_id).where(ChatMember.chat_id.in_(chat_ids))
+            members: Dict[int, List[int]] = {}
+            for chat_id, user_id in (await db.execute(stmt)).all():
+                members.setdefault(chat_id, []).append(user_id)
+
+            counts: Dict[int, Dict[int, int]] = {}
+            for message_id, chat_id, read_count in rows:
+                counts.setdefault(chat_id, {})[message_id] = read_count
+            for chat_id, chat_counts in counts.items():
+                member_ids = members.get(chat_id, [])
+                if is_large_group(len(member_ids)):
+                    ws_msg = {
+                        "type": WSEventType.MESSAGE_READ_COUNT,
+                        "data": {
+                            "chat_id": chat_id,
+                            "counts": {str(m): n for m, n in chat_counts.items()},
+                        }
+                    }
+                    outbox.enqueue(db, ws_msg, member_ids)
+            await db.commit()
+
+        for chat_id, chat_counts in counts.items():
+            read_cache.invalidate_chat(chat_id, members.get(chat_id, []))
+            recent_messages.set_read_counts(chat_id, chat_counts)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.READ_COUNT_FLUSH_INTERVAL_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush read counts: {e}")
+
+
+read_counter = ReadCounter()
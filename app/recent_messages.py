@@ -0,0 +1,205 @@
+import json
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .config import settings
+from .serializers import json_datetime
+
+
+def _size(entry: dict) -> int:
+    return len(json.dumps(entry, separators=(",", ":")))
+
+
+def viewer_copy(entry: dict, user_id: int) -> dict:
+    """Entries hold every reaction; narrow them to the viewer like hot messages."""
+    mine = [r for r in entry["reactions"] if r["user_id"] == user_id]
+    emojis = {r["emoji"] for r in mine}
+    return {
+        **entry,
+        "reactions": mine,
+        "reaction_summary": [{**s, "reacted_by_me": s["emoji"] in emojis} for s in entry["reaction_summary"]],
+    }
+
+
+class ChatRing:
+    """The newest serialized messages of one chat, oldest first, plus its members."""
+
+    def __init__(self, member_ids: Iterable[int], entries: List[dict], exhaustive: bool):
+        self.member_ids: Set[int] = set(member_ids)
+        self.entries = entries
+        self.sizes = [_size(e) for e in entries]
+        # True when the chat has no messages besides these
+        self.exhaustive = exhaustive
+
+    @property
+    def bytes(self) -> int:
+        return sum(self.sizes)
+
+    def can_serve(self, limit: int) -> bool:
+        return self.exhaustive or len(self.entries) >= limit
+
+    def latest(self, user_id: int, limit: int) -> List[dict]:
+        return [viewer_copy(e, user_id) for e in self.entries[-limit:]]
+
+    def find(self, message_id: int) -> int:
+        for i in range(len(self.entries) - 1, -1, -1):
+            if self.entries[i]["id"] == message_id:
+                return i
+        return -1
+
+
+class RecentMessages:
+    """Per-chat rings of recent MessageOut dicts for the first history page.
+
+    Services write through after committing, so an active chat's latest page
+    needs no queries. Chats are evicted least recently used first once the
+    serialized size passes RECENT_MESSAGES_MAX_BYTES. Like the read cache this is
+    per process.
+    """
+
+    def __init__(self):
+        self._rings: "OrderedDict[int, ChatRing]" = OrderedDict()
+        self._bytes = 0
+        # chat_id -> [fills in progress, writes seen meanwhile]
+        self._fills: Dict[int, List[int]] = {}
+
+    # --- reading ---------------------------------------------------------
+
+    def get(self, chat_id: int, limit: int) -> Optional[ChatRing]:
+        ring = self._rings.get(chat_id)
+        if ring is None or not ring.can_serve(limit):
+            return None
+        self._rings.move_to_end(chat_id)
+        return ring
+
+    def begin_fill(self, chat_id: int) -> Tuple[int, int]:
+        state = self._fills.setdefault(chat_id, [0, 0])
+        state[0] += 1
+        return chat_id, state[1]
+
+    def finish_fill(self, token: Tuple[int, int], member_ids: Iterable[int] = (), entries: Optional[List[dict]] = None, exhaustive: bool = False):
+        """Install a ring loaded from the database, unless a write raced the load.
+
+        Without entries the fill is only ended (failed load or unknown chat).
+        """
+        chat_id, writes = token
+        state = self._fills[chat_id]
+        state[0] -= 1
+        raced = state[1] != writes
+        if state[0] == 0:
+            del self._fills[chat_id]
+        if raced or entries is None:
+            return
+        self.drop_chat(chat_id)
+        ring = ChatRing(member_ids, entries[-settings.RECENT_MESSAGES_PER_CHAT:], exhaustive)
+        self._rings[chat_id] = ring
+        self._bytes += ring.bytes
+        self._evict()
+
+    # --- write-through ---------------------------------------------------
+
+    def _writing(self, chat_id: int) -> Optional[ChatRing]:
+        state = self._fills.get(chat_id)
+        if state is not None:
+            state[1] += 1
+        return self._rings.get(chat_id)
+
+    def _replace(self, ring: ChatRing, index: int, entry: dict):
+        size = _size(entry)
+        self._bytes += size - ring.sizes[index]
+        ring.entries[index] = entry
+        ring.sizes[index] = size
+
+    def add_message(self, chat_id: int, entry: dict):
+        ring = self._writing(chat_id)
+        if ring is None:
+            return
+        ring.entries.append(entry)
+        ring.sizes.append(_size(entry))
+        self._bytes += ring.sizes[-1]
+        while len(ring.entries) > settings.RECENT_MESSAGES_PER_CHAT:
+            ring.entries.pop(0)
+            self._bytes -= ring.sizes.pop(0)
+            ring.exhaustive = False
+        self._evict()
+
+    def remove_messages(self, chat_id: int, message_ids: Iterable[int]):
+        ring = self._writing(chat_id)
+        if ring is None:
+            return
+        for message_id in message_ids:
+            index = ring.find(message_id)
+            if index >= 0:
+                del ring.entries[index]
+                self._bytes -= ring.sizes.pop(index)
+
+    def set_reaction(self, chat_id: int, message_id: int, user_id: int, reaction: Optional[dict], counts: List[Tuple[str, int]]):
+        ring = self._writing(chat_id)
+        index = ring.find(message_id) if ring else -1
+        if index < 0:
+            return
+        entry = ring.entries[index]
+        reactions = [r for r in entry["reactions"] if r["user_id"] != user_id]
+        if reaction is not None:
+            reactions.append(reaction)
+        summary = [{"emoji": e, "count": c, "reacted_by_me": False} for e, c in counts]
+        self._replace(ring, index, {**entry, "reactions": reactions, "reaction_summary": summary})
+
+    def add_reads(self, chat_id: int, message_ids: Iterable[int], user_id: int, read_at: datetime):
+        ring = self._writing(chat_id)
+        if ring is None:
+            return
+        read_at = json_datetime(read_at)
+        for message_id in message_ids:
+            index = ring.find(message_id)
+            if index >= 0:
+                entry = ring.entries[index]
+                if all(r["user_id"] != user_id for r in entry["read_by"]):
+                    read_by = entry["read_by"] + [{"user_id": user_id, "read_at": read_at}]
+                    self._replace(ring, index, {**entry, "read_by": read_by, "read_count": entry["read_count"] + 1})
+
+    def set_read_counts(self, chat_id: int, counts: Dict[int, int]):
+        ring = self._writing(chat_id)
+        if ring is None:
+            return
+        for message_id, read_count in counts.items():
+            index = ring.find(message_id)
+            if index >= 0 and ring.entries[index]["read_count"] != read_count:
+                self._replace(ring, index, {**ring.entries[index], "read_count": read_count})
+
+    def set_member(self, chat_id: int, user_id: int, is_member: bool):
+        ring = self._writing(chat_id)
+        if ring is None:
+            return
+        was_large = len(ring.member_ids) > settings.LARGE_GROUP_THRESHOLD
+        if is_member:
+            ring.member_ids.add(user_id)
+        else:
+            ring.member_ids.discard(user_id)
+        if (len(ring.member_ids) > settings.LARGE_GROUP_THRESHOLD) != was_large:
+            # Entries are loaded with or without read_by depending on the size
+            self.drop_chat(chat_id)
+
+    def drop_chat(self, chat_id: int):
+        self._writing(chat_id)
+        ring = self._rings.pop(chat_id, None)
+        if ring is not None:
+            self._bytes -= ring.bytes
+
+    def clear(self):
+        for state in self._fills.values():
+            state[1] += 1
+        self._rings.clear()
+        self._bytes = 0
+
+    def _evict(self):
+        while self._bytes > settings.RECENT_MESSAGES_MAX_BYTES and self._rings:
+            _, ring = self._rings.popitem(last=False)
+            self._bytes -= ring.bytes
+
+    def stats(self) -> dict:
+        return {"chats": len(self._rings), "bytes": self._bytes}
+
+
+recent_messages = RecentMessages()
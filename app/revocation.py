@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict
+
+from sqlalchemy import delete, select
+
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import RefreshToken, RevokedSession
+from .rate_limit import prune_buckets
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class RevocationList:
+    """Sessions whose access tokens must be refused before they expire.
+
+    Lookups are a dict hit, so they run on every request and WS connect instead of
+    a user query. Entries are only needed until the last access token of the
+    session has expired, which keeps the set as small as the logouts of one
+    ACCESS_TOKEN_EXPIRE_MINUTES window. revoked_sessions persists it: every worker
+    loads it on startup and merges in the others' revocations periodically.
+    """
+
+    def __init__(self):
+        # session_id -> unix time after which no token of it is valid anyway
+        self._revoked: Dict[str, float] = {}
+        self._last_prune = 0.0
+
+    def is_revoked(self, session_id: str) -> bool:
+        expires = self._revoked.get(session_id)
+        return expires is not None and expires > time.time()
+
+    def add(self, session_id: str, expires_at: datetime):
+        self._revoked[session_id] = _timestamp(expires_at)
+
+    async def load(self):
+        now = datetime.now(timezone.utc)
+        async with AsyncSessionLocal() as db:
+            stmt = select(RevokedSession.session_id, RevokedSession.expires_at).where(RevokedSession.expires_at > now)
+            rows = (await db.execute(stmt)).all()
+
+            if time.monotonic() - self._last_prune > 300:
+                await db.execute(delete(RevokedSession).where(RevokedSession.expires_at <= now))
+                await db.execute(delete(RefreshToken).where(RefreshToken.expires_at <= now))
+                await prune_buckets(db)
+                await db.commit()
+                self._last_prune = time.monotonic()
+
+        cutoff = time.time()
+        self._revoked = {sid: exp for sid, exp in self._revoked.items() if exp > cutoff}
+        for session_id, expires_at in rows:
+            self.add(session_id, expires_at)
+
+    async def run_sync(self):
+        while True:
+            await asyncio.sleep(settings.REVOCATION_SYNC_INTERVAL_SECONDS)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Failed to sync revoked sessions: {e}")
+
+
+revocation_list = RevocationList()
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
+from fastapi.responses import StreamingResponse
+import json
 from sqlalchemy.ext.asyncio import AsyncSession
-from ..database import get_db
+from ..database import get_db, pool_status
 from ..models import User
 from ..auth import verify_admin_access, get_current_admin_user
-from ..services import admin_service, user_service
+from ..services import admin_service, user_service, export_service, import_service
 
 router = APIRouter(tags=["admin"])
 
@@ -11,6 +13,11 @@ router = APIRouter(tags=["admin"])
 async def get_status(current_admin: User = Depends(get_current_admin_user)):
     return {"status": "ok", "message": "Admin authorization active"}
 
+@router.get("/metrics/db")
+async def get_db_metrics(current_admin: User = Depends(get_current_admin_user)):
+    """Connection pool usage and how long checkouts waited for a connection."""
+    return pool_status()
+
 @router.delete("/messages/clear")
 async def clear_messages(
     current_admin: User = Depends(get_current_admin_user),
@@ -45,3 +52,25 @@ async def wipe_system(
     await admin_service.clear_all_chats(db)
     await user_service.clear_all_avatars(db)
     return {"status": "success", "message": "All messages, files, chats, and avatars have been cleared"}
+
+@router.get("/chats/{chat_id}/export")
+async def export_chat(
+    chat_id: int,
+    format: str = Query("ndjson", pattern="^(ndjson|zip)$"),
+    current_admin: User = Depends(get_current_admin_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if not await export_service.can_export(db, chat_id, None):
+        raise HTTPException(status_code=404, detail="Chat not found")
+    return export_service.export_response(chat_id, format)
+
+@router.post("/import")
+async def import_history(
+    file: UploadFile = File(...),
+    current_admin: User = Depends(get_current_admin_user),
+):
+    """Bulk-load NDJSON chat history; responds with one NDJSON progress report per batch."""
+    async def reports():
+        async for report in import_service.import_history(import_service.iter_lines(file.read)):
+            yield json.dumps(report) + "\n"
+    return StreamingResponse(reports(), media_type="application/x-ndjson")
@@ -7,9 +7,9 @@ from jose import jwt, JWTError
 
 from ..database import get_db
 from ..models import User
-from ..schemas import UserCreate, UserOut, LoginResponse, TwoFASetup, TwoFAVerify, UserRegisterConfirm, PasswordlessLogin, PasswordlessLoginRequest
-from ..auth import get_current_user, get_current_admin_user, get_password_hash, create_access_token, SECRET_KEY, ALGORITHM
-from ..services import user_service
+from ..schemas import UserCreate, UserOut, LoginResponse, TwoFASetup, TwoFAVerify, UserRegisterConfirm, PasswordlessLogin, PasswordlessLoginRequest, RefreshRequest
+from ..auth import CurrentUser, get_current_user, get_current_db_user, get_current_admin_user, create_access_token, SECRET_KEY, ALGORITHM
+from ..services import user_service, session_service
 from ..services.otp_service import generate_2fa_secret, get_2fa_uri, verify_2fa_code
 from ..websockets import manager
 from ..limiter import limiter
@@ -102,9 +102,10 @@ async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends
             username=user.username
         )
         
-    token_data = user_service.create_user_token(user)
+    token_data = await session_service.create_session(db, user)
     return LoginResponse(
         access_token=token_data["access_token"],
+        refresh_token=token_data["refresh_token"],
         token_type=token_data["token_type"],
         requires_2fa=False,
         username=user.username
@@ -136,9 +137,10 @@ async def login_2fa(request: Request, data: TwoFAVerify, token: str = Depends(OA
             user.is_2fa_enabled = True
             await db.commit()
             
-        token_data = user_service.create_user_token(user)
+        token_data = await session_service.create_session(db, user)
         return LoginResponse(
             access_token=token_data["access_token"],
+            refresh_token=token_data["refresh_token"],
             token_type=token_data["token_type"],
             requires_2fa=False,
             username=user.username
@@ -176,24 +178,45 @@ async def login_passwordless_verify(request: Request, data: PasswordlessLogin, d
     if not user:
         raise HTTPException(status_code=401, detail="Invalid neural bypass code")
         
-    token_data = user_service.create_user_token(user)
+    token_data = await session_service.create_session(db, user)
     return LoginResponse(
         access_token=token_data["access_token"],
+        refresh_token=token_data["refresh_token"],
         token_type=token_data["token_type"],
         requires_2fa=False,
         username=user.username
     )
 
+@router.post("/refresh", response_model=LoginResponse)
+@limiter.limit("30/minute")
+async def refresh(request: Request, data: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    token_data = await session_service.rotate_session(db, data.refresh_token)
+    if not token_data:
+        raise HTTPException(status_code=401, detail="Refresh token expired or revoked")
+    return LoginResponse(
+        access_token=token_data["access_token"],
+        refresh_token=token_data["refresh_token"],
+        token_type=token_data["token_type"],
+        requires_2fa=False,
+        username=token_data["username"]
+    )
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    await session_service.revoke_session(db, current_user.session_id, current_user.id)
 
+@router.post("/logout/all", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_everywhere(current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    await session_service.revoke_user_sessions(db, current_user.id)
 
 @router.get("/me", response_model=UserOut)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: User = Depends(get_current_db_user)):
     return current_user
 
 @router.post("/me/avatar", response_model=UserOut)
 async def upload_avatar(
     file: UploadFile = FastAPIFile(...),
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_db_user),
     db: AsyncSession = Depends(get_db)
 ):
     user = await user_service.update_user_avatar(db, current_user, file, file.filename)
@@ -202,7 +225,7 @@ async def upload_avatar(
 
 @router.delete("/me/avatar", response_model=UserOut)
 async def delete_avatar(
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_db_user),
     db: AsyncSession = Depends(get_db)
 ):
     user = await user_service.delete_user_avatar(db, current_user)
@@ -1,52 +1,90 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File as FastAPIFile
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File as FastAPIFile, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Optional
+from typing import List, Optional, Union
 from ..database import get_db
-from ..models import User
-from ..schemas import ChatOut, ChatCreate, UserOut, ChatUpdate, AddMember, StatusResponse, MemberAdminUpdate
-from ..auth import get_current_user
-from ..services import chat_service
+from ..schemas import ChatOut, ChatSummaryOut, ChatSyncOut, ChatMemberPage, ChatCreate, UserOut, ChatUpdate, AddMember, StatusResponse, MemberAdminUpdate
+from ..auth import CurrentUser, get_current_user, get_read_db
+from ..config import settings
+from ..serializers import json_response
+from ..services import chat_service, export_service
 
 router = APIRouter()
 
-@router.get("/chats", response_model=List[ChatOut])
-async def get_chats(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    return await chat_service.get_user_chats(db, current_user.id)
+@router.get("/chats", response_model=Union[List[ChatOut], List[ChatSummaryOut], ChatSyncOut])
+async def get_chats(
+    compact: bool = False,
+    since: Optional[int] = Query(None, ge=0),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    # The plain list stays the default for existing clients; ?since=<X-Chat-Version> syncs incrementally
+    if since is not None:
+        return json_response(await chat_service.get_chat_changes(current_user.id, since, compact))
+    if compact:
+        version, body = await chat_service.get_user_chat_summaries_cached(current_user.id)
+    else:
+        version, body = await chat_service.get_user_chats_cached(current_user.id)
+    response = json_response(body)
+    response.headers["X-Chat-Version"] = str(version)
+    return response
 
 @router.post("/chats/create", response_model=ChatOut)
-async def create_chat(payload: ChatCreate, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def create_chat(payload: ChatCreate, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     chat_out = await chat_service.create_chat(db, payload, current_user.id)
     if not chat_out:
         raise HTTPException(status_code=400, detail="Invalid chat creation parameters")
     return chat_out
 
 @router.get("/users", response_model=List[UserOut])
-async def search_users(q: str = "", current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    return await chat_service.search_users(db, q, current_user.id)
+async def search_users(
+    response: Response,
+    q: str = "",
+    limit: int = Query(20, ge=1, le=settings.USER_SEARCH_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    users, next_cursor = await chat_service.search_users(db, q, current_user.id, limit, cursor)
+    # The body stays a plain list for existing clients; the next page is in a header
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return users
 
 @router.patch("/chats/{chat_id}", response_model=ChatOut)
-async def update_chat(chat_id: int, payload: ChatUpdate, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def update_chat(chat_id: int, payload: ChatUpdate, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     chat = await chat_service.update_chat(db, chat_id, payload.name, payload.avatar_path, current_user.id)
     if not chat:
         raise HTTPException(status_code=403, detail="Forbidden or chat not found")
     return chat
 
 @router.post("/chats/{chat_id}/members", response_model=ChatOut)
-async def add_member(chat_id: int, payload: AddMember, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def add_member(chat_id: int, payload: AddMember, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     chat = await chat_service.add_member(db, chat_id, payload.user_id, current_user.id)
     if not chat:
         raise HTTPException(status_code=403, detail="Forbidden or chat not found")
     return chat
 
+@router.get("/chats/{chat_id}/members", response_model=ChatMemberPage)
+async def get_chat_members(
+    chat_id: int,
+    limit: int = Query(50, ge=1, le=settings.CHAT_MEMBERS_PAGE_MAX_LIMIT),
+    cursor: Optional[int] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    page = await chat_service.get_chat_members_page(db, chat_id, current_user.id, limit, cursor)
+    if page is None:
+        raise HTTPException(status_code=403, detail="Forbidden or chat not found")
+    return page
+
 @router.delete("/chats/{chat_id}/members/{member_id}")
-async def remove_member(chat_id: int, member_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def remove_member(chat_id: int, member_id: int, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     chat = await chat_service.remove_member(db, chat_id, member_id, current_user.id)
     if chat is None:
         return StatusResponse(status="ok", message="Member removed or chat deleted")
     return chat
 
 @router.delete("/chats/{chat_id}")
-async def delete_chat(chat_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def delete_chat(chat_id: int, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     # This deletes the entire chat history for everyone (Private chats only usually)
     success = await chat_service.delete_chat(db, chat_id, current_user.id)
     if not success:
@@ -54,7 +92,7 @@ async def delete_chat(chat_id: int, current_user: User = Depends(get_current_use
     return {"status": "ok"}
 
 @router.post("/chats/{chat_id}/leave")
-async def leave_chat(chat_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def leave_chat(chat_id: int, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     success = await chat_service.remove_member(db, chat_id, current_user.id, current_user.id)
     if success is None:
         if not await chat_service.is_chat_member(db, chat_id, current_user.id):
@@ -66,7 +104,7 @@ async def leave_chat(chat_id: int, current_user: User = Depends(get_current_user
 async def upload_chat_avatar(
     chat_id: int,
     file: UploadFile = FastAPIFile(...),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     chat = await chat_service.update_chat_avatar(db, chat_id, file, file.filename, current_user.id)
@@ -79,7 +117,7 @@ async def update_member_admin(
     chat_id: int,
     member_id: int,
     payload: MemberAdminUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     if member_id != payload.user_id:
@@ -88,3 +126,14 @@ async def update_member_admin(
     if not chat:
         raise HTTPException(status_code=403, detail="Forbidden or chat not found")
     return chat
+
+@router.get("/chats/{chat_id}/export")
+async def export_chat(
+    chat_id: int,
+    format: str = Query("ndjson", pattern="^(ndjson|zip)$"),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if not await export_service.can_export(db, chat_id, current_user.id):
+        raise HTTPException(status_code=403, detail="Forbidden or chat not found")
+    return export_service.export_response(chat_id, format)
@@ -5,7 +5,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 import os
 from ..database import get_db
 from ..schemas import FileOut
-from ..auth import get_current_user
+from ..auth import get_current_user, get_read_db
 from ..services import file_service
 from ..config import settings
 
@@ -20,7 +20,7 @@ async def upload_file(file: UploadFile = FastAPIFile(...), current_user = Depend
 async def download_file(
     file_path: str,
     current_user = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     # Sanitize: only allow the basename to prevent path traversal (e.g. ../../etc/passwd)
     safe_name = os.path.basename(file_path)
@@ -1,70 +1,121 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
+from ..config import settings
+from ..serializers import encode, json_response
 from ..database import get_db
-from ..models import User
-from ..schemas import MessageOut, MessageCreate, BulkDeleteRequest
-from ..auth import get_current_user
-from ..services import message_service
+from ..schemas import MessageOut, MessageCreate, BulkDeleteRequest, MessageSearchPage, ReadReceiptPage
+from ..auth import CurrentUser, get_current_user, get_read_db
+from ..services import message_service, search_service
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Declared before /messages/{chat_id} so "search" isn't parsed as a chat id
+@router.get("/messages/search", response_model=MessageSearchPage)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    chat_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await search_service.search_messages(db, current_user.id, q, chat_id, limit, cursor)
+
 @router.get("/messages/{chat_id}", response_model=List[MessageOut])
-async def get_messages(chat_id: int, offset: int = 0, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    messages = await message_service.get_messages(db, chat_id, current_user.id, offset)
+async def get_messages(chat_id: int, offset: int = 0, current_user: CurrentUser = Depends(get_current_user)):
+    body = await message_service.get_messages_cached(chat_id, current_user.id, offset)
+    if body is None:
+        raise HTTPException(status_code=403, detail="Not a member of this chat")
+    return json_response(body)
+
+@router.get("/messages/{chat_id}/latest", response_model=List[MessageOut])
+async def get_latest_messages(
+    chat_id: int,
+    limit: int = Query(50, ge=1, le=settings.RECENT_MESSAGES_PER_CHAT),
+    current_user: CurrentUser = Depends(get_current_user)
+):
+    messages = await message_service.get_latest_messages(chat_id, current_user.id, limit)
     if messages is None:
         raise HTTPException(status_code=403, detail="Not a member of this chat")
-    return messages
+    return json_response(encode(messages))
 
 @router.post("/messages/send", response_model=MessageOut)
-async def send_message(payload: MessageCreate, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def send_message(payload: MessageCreate, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     message = await message_service.send_message(db, payload, current_user.id)
     if not message:
         raise HTTPException(status_code=403, detail="Not a member of this chat")
     return message
 
 @router.delete("/messages/{message_id}")
-async def delete_message(message_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def delete_message(message_id: int, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     success = await message_service.delete_message(db, message_id, current_user.id)
     if not success:
         raise HTTPException(status_code=404, detail="Message not found or you don't have permission")
     return {"status": "success"}
 
 @router.post("/messages/bulk/delete")
-async def delete_messages_bulk(payload: BulkDeleteRequest, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def delete_messages_bulk(payload: BulkDeleteRequest, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     success = await message_service.delete_messages(db, payload.message_ids, current_user.id)
     if not success:
         raise HTTPException(status_code=400, detail="Failed to delete messages")
     return {"status": "success"}
 
 @router.post("/messages/{message_id}/read")
-async def mark_as_read(message_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def mark_as_read(message_id: int, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     success = await message_service.mark_as_read(db, message_id, current_user.id)
     if not success:
         raise HTTPException(status_code=403, detail="Forbidden or message not found")
     return {"status": "ok"}
 
+@router.get("/messages/{message_id}/reads", response_model=ReadReceiptPage)
+async def get_read_receipts(
+    message_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[int] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    page = await message_service.get_read_receipts(db, message_id, current_user.id, limit, cursor)
+    if page is None:
+        raise HTTPException(status_code=403, detail="Forbidden or message not found")
+    return page
+
 @router.post("/chats/{chat_id}/read")
-async def mark_chat_as_read(chat_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def mark_chat_as_read(chat_id: int, current_user: CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     success = await message_service.mark_all_as_read(db, chat_id, current_user.id)
     if not success:
         raise HTTPException(status_code=403, detail="Forbidden or chat not found")
     return {"status": "ok"}
 
-from ..schemas import ReactionToggle
+from ..schemas import ReactionToggle, ReactionToggleOut, ReactorPage
 from ..services import reaction_service
 
-@router.post("/messages/{message_id}/reactions")
+@router.post("/messages/{message_id}/reactions", response_model=ReactionToggleOut)
 async def toggle_reaction(
     message_id: int, 
     payload: ReactionToggle, 
-    current_user: User = Depends(get_current_user), 
+    current_user: CurrentUser = Depends(get_current_user), 
     db: AsyncSession = Depends(get_db)
 ):
     result = await reaction_service.toggle_reaction(db, message_id, current_user.id, payload.emoji)
     if not result:
         raise HTTPException(status_code=403, detail="Forbidden or message not found")
     return result
+
+@router.get("/messages/{message_id}/reactions", response_model=ReactorPage)
+async def get_reactors(
+    message_id: int,
+    emoji: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[int] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    page = await reaction_service.get_reactors(db, message_id, current_user.id, emoji, limit, cursor)
+    if page is None:
+        raise HTTPException(status_code=403, detail="Forbidden or message not found")
+    return page
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Union
 
 class UserBase(BaseModel):
     username: str = Field(..., min_length=3, max_length=50, description="Unique username")
@@ -42,8 +42,12 @@ class PasswordlessLogin(BaseModel):
 class PasswordlessLoginRequest(BaseModel):
     username: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class LoginResponse(BaseModel):
     access_token: Optional[str] = None
+    refresh_token: Optional[str] = None
     token_type: Optional[str] = None
     requires_2fa: bool = False
     username: Optional[str] = None
@@ -76,6 +80,19 @@ class MessageReactionOut(BaseModel):
     created_at: datetime
     model_config = ConfigDict(from_attributes=True)
 
+class ReactionSummaryOut(BaseModel):
+    emoji: str
+    count: int
+    reacted_by_me: bool = False
+
+class ReactorPage(BaseModel):
+    reactions: List[MessageReactionOut]
+    next_cursor: Optional[int] = None
+
+class ReadReceiptPage(BaseModel):
+    reads: List[MessageReadOut]
+    next_cursor: Optional[int] = None
+
 class MessageReplyOut(BaseModel):
     id: int
     text: Optional[str] = None
@@ -90,14 +107,43 @@ class MessageOut(BaseModel):
     text: Optional[str] = None
     file: Optional[FileOut] = None
     created_at: datetime
+    # Left empty in groups above LARGE_GROUP_THRESHOLD members; read_count is
+    # always set and the readers are paged from GET /messages/{id}/reads
     read_by: List[MessageReadOut] = []
+    read_count: int = 0
+    # Only the requesting user's own reactions; everyone else's are in
+    # reaction_summary and GET /messages/{id}/reactions
     reactions: List[MessageReactionOut] = []
+    reaction_summary: List[ReactionSummaryOut] = []
     reply_to: Optional[MessageReplyOut] = None
     model_config = ConfigDict(from_attributes=True)
 
+class MessageSearchResult(BaseModel):
+    id: int
+    chat_id: int
+    sender_id: int
+    sender_username: str
+    text: Optional[str] = None
+    # HTML: the message text escaped, with the matches wrapped in <b></b>
+    snippet: str
+    rank: float
+    created_at: datetime
+
+class MessageSearchPage(BaseModel):
+    results: List[MessageSearchResult]
+    next_cursor: Optional[str] = None
+
 class ReactionToggle(BaseModel):
     emoji: str
 
+class ReactionToggleOut(BaseModel):
+    message_id: int
+    chat_id: int
+    emoji: str
+    action: str
+    removed: List[str] = []
+    reaction_summary: List[ReactionSummaryOut] = []
+
 class ChatCreate(BaseModel):
     recipient_id: Optional[int] = Field(None, description="For private chats")
     member_ids: Optional[List[int]] = Field(None, description="For group chats")
@@ -115,6 +161,49 @@ class ChatOut(BaseModel):
     unread_count: int = 0
     model_config = ConfigDict(from_attributes=True)
 
+class ChatMemberPreview(BaseModel):
+    id: int
+    username: str
+    avatar_path: Optional[str] = None
+
+class MessagePreview(BaseModel):
+    id: int
+    sender_id: int
+    sender_username: str
+    # Cut to CHAT_PREVIEW_TEXT_LENGTH characters
+    text: Optional[str] = None
+    has_file: bool = False
+    created_at: datetime
+
+class ChatSummaryOut(BaseModel):
+    """Compact chat list entry (GET /chats?compact=true); its size doesn't grow with the group."""
+    id: int
+    name: Optional[str] = None
+    avatar_path: Optional[str] = None
+    is_group: bool = False
+    created_at: datetime
+    member_count: int
+    # A few members other than the requesting user, for avatars and DM names
+    members_preview: List[ChatMemberPreview] = []
+    is_chat_admin: bool = False
+    is_chat_owner: bool = False
+    last_message: Optional[MessagePreview] = None
+    unread_count: int = 0
+
+class ChatSyncOut(BaseModel):
+    """GET /chats?since=<version>: what changed since the client's last sync."""
+    version: int
+    # The client's version was unknown: chats is the whole list, replace local state
+    full: bool = False
+    # ChatSummaryOut with compact=true
+    chats: List[Union[ChatOut, ChatSummaryOut]] = []
+    # Chats the user left, was removed from or that were deleted
+    removed: List[int] = []
+
+class ChatMemberPage(BaseModel):
+    members: List[ChatMemberOut]
+    next_cursor: Optional[int] = None
+
 class ChatUpdate(BaseModel):
     name: Optional[str] = None
     avatar_path: Optional[str] = None
@@ -0,0 +1,153 @@
+"""JSON-ready dicts built straight from ORM rows for the hottest responses.
+
+They produce exactly what MessageOut / ChatOut would dump with mode="json", but
+without instantiating and validating a model per message, member and user.
+Routes return the encoded bytes in a Response, which FastAPI passes through
+without validating it against response_model again.
+"""
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import Response
+from pydantic import BaseModel
+
+from .models import Chat, ChatMember, User
+
+
+def json_datetime(value: Optional[datetime]) -> Optional[str]:
+    # Same format pydantic uses: "Z" for UTC
+    if value is None:
+        return None
+    text = value.isoformat()
+    return text[:-6] + "Z" if text.endswith("+00:00") else text
+
+
+def user_dict(user: User) -> dict:
+    return {
+        "username": user.username,
+        "id": user.id,
+        "email": user.email,
+        "avatar_path": user.avatar_path,
+        "is_admin": bool(user.is_admin),
+        "is_verified": bool(user.is_verified),
+        "is_2fa_enabled": bool(user.is_2fa_enabled),
+        "created_at": json_datetime(user.created_at),
+    }
+
+
+def message_dict(message) -> dict:
+    """A Message row loaded like get_messages does (summary attached), or a MessageOut."""
+    if isinstance(message, BaseModel):
+        return message.model_dump(mode="json")
+    file = message.file
+    reply_to = message.reply_to
+    return {
+        "id": message.id,
+        "chat_id": message.chat_id,
+        "sender_id": message.sender_id,
+        "sender": user_dict(message.sender),
+        "text": message.text,
+        "file": {
+            "id": file.id,
+            "filename": file.filename,
+            "path": file.path,
+            "mime_type": file.mime_type,
+            "size": file.size,
+        } if file else None,
+        "created_at": json_datetime(message.created_at),
+        "read_by": [{"user_id": r.user_id, "read_at": json_datetime(r.read_at)} for r in message.read_by],
+        "read_count": message.read_count or 0,
+        "reactions": [
+            {"id": r.id, "user_id": r.user_id, "emoji": r.emoji, "created_at": json_datetime(r.created_at)}
+            for r in message.reactions
+        ],
+        "reaction_summary": [s.model_dump() for s in message.reaction_summary],
+        "reply_to": {
+            "id": reply_to.id,
+            "text": reply_to.text,
+            "sender": user_dict(reply_to.sender),
+        } if reply_to else None,
+    }
+
+
+class MemberFragments:
+    """Member dicts for one response; a user in many chats is serialized once."""
+
+    def __init__(self):
+        self._users: Dict[int, dict] = {}
+
+    def member(self, cm: ChatMember) -> dict:
+        base = self._users.get(cm.user_id)
+        if base is None:
+            base = self._users[cm.user_id] = user_dict(cm.user)
+        return {**base, "is_chat_admin": bool(cm.is_admin), "is_chat_owner": bool(cm.is_owner)}
+
+
+def chat_dict(
+    chat: Chat,
+    members: Iterable[ChatMember],
+    last_message,
+    unread_count: int,
+    fragments: Optional[MemberFragments] = None,
+) -> dict:
+    fragments = fragments or MemberFragments()
+    return {
+        "id": chat.id,
+        "name": chat.name,
+        "avatar_path": chat.avatar_path,
+        "is_group": bool(chat.is_group),
+        "created_at": json_datetime(chat.created_at),
+        "members": [fragments.member(cm) for cm in members],
+        "last_message": message_dict(last_message) if last_message is not None else None,
+        "unread_count": unread_count,
+    }
+
+
+def message_preview_dict(
+    message_id: int, sender_id: int, sender_username: str, text: Optional[str], has_file: bool, created_at: datetime
+) -> dict:
+    return {
+        "id": message_id,
+        "sender_id": sender_id,
+        "sender_username": sender_username,
+        "text": text,
+        "has_file": has_file,
+        "created_at": json_datetime(created_at),
+    }
+
+
+def chat_summary_dict(
+    chat: Chat,
+    membership: ChatMember,
+    member_count: int,
+    preview: List[dict],
+    last_message: Optional[dict],
+    unread_count: int,
+) -> dict:
+    return {
+        "id": chat.id,
+        "name": chat.name,
+        "avatar_path": chat.avatar_path,
+        "is_group": bool(chat.is_group),
+        "created_at": json_datetime(chat.created_at),
+        "member_count": member_count,
+        "members_preview": preview,
+        "is_chat_admin": bool(membership.is_admin),
+        "is_chat_owner": bool(membership.is_owner),
+        "last_message": last_message,
+        "unread_count": unread_count,
+    }
+
+
+def encode(content) -> bytes:
+    # Same settings as Starlette's JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+
+def messages_body(messages: List) -> bytes:
+    return encode([m if isinstance(m, dict) else message_dict(m) for m in messages])
@@ -1,14 +1,23 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import delete
+from sqlalchemy import delete, text
 import os
 import shutil
-from ..models import Message, File, User, Chat, ChatMember
+from ..models import Message, File, User, Chat, ChatMember, MessageArchiveSegment
 from ..config import settings
+from . import archive_service
+from ..read_cache import read_cache
+from ..recent_messages import recent_messages
 
 async def clear_all_messages(db: AsyncSession):
-    """Deletes all messages from the database."""
-    await db.execute(delete(Message))
+    """Deletes all messages from the database and the message archive."""
+    # Truncates every partition plus reads/reactions without per-row cascades or dead tuples
+    await db.execute(text("TRUNCATE messages CASCADE"))
+    archive_paths = await archive_service.chat_archive_paths(db)
+    await db.execute(delete(MessageArchiveSegment))
     await db.commit()
+    read_cache.clear()
+    recent_messages.clear()
+    archive_service.remove_archive_files(archive_paths)
     return {"status": "success", "message": "All messages cleared"}
 
 async def clear_all_files(db: AsyncSession):
@@ -32,13 +41,19 @@ async def clear_all_files(db: AsyncSession):
     # 3. Clear File table in DB
     await db.execute(delete(File))
     await db.commit()
+    read_cache.clear()
+    recent_messages.clear()
     return {"status": "success", "message": "All uploaded files cleared"}
 
 async def clear_all_chats(db: AsyncSession):
     """Deletes all chats and chat members from the database."""
     # Order matters if there are FKs, though Message deletion should happen first
+    archive_paths = await archive_service.chat_archive_paths(db)
     await db.execute(delete(ChatMember))
     await db.execute(delete(Chat))
     await db.commit()
+    read_cache.clear()
+    recent_messages.clear()
+    archive_service.remove_archive_files(archive_paths)
     return {"status": "success", "message": "All chats and members cleared"}
 
@@ -0,0 +1,365 @@
+import asyncio
+import gzip
+import io
+import logging
+import os
+import re
+import shutil
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, func, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import joinedload, selectinload
+
+from ..config import settings
+from ..database import AsyncSessionLocal
+from ..models import Message, MessageArchiveSegment, MessageReaction, MessageReactionCount, MessageRead
+from ..schemas import MessageOut
+from .reaction_service import attach_reaction_summary
+
+logger = logging.getLogger(__name__)
+
+# pg advisory lock held by whichever worker is creating or archiving partitions
+MAINTENANCE_LOCK_KEY = 7_300_437
+_BOUND_RE = re.compile(r"FROM \((?:MINVALUE|'?(-?\d+)'?)\) TO \((?:MAXVALUE|'?(-?\d+)'?)\)")
+
+
+class Partition(NamedTuple):
+    name: str
+    lower: Optional[int]
+    upper: Optional[int]
+
+
+async def is_partitioned(db: AsyncSession) -> bool:
+    stmt = text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'messages'::regclass")
+    return (await db.execute(stmt)).scalar() is not None
+
+
+async def _partitions(db: AsyncSession) -> List[Partition]:
+    stmt = text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'messages'::regclass"
+    )
+    partitions = []
+    for name, bound in (await db.execute(stmt)).all():
+        match = _BOUND_RE.search(bound or "")
+        if match:
+            lower, upper = (int(v) if v is not None else None for v in match.groups())
+            partitions.append(Partition(name, lower, upper))
+    return sorted(partitions, key=lambda p: p.lower if p.lower is not None else -1)
+
+
+async def _last_message_id(db: AsyncSession) -> int:
+    # The sequence rather than max(id): bulk imports reserve ids before writing rows
+    stmt = text("SELECT pg_sequence_last_value(pg_get_serial_sequence('messages', 'id')::regclass)")
+    return (await db.execute(stmt)).scalar() or 0
+
+
+async def ensure_partitions(db: AsyncSession, headroom: int = 0):
+    """Create partitions so ids up to MESSAGE_PARTITIONS_AHEAD partitions (plus
+    `headroom` ids) past the current sequence value have somewhere to go.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    partitions = await _partitions(db)
+    if not partitions:
+        return
+    upper = max(p.upper for p in partitions if p.upper is not None)
+    target = await _last_message_id(db) + headroom + settings.MESSAGE_PARTITIONS_AHEAD * settings.MESSAGE_PARTITION_SIZE
+    if upper >= target:
+        return
+    await db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+    # Another worker may have created them while we waited for the lock
+    upper = max(p.upper for p in await _partitions(db) if p.upper is not None)
+    while upper < target:
+        end = upper + settings.MESSAGE_PARTITION_SIZE
+        await db.execute(text(f"CREATE TABLE messages_p{upper} PARTITION OF messages FOR VALUES FROM ({upper}) TO ({end})"))
+        logger.info(f"Created message partition messages_p{upper} for ids [{upper}, {end})")
+        upper = end
+
+
+class _SegmentWriter:
+    def __init__(self, partition: str, directory: str, chat_id: int, first_message_id: int):
+        self.chat_id = chat_id
+        self.first_message_id = first_message_id
+        self.last_message_id = first_message_id
+        self.count = 0
+        self.path = f"{partition}/chat_{chat_id}.ndjson.gz"
+        self.block_lines = settings.MESSAGE_ARCHIVE_BLOCK_LINES
+        self.block_offsets: List[int] = []
+        self.last_line: Optional[str] = None
+        self._raw = open(os.path.join(directory, f"chat_{chat_id}.ndjson.gz"), "wb")
+        self._block: Optional[gzip.GzipFile] = None
+
+    def _write_lines(self, lines: List[str]):
+        for line in lines:
+            if self._block is None:
+                self.block_offsets.append(self._raw.tell())
+                self._block = gzip.GzipFile(fileobj=self._raw, mode="wb")
+            self._block.write(line.encode("utf-8") + b"\n")
+            self.count += 1
+            if self.count % self.block_lines == 0:
+                self._block.close()
+                self._block = None
+
+    def _close(self):
+        if self._block is not None:
+            self._block.close()
+        self._raw.close()
+
+    async def write(self, messages: List[Message]):
+        lines = [MessageOut.model_validate(m).model_dump_json() for m in messages]
+        await asyncio.to_thread(self._write_lines, lines)
+        self.last_message_id = messages[-1].id
+        self.last_line = lines[-1]
+
+    async def close(self) -> MessageArchiveSegment:
+        await asyncio.to_thread(self._close)
+        return MessageArchiveSegment(
+            chat_id=self.chat_id,
+            first_message_id=self.first_message_id,
+            last_message_id=self.last_message_id,
+            message_count=self.count,
+            path=self.path,
+            block_lines=self.block_lines,
+            block_offsets=self.block_offsets,
+            last_message=self.last_line,
+        )
+
+
+async def archive_partition(partition: Partition) -> bool:
+    """Write a partition's messages to per-chat gzipped NDJSON files, record them
+    in message_archive_segments and drop the partition.
+
+    Reads and reactions of the archived messages are kept inside the archived
+    records and deleted from their tables so the partition can be detached.
+    """
+    lower, upper = partition.lower if partition.lower is not None else 0, partition.upper
+    final_dir = os.path.join(settings.MESSAGE_ARCHIVE_DIR, partition.name)
+    tmp_dir = final_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    async with AsyncSessionLocal() as db:
+        try:
+            if not (await db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY})).scalar():
+                return False
+            # Messages in the partition can't change underneath the export
+            await db.execute(text(f"LOCK TABLE {partition.name} IN SHARE MODE"))
+
+            stmt = (
+                select(Message)
+                .where(Message.id >= lower, Message.id < upper)
+                .order_by(Message.chat_id, Message.id)
+                .options(
+                    joinedload(Message.file),
+                    joinedload(Message.sender),
+                    joinedload(Message.reply_to).joinedload(Message.sender),
+                    selectinload(Message.read_by),
+                    selectinload(Message.reactions),
+                    selectinload(Message.reaction_counts),
+                )
+                .execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+            )
+            segments, writer = [], None
+            result = await db.stream_scalars(stmt)
+            async for batch in result.partitions():
+                attach_reaction_summary(batch, None)
+                start = 0
+                for i in range(1, len(batch) + 1):
+                    if i < len(batch) and batch[i].chat_id == batch[start].chat_id:
+                        continue
+                    run = batch[start:i]
+                    if writer is None or writer.chat_id != run[0].chat_id:
+                        if writer is not None:
+                            segments.append(await writer.close())
+                        writer = _SegmentWriter(partition.name, tmp_dir, run[0].chat_id, run[0].id)
+                    await writer.write(run)
+                    start = i
+                db.expunge_all()
+            if writer is not None:
+                segments.append(await writer.close())
+
+            db.add_all(segments)
+            for model in (MessageRead, MessageReaction, MessageReactionCount):
+                await db.execute(delete(model).where(model.message_id >= lower, model.message_id < upper))
+            # DETACH needs an exclusive lock on messages; give up rather than stall traffic
+            await db.execute(text("SET LOCAL lock_timeout = '5s'"))
+            await db.execute(text(f"ALTER TABLE messages DETACH PARTITION {partition.name}"))
+            await db.execute(text(f"DROP TABLE {partition.name}"))
+
+            os.replace(tmp_dir, final_dir)
+            try:
+                await db.commit()
+            except Exception:
+                shutil.rmtree(final_dir, ignore_errors=True)
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    logger.info(f"Archived {partition.name}: {sum(s.message_count for s in segments)} messages in {len(segments)} chats")
+    return True
+
+
+async def maintain_partitions():
+    async with AsyncSessionLocal() as db:
+        if not await is_partitioned(db):
+            return
+        await ensure_partitions(db)
+        await db.commit()
+        if settings.MESSAGE_ARCHIVE_AFTER_DAYS is None:
+            return
+
+        cutoff = datetime.now(timezone.utc) - timedelta(days=settings.MESSAGE_ARCHIVE_AFTER_DAYS)
+        last_id = await _last_message_id(db)
+        archivable = []
+        # Only a prefix of old partitions, so archived ids always precede hot ones
+        for partition in await _partitions(db):
+            if partition.upper is None or partition.upper > last_id:
+                break
+            newest = (await db.execute(text(f"SELECT max(created_at) FROM {partition.name}"))).scalar()
+            if newest is not None and newest >= cutoff:
+                break
+            archivable.append(partition)
+
+    for partition in archivable:
+        if not await archive_partition(partition):
+            break
+
+
+async def run_partition_maintenance():
+    while True:
+        try:
+            await maintain_partitions()
+        except Exception as e:
+            logger.error(f"Message partition maintenance failed: {e}")
+        await asyncio.sleep(settings.MESSAGE_PARTITION_CHECK_INTERVAL_SECONDS)
+
+
+# --- reading archived messages ----------------------------------------------
+
+def _viewer_copy(line: str, user_id: Optional[int]) -> MessageOut:
+    """Archived records hold every reaction; narrow them to the viewer like hot messages."""
+    message = MessageOut.model_validate_json(line)
+    if "read_count" not in message.model_fields_set:
+        # Archived before messages had a read_count
+        message.read_count = len(message.read_by)
+    message.reactions = [r for r in message.reactions if r.user_id == user_id]
+    mine = {r.emoji for r in message.reactions}
+    for summary in message.reaction_summary:
+        summary.reacted_by_me = summary.emoji in mine
+    return message
+
+
+def _skip(f, count: int):
+    for _ in islice(f, count):
+        pass
+
+
+def _open_segment(segment: MessageArchiveSegment, skip: int) -> Tuple[io.TextIOWrapper, io.BufferedReader, int]:
+    """Open the segment at the block holding record `skip`; returns the reader,
+    the underlying file and how many records are left to skip."""
+    raw = open(os.path.join(settings.MESSAGE_ARCHIVE_DIR, segment.path), "rb")
+    if segment.block_offsets:
+        block = min(skip // segment.block_lines, len(segment.block_offsets) - 1)
+        raw.seek(segment.block_offsets[block])
+        skip -= block * segment.block_lines
+    # Reads on through the following blocks (gzip members) to the end
+    return io.TextIOWrapper(gzip.GzipFile(fileobj=raw), encoding="utf-8"), raw, skip
+
+
+async def _iter_segment(segment: MessageArchiveSegment, skip: int = 0, batch_size: int = 1000) -> AsyncIterator[List[str]]:
+    f, raw, skip = await asyncio.to_thread(_open_segment, segment, skip)
+    try:
+        if skip:
+            await asyncio.to_thread(_skip, f, skip)
+        while lines := await asyncio.to_thread(lambda: list(islice(f, batch_size))):
+            yield lines
+    finally:
+        f.close()
+        raw.close()
+
+
+async def _segments(db: AsyncSession, chat_id: int) -> List[MessageArchiveSegment]:
+    stmt = (
+        select(MessageArchiveSegment)
+        .where(MessageArchiveSegment.chat_id == chat_id)
+        .order_by(MessageArchiveSegment.first_message_id)
+    )
+    return list((await db.execute(stmt)).scalars().all())
+
+
+async def archived_count(db: AsyncSession, chat_id: int) -> int:
+    stmt = select(func.coalesce(func.sum(MessageArchiveSegment.message_count), 0)).where(
+        MessageArchiveSegment.chat_id == chat_id
+    )
+    return (await db.execute(stmt)).scalar()
+
+
+async def get_archived_messages(db: AsyncSession, chat_id: int, user_id: int, offset: int, limit: int) -> List[MessageOut]:
+    """The same slice get_messages would return if the archived messages were still hot."""
+    out: List[MessageOut] = []
+    for segment in await _segments(db, chat_id):
+        if offset >= segment.message_count:
+            offset -= segment.message_count
+            continue
+        async for lines in _iter_segment(segment, offset, min(limit - len(out), 1000)):
+            out.extend(_viewer_copy(line, user_id) for line in lines[:limit - len(out)])
+            if len(out) >= limit:
+                return out
+        offset = 0
+    return out
+
+
+async def iter_archived_messages(db: AsyncSession, chat_id: int) -> AsyncIterator[List[MessageOut]]:
+    for segment in await _segments(db, chat_id):
+        async for lines in _iter_segment(segment):
+            yield [_viewer_copy(line, None) for line in lines]
+
+
+async def last_archived_messages(db: AsyncSession, chat_ids: List[int], user_id: Optional[int]) -> Dict[int, MessageOut]:
+    """Latest archived message of each chat, for chats with nothing left in the hot table."""
+    if not chat_ids:
+        return {}
+    latest = (
+        select(MessageArchiveSegment.chat_id, func.max(MessageArchiveSegment.first_message_id))
+        .where(MessageArchiveSegment.chat_id.in_(chat_ids))
+        .group_by(MessageArchiveSegment.chat_id)
+    )
+    stmt = select(MessageArchiveSegment).where(
+        tuple_(MessageArchiveSegment.chat_id, MessageArchiveSegment.first_message_id).in_(latest)
+    )
+    out = {}
+    for segment in (await db.execute(stmt)).scalars().all():
+        last = segment.last_message
+        if last is None:
+            # Archived before segments kept their last record
+            try:
+                async for lines in _iter_segment(segment, max(segment.message_count - 1, 0)):
+                    last = lines[-1]
+            except OSError as e:
+                logger.error(f"Failed to read archive file {segment.path}: {e}")
+                continue
+        if last is not None:
+            out[segment.chat_id] = _viewer_copy(last, user_id)
+    return out
+
+
+async def chat_archive_paths(db: AsyncSession, chat_id: Optional[int] = None) -> List[str]:
+    stmt = select(MessageArchiveSegment.path)
+    if chat_id is not None:
+        stmt = stmt.where(MessageArchiveSegment.chat_id == chat_id)
+    return list((await db.execute(stmt)).scalars().all())
+
+
+def remove_archive_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(os.path.join(settings.MESSAGE_ARCHIVE_DIR, path))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Failed to remove archive file {path}: {e}")
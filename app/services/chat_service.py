@@ -1,22 +1,36 @@
 import os
 import shutil
 import uuid
+import json
+import base64
+import time
 import logging
 import aiofiles
-from typing import List, Optional
+from fastapi import HTTPException
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload, joinedload
-from sqlalchemy import func
+from sqlalchemy.orm import selectinload, joinedload, aliased
+from sqlalchemy import func, case, and_, tuple_, literal
 
 from ..config import settings
-from ..models import Chat, ChatMember, User, Message, MessageRead
-from ..websockets import manager
-from ..schemas import ChatCreate, ChatOut, ChatMemberOut
+from ..models import Chat, ChatMember, User, Message
+from .. import outbox
+from ..database import read_session
+from ..read_cache import read_cache
+from ..read_receipts import is_large_group, read_by_loader
+from ..serializers import MemberFragments, chat_dict, chat_summary_dict, encode, message_preview_dict
+from ..recent_messages import recent_messages
+from .reaction_service import reaction_loader_options, attach_reaction_summary
+from . import archive_service, sync_service, unread_service
+from ..schemas import ChatCreate, ChatOut, ChatMemberOut, ChatMemberPage, UserOut
 from ..ws_types import WSEventType
 
-async def get_user_chats(db: AsyncSession, user_id: int) -> List[ChatOut]:
+async def get_user_chats(db: AsyncSession, user_id: int, since: Optional[int] = None) -> List[dict]:
+    """The user's chats as ChatOut-shaped JSON dicts (see serializers); with
+    `since`, only those that changed for the user after that chat version."""
     # Subquery: get the latest message ID for each chat
     last_msg_subq = (
         select(func.max(Message.id).label("max_id"))
@@ -33,13 +47,14 @@ async def get_user_chats(db: AsyncSession, user_id: int) -> List[ChatOut]:
             selectinload(Chat.members).joinedload(ChatMember.user),
         )
     )
+    if since is not None:
+        stmt = stmt.where(sync_service.changed_since(since))
     result = await db.execute(stmt)
     chats = result.unique().scalars().all()
     
     # Fetch last messages for all chats in a single query
     chat_ids = [chat.id for chat in chats]
     last_messages: dict[int, Message] = {}
-    unread_counts: dict[int, int] = {}
     if chat_ids:
         last_msg_ids_stmt = (
             select(func.max(Message.id).label("msg_id"), Message.chat_id)
@@ -48,59 +63,171 @@ async def get_user_chats(db: AsyncSession, user_id: int) -> List[ChatOut]:
         )
         last_msg_ids_result = await db.execute(last_msg_ids_stmt)
         msg_id_map = {row.chat_id: row.msg_id for row in last_msg_ids_result}
-        
-        if msg_id_map:
+        large_ids = {chat.id for chat in chats if is_large_group(len(chat.members))}
+
+        # Large groups' last messages are loaded without their read receipts
+        for large in (False, True):
+            msg_ids = [msg_id for chat_id, msg_id in msg_id_map.items() if (chat_id in large_ids) == large]
+            if not msg_ids:
+                continue
             msgs_stmt = (
                 select(Message)
-                .where(Message.id.in_(msg_id_map.values()))
+                .where(Message.id.in_(msg_ids))
                 .options(
                     joinedload(Message.sender), 
                     joinedload(Message.file),
                     joinedload(Message.reply_to).joinedload(Message.sender),
-                    selectinload(Message.read_by),
-                    selectinload(Message.reactions)
+                    read_by_loader(large),
+                    *reaction_loader_options(user_id)
                 )
+                .execution_options(populate_existing=True)
             )
             msgs_result = await db.execute(msgs_stmt)
             for msg in msgs_result.unique().scalars().all():
                 last_messages[msg.chat_id] = msg
+        attach_reaction_summary(last_messages.values(), user_id)
 
-        unread_stmt = (
-            select(Message.chat_id, func.count(Message.id).label("unread_count"))
-            .outerjoin(MessageRead, (Message.id == MessageRead.message_id) & (MessageRead.user_id == user_id))
-            .where(Message.chat_id.in_(chat_ids))
-            .where(Message.sender_id != user_id)
-            .where(MessageRead.id == None)
-            .group_by(Message.chat_id)
-        )
-        unread_result = await db.execute(unread_stmt)
-        for row in unread_result:
-            unread_counts[row.chat_id] = row.unread_count
+        missing = [chat_id for chat_id in chat_ids if chat_id not in last_messages]
+        for chat_id, msg in (await archive_service.last_archived_messages(db, missing, user_id)).items():
+            if chat_id in large_ids:
+                msg.read_by = []
+            last_messages[chat_id] = msg
 
+    fragments = MemberFragments()
     out = []
     for chat in chats:
-        members = []
-        for cm in chat.members:
-            m_out = ChatMemberOut.model_validate(cm.user)
-            m_out.is_chat_admin = cm.is_admin
-            m_out.is_chat_owner = cm.is_owner
-            members.append(m_out)
-            
-        last_msg = last_messages.get(chat.id)
-        unread_count = unread_counts.get(chat.id, 0)
-        
-        out.append(ChatOut(
-            id=chat.id,
-            name=chat.name,
-            avatar_path=chat.avatar_path,
-            is_group=chat.is_group,
-            created_at=chat.created_at,
-            members=members,
-            last_message=last_msg,
-            unread_count=unread_count
-        ))
+        unread_count = next((cm.unread_count for cm in chat.members if cm.user_id == user_id), 0)
+        out.append(chat_dict(chat, chat.members, last_messages.get(chat.id), unread_count, fragments))
     return out
 
+async def get_user_chat_summaries(db: AsyncSession, user_id: int, since: Optional[int] = None) -> List[dict]:
+    """The user's chats as ChatSummaryOut dicts: counts and previews instead of
+    member lists and full messages, so a chat costs the same whatever its size."""
+    stmt = (
+        select(Chat, ChatMember)
+        .join(ChatMember, ChatMember.chat_id == Chat.id)
+        .where(ChatMember.user_id == user_id)
+    )
+    if since is not None:
+        stmt = stmt.where(sync_service.changed_since(since))
+    rows = (await db.execute(stmt)).all()
+    chat_ids = [chat.id for chat, _ in rows]
+    if not chat_ids:
+        return []
+
+    stmt = (
+        select(ChatMember.chat_id, func.count(ChatMember.id))
+        .where(ChatMember.chat_id.in_(chat_ids))
+        .group_by(ChatMember.chat_id)
+    )
+    member_counts = dict((await db.execute(stmt)).all())
+
+    position = func.row_number().over(partition_by=ChatMember.chat_id, order_by=ChatMember.id).label("position")
+    ranked = (
+        select(ChatMember.chat_id, User.id, User.username, User.avatar_path, position)
+        .join(User, User.id == ChatMember.user_id)
+        .where(ChatMember.chat_id.in_(chat_ids), ChatMember.user_id != user_id)
+        .subquery()
+    )
+    stmt = (
+        select(ranked.c.chat_id, ranked.c.id, ranked.c.username, ranked.c.avatar_path)
+        .where(ranked.c.position <= settings.CHAT_PREVIEW_MEMBERS)
+        .order_by(ranked.c.chat_id, ranked.c.position)
+    )
+    previews: dict[int, list] = {}
+    for row in await db.execute(stmt):
+        previews.setdefault(row.chat_id, []).append(
+            {"id": row.id, "username": row.username, "avatar_path": row.avatar_path}
+        )
+
+    last_ids = (
+        select(func.max(Message.id))
+        .where(Message.chat_id.in_(chat_ids))
+        .group_by(Message.chat_id)
+    )
+    stmt = (
+        select(
+            Message.id, Message.chat_id, Message.sender_id, User.username,
+            func.substr(Message.text, 1, settings.CHAT_PREVIEW_TEXT_LENGTH).label("text"),
+            Message.file_id, Message.created_at,
+        )
+        .join(User, User.id == Message.sender_id)
+        .where(Message.id.in_(last_ids))
+    )
+    last_messages = {
+        row.chat_id: message_preview_dict(row.id, row.sender_id, row.username, row.text, row.file_id is not None, row.created_at)
+        for row in await db.execute(stmt)
+    }
+    missing = [chat_id for chat_id in chat_ids if chat_id not in last_messages]
+    for chat_id, m in (await archive_service.last_archived_messages(db, missing, user_id)).items():
+        text = m.text[:settings.CHAT_PREVIEW_TEXT_LENGTH] if m.text else m.text
+        last_messages[chat_id] = message_preview_dict(m.id, m.sender_id, m.sender.username, text, m.file is not None, m.created_at)
+
+    return [
+        chat_summary_dict(
+            chat, cm, member_counts.get(chat.id, 0), previews.get(chat.id, []),
+            last_messages.get(chat.id), cm.unread_count,
+        )
+        for chat, cm in rows
+    ]
+
+async def get_user_chat_summaries_cached(user_id: int) -> Tuple[int, bytes]:
+    async def load():
+        async with read_session(user_id) as db:
+            version = await sync_service.get_chat_version(db)
+            return version, encode(await get_user_chat_summaries(db, user_id))
+    return await read_cache.get(("chat_summaries", user_id), [f"user:{user_id}"], load)
+
+async def get_chat_changes(user_id: int, since: int, compact: bool = False) -> bytes:
+    """ChatSyncOut body for GET /chats?since: chats changed at or after `since`
+    plus the ids of chats the user lost. A `since` ahead of the current version
+    (e.g. after a database restore) gets the full list with "full": true."""
+    async with read_session(user_id) as db:
+        # Read first: a change committed meanwhile is at worst sent again next time
+        version = await sync_service.get_chat_version(db)
+        full = since > version
+        if not full and await sync_service.get_newest_change(db, user_id) < since:
+            return encode({"version": version, "full": False, "chats": [], "removed": []})
+        load = get_user_chat_summaries if compact else get_user_chats
+        chats = await load(db, user_id, None if full else since)
+        removed = [] if full else await sync_service.get_removed_chats(db, user_id, since)
+    return encode({"version": version, "full": full, "chats": chats, "removed": removed})
+
+async def get_chat_members_page(
+    db: AsyncSession, chat_id: int, user_id: int, limit: int = 50, cursor: Optional[int] = None
+) -> Optional[ChatMemberPage]:
+    """Page through a chat's members in join order; None if the user isn't one."""
+    if not await is_chat_member(db, chat_id, user_id):
+        return None
+    stmt = (
+        select(ChatMember)
+        .where(ChatMember.chat_id == chat_id)
+        .options(joinedload(ChatMember.user))
+    )
+    if cursor:
+        stmt = stmt.where(ChatMember.id > cursor)
+    stmt = stmt.order_by(ChatMember.id.asc()).limit(limit + 1)
+    rows = list((await db.execute(stmt)).scalars().all())
+
+    members = []
+    for cm in rows[:limit]:
+        m_out = ChatMemberOut.model_validate(cm.user)
+        m_out.is_chat_admin = cm.is_admin
+        m_out.is_chat_owner = cm.is_owner
+        members.append(m_out)
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return ChatMemberPage(members=members, next_cursor=next_cursor)
+
+async def get_user_chats_cached(user_id: int) -> Tuple[int, bytes]:
+    """get_user_chats encoded as a JSON body, with the user's chat version read
+    before it, through the read cache; concurrent identical requests share one
+    query set and cache hits skip encoding too."""
+    async def load():
+        async with read_session(user_id) as db:
+            version = await sync_service.get_chat_version(db)
+            return version, encode(await get_user_chats(db, user_id))
+    return await read_cache.get(("chats", user_id), [f"user:{user_id}"], load)
+
 async def create_chat(db: AsyncSession, payload: ChatCreate, creator_id: int) -> Optional[ChatOut]:
     chat_id = None
     
@@ -120,7 +247,7 @@ async def create_chat(db: AsyncSession, payload: ChatCreate, creator_id: int) ->
             is_creator = (m_id == creator_id)
             db.add(ChatMember(chat_id=chat_id, user_id=m_id, is_admin=is_creator, is_owner=is_creator))
         
-        await db.commit()
+        await db.flush()
     else:
         if not payload.recipient_id or payload.recipient_id == creator_id:
             return None
@@ -146,7 +273,7 @@ async def create_chat(db: AsyncSession, payload: ChatCreate, creator_id: int) ->
             chat_id = new_chat.id
             db.add(ChatMember(chat_id=chat_id, user_id=creator_id))
             db.add(ChatMember(chat_id=chat_id, user_id=payload.recipient_id))
-            await db.commit()
+            await db.flush()
 
     if not chat_id:
         return None
@@ -163,16 +290,147 @@ async def create_chat(db: AsyncSession, payload: ChatCreate, creator_id: int) ->
             "data": chat_out.model_dump(mode='json')
         }
         member_ids = [m.id for m in chat_out.members]
-        await manager.broadcast_to_chat(ws_msg, member_ids)
+        outbox.enqueue(db, ws_msg, member_ids)
+        await sync_service.chat_changed(db, chat_id)
+    await db.commit()
+    if chat_out:
+        read_cache.invalidate_chat(chat_id, member_ids)
 
     return chat_out
 
-async def search_users(db: AsyncSession, query: str, exclude_user_id: int):
-    # Escape SQL LIKE wildcards    # Use explicit escape character
-    safe_query = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
-    stmt = select(User).where(User.username.ilike(f"%{safe_query}%", escape="\\")).where(User.id != exclude_user_id)
-    result = await db.execute(stmt)
-    return result.scalars().all()
+# Short queries can't use the trigram index and match a large share of all users,
+# so their global ranking is cached briefly: query -> (expires_at, ranked users, complete)
+_short_query_cache: "OrderedDict[str, Tuple[float, List[UserOut], bool]]" = OrderedDict()
+
+def _escape_like(query: str) -> str:
+    return query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _match_bucket(username: str, query: str) -> int:
+    # exact > prefix > substring
+    name = username.lower()
+    if name == query:
+        return 0
+    if name.startswith(query):
+        return 1
+    return 2
+
+def _user_sort_key(user: UserOut, query: str, contact_ids: set) -> tuple:
+    return (_match_bucket(user.username, query), 0 if user.id in contact_ids else 1, user.username.lower(), user.id)
+
+def _encode_user_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def _decode_user_cursor(cursor: str) -> tuple:
+    try:
+        bucket, not_shared, name, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (int(bucket), int(not_shared), str(name), int(user_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def search_users(
+    db: AsyncSession,
+    query: str,
+    exclude_user_id: int,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+) -> Tuple[List[UserOut], Optional[str]]:
+    """Type-ahead user search: exact > prefix > substring matches, people who
+    already share a chat with the caller first within each group.
+
+    Returns one page and the cursor for the next one (None on the last page).
+    """
+    query = query.strip().lower()
+    after = _decode_user_cursor(cursor) if cursor else None
+    safe_query = _escape_like(query)
+
+    # Everyone the caller already shares a chat with
+    mine = aliased(ChatMember)
+    theirs = aliased(ChatMember)
+    contacts_subq = (
+        select(theirs.user_id)
+        .join(mine, mine.chat_id == theirs.chat_id)
+        .where(mine.user_id == exclude_user_id)
+    )
+
+    if 0 < len(query) <= settings.USER_SEARCH_CACHE_MAX_QUERY_LENGTH:
+        page = await _search_users_cached(db, query, safe_query, exclude_user_id, contacts_subq, limit, after)
+        if page is not None:
+            return page
+
+    lowered = func.lower(User.username)
+    bucket = case((lowered == query, 0), (lowered.like(f"{safe_query}%", escape="\\"), 1), else_=2)
+    not_shared = case((User.id.in_(contacts_subq), 0), else_=1)
+
+    stmt = (
+        select(User, bucket.label("bucket"), not_shared.label("not_shared"))
+        .where(User.username.ilike(f"%{safe_query}%", escape="\\"))
+        .where(User.id != exclude_user_id)
+    )
+    if after:
+        stmt = stmt.where(tuple_(bucket, not_shared, lowered, User.id) > tuple_(*[literal(v) for v in after]))
+    stmt = stmt.order_by(bucket, not_shared, lowered, User.id).limit(limit + 1)
+
+    rows = (await db.execute(stmt)).all()
+    users = [UserOut.model_validate(row.User) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_user_cursor((last.bucket, last.not_shared, last.User.username.lower(), last.User.id))
+    return users, next_cursor
+
+async def _search_users_cached(db, query, safe_query, exclude_user_id, contacts_subq, limit, after):
+    now = time.monotonic()
+    cached = _short_query_cache.get(query)
+    if cached and cached[0] > now:
+        _short_query_cache.move_to_end(query)
+        ranked, complete = cached[1], cached[2]
+    else:
+        depth = settings.USER_SEARCH_CACHE_DEPTH
+        lowered = func.lower(User.username)
+        bucket = case((lowered == query, 0), (lowered.like(f"{safe_query}%", escape="\\"), 1), else_=2)
+        stmt = (
+            select(User)
+            .where(User.username.ilike(f"%{safe_query}%", escape="\\"))
+            .order_by(bucket, lowered, User.id)
+            .limit(depth + 1)
+        )
+        users = (await db.execute(stmt)).scalars().all()
+        ranked = [UserOut.model_validate(u) for u in users[:depth]]
+        complete = len(users) <= depth
+        _short_query_cache[query] = (now + settings.USER_SEARCH_CACHE_TTL_SECONDS, ranked, complete)
+        while len(_short_query_cache) > settings.USER_SEARCH_CACHE_MAX_ENTRIES:
+            _short_query_cache.popitem(last=False)
+
+    # The caller's matching contacts are few and always fetched fresh
+    stmt = (
+        select(User)
+        .where(User.id.in_(contacts_subq))
+        .where(User.username.ilike(f"%{safe_query}%", escape="\\"))
+    )
+    contacts = [UserOut.model_validate(u) for u in (await db.execute(stmt)).scalars().all()]
+    contact_ids = {u.id for u in contacts}
+
+    merged = {u.id: u for u in ranked}
+    merged.update({u.id: u for u in contacts})
+    candidates = sorted(
+        ((_user_sort_key(u, query, contact_ids), u) for u in merged.values() if u.id != exclude_user_id),
+        key=lambda item: item[0],
+    )
+
+    # Non-contacts past the cached depth are unknown, so the merged order is only
+    # exact up to the last cached user; past that the caller falls back to SQL.
+    if not complete and ranked:
+        boundary = (_match_bucket(ranked[-1].username, query), 1, ranked[-1].username.lower(), ranked[-1].id)
+        candidates = [item for item in candidates if item[0] <= boundary]
+
+    if after:
+        candidates = [item for item in candidates if item[0] > after]
+    if len(candidates) <= limit and not complete:
+        return None
+
+    page = candidates[:limit]
+    next_cursor = _encode_user_cursor(page[-1][0]) if len(candidates) > limit else None
+    return [u for _, u in page], next_cursor
 
 async def update_chat(db: AsyncSession, chat_id: int, name: Optional[str], avatar_path: Optional[str], user_id: int):
     # Check if user is member AND (admin OR owner)
@@ -193,8 +451,9 @@ async def update_chat(db: AsyncSession, chat_id: int, name: Optional[str], avata
     if avatar_path is not None:
         chat.avatar_path = avatar_path
     
+    await sync_service.chat_changed(db, chat_id)
     await db.commit()
-    return await get_chat_out(db, chat_id)
+    return await _chat_out_after_change(db, chat_id)
 
 async def add_member(db: AsyncSession, chat_id: int, member_id: int, user_id: int):
     # Check if caller is member AND admin
@@ -211,7 +470,10 @@ async def add_member(db: AsyncSession, chat_id: int, member_id: int, user_id: in
         return await get_chat_out(db, chat_id)
     
     db.add(ChatMember(chat_id=chat_id, user_id=member_id))
-    await db.commit()
+    await db.flush()
+    await sync_service.chat_joined(db, chat_id, member_id)
+    await unread_service.member_added(db, chat_id, member_id)
+    await sync_service.chat_changed(db, chat_id)
     
     chat_out = await get_chat_out(db, chat_id)
     
@@ -221,7 +483,11 @@ async def add_member(db: AsyncSession, chat_id: int, member_id: int, user_id: in
             "type": "new_chat",
             "data": chat_out.model_dump(mode='json')
         }
-        await manager.broadcast_to_chat(ws_msg, [member_id])
+        outbox.enqueue(db, ws_msg, [member_id])
+    await db.commit()
+    if chat_out:
+        read_cache.invalidate_chat(chat_id, [m.id for m in chat_out.members])
+    recent_messages.set_member(chat_id, member_id, True)
         
     return chat_out
 
@@ -262,14 +528,19 @@ async def remove_member(db: AsyncSession, chat_id: int, member_id: int, user_id:
         return await get_chat_out(db, chat_id)
     
     await db.delete(member)
-    await db.commit()
+    await db.flush()
+    await sync_service.chat_removed(db, chat_id, [member_id])
+    await sync_service.chat_changed(db, chat_id)
     
     # Notify the removed member that they are no longer in this chat
     ws_msg = {
         "type": "chat_deleted",
         "data": {"chat_id": chat_id}
     }
-    await manager.broadcast_to_chat(ws_msg, [member_id])
+    outbox.enqueue(db, ws_msg, [member_id])
+    await db.commit()
+    read_cache.invalidate_chat(chat_id, [member_id])
+    recent_messages.set_member(chat_id, member_id, False)
     
     # Check if any members left
     stmt = select(ChatMember).where(ChatMember.chat_id == chat_id)
@@ -279,7 +550,7 @@ async def remove_member(db: AsyncSession, chat_id: int, member_id: int, user_id:
         await delete_chat(db, chat_id, user_id, force=True)
         return None
 
-    return await get_chat_out(db, chat_id)
+    return await _chat_out_after_change(db, chat_id)
 
 async def delete_chat(db: AsyncSession, chat_id: int, user_id: int, force: bool = False):
     chat_stmt = select(Chat).where(Chat.id == chat_id)
@@ -302,9 +573,10 @@ async def delete_chat(db: AsyncSession, chat_id: int, user_id: int, force: bool
     
     # Get members before deletion
     member_ids = await get_chat_member_ids(db, chat_id)
+    archive_paths = await archive_service.chat_archive_paths(db, chat_id)
     
     await db.delete(chat)
-    await db.commit()
+    await sync_service.chat_removed(db, chat_id, member_ids)
     
     # Broadcast deletion
     if member_ids:
@@ -312,7 +584,11 @@ async def delete_chat(db: AsyncSession, chat_id: int, user_id: int, force: bool
             "type": "chat_deleted",
             "data": {"chat_id": chat_id}
         }
-        await manager.broadcast_to_chat(ws_msg, member_ids)
+        outbox.enqueue(db, ws_msg, member_ids)
+    await db.commit()
+    read_cache.invalidate_chat(chat_id, member_ids)
+    recent_messages.drop_chat(chat_id)
+    archive_service.remove_archive_files(archive_paths)
         
     return True
 
@@ -328,6 +604,7 @@ async def get_chat_out(db: AsyncSession, chat_id: int) -> Optional[ChatOut]:
     chat = result.unique().scalars().first()
     if not chat:
         return None
+    large = is_large_group(len(chat.members))
     
     # Get last message
     stmt = (
@@ -338,12 +615,17 @@ async def get_chat_out(db: AsyncSession, chat_id: int) -> Optional[ChatOut]:
         .options(
             joinedload(Message.sender),
             joinedload(Message.reply_to).joinedload(Message.sender),
-            selectinload(Message.read_by),
-            selectinload(Message.reactions)
+            read_by_loader(large),
+            *reaction_loader_options(None)
         )
     )
     res = await db.execute(stmt)
     last_msg = res.scalars().first()
+    attach_reaction_summary([last_msg], None)
+    if last_msg is None:
+        last_msg = (await archive_service.last_archived_messages(db, [chat_id], None)).get(chat_id)
+        if last_msg is not None and large:
+            last_msg.read_by = []
     
     members = []
     for cm in chat.members:
@@ -365,6 +647,12 @@ async def get_chat_out(db: AsyncSession, chat_id: int) -> Optional[ChatOut]:
     
     return chat_out
 
+async def _chat_out_after_change(db: AsyncSession, chat_id: int) -> Optional[ChatOut]:
+    chat_out = await get_chat_out(db, chat_id)
+    if chat_out:
+        read_cache.invalidate_chat(chat_id, [m.id for m in chat_out.members])
+    return chat_out
+
 async def update_chat_avatar(db: AsyncSession, chat_id: int, file: any, filename: str, user_id: int):
     # Check if user is member AND (admin OR owner)
     stmt = select(ChatMember).where(ChatMember.chat_id == chat_id, ChatMember.user_id == user_id)
@@ -400,8 +688,9 @@ async def update_chat_avatar(db: AsyncSession, chat_id: int, file: any, filename
                 logging.getLogger(__name__).error(f"Error deleting file: {e}")
     
     chat.avatar_path = new_filename
+    await sync_service.chat_changed(db, chat_id)
     await db.commit()
-    return await get_chat_out(db, chat_id)
+    return await _chat_out_after_change(db, chat_id)
 
 async def get_chat_member_ids(db: AsyncSession, chat_id: int) -> List[int]:
     stmt = select(ChatMember.user_id).where(ChatMember.chat_id == chat_id)
@@ -430,5 +719,6 @@ async def set_member_admin(db: AsyncSession, chat_id: int, target_user_id: int,
         return None
     
     target.is_admin = is_admin
+    await sync_service.chat_changed(db, chat_id)
     await db.commit()
-    return await get_chat_out(db, chat_id)
+    return await _chat_out_after_change(db, chat_id)
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import zipfile
+from types import SimpleNamespace
+from typing import AsyncIterator, List, Optional
+
+import aiofiles
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from ..config import settings
+from ..database import AsyncSessionLocal, read_engine
+from ..models import Chat, ChatMember, File, Message, User
+from ..schemas import MessageOut
+from . import archive_service
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ZIP_MEDIA_TYPE = "application/zip"
+
+
+async def can_export(db: AsyncSession, chat_id: int, user_id: Optional[int]) -> bool:
+    """Members may export their chats; user_id=None (admin) only needs the chat to exist."""
+    if user_id is None:
+        stmt = select(Chat.id).where(Chat.id == chat_id)
+    else:
+        stmt = select(ChatMember.id).where(ChatMember.chat_id == chat_id, ChatMember.user_id == user_id)
+    return (await db.execute(stmt)).scalar() is not None
+
+
+def _attachment_name(file_id: int, filename: str) -> str:
+    return f"attachments/{file_id}_{os.path.basename(filename)}"
+
+
+def _message_record(row, with_attachments: bool) -> dict:
+    record = {
+        "id": row.id,
+        "chat_id": row.chat_id,
+        "sender_id": row.sender_id,
+        "sender": row.username,
+        "text": row.text,
+        "reply_to_id": row.reply_to_id,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "file": None,
+    }
+    if row.file_id is not None:
+        record["file"] = {
+            "id": row.file_id,
+            "filename": row.filename,
+            "mime_type": row.mime_type,
+            "size": row.size,
+        }
+        if with_attachments:
+            record["file"]["path"] = _attachment_name(row.file_id, row.filename)
+    return record
+
+
+def _archived_row(message: MessageOut) -> SimpleNamespace:
+    """Shape an archived MessageOut like the hot query's rows."""
+    file = message.file
+    return SimpleNamespace(
+        id=message.id,
+        chat_id=message.chat_id,
+        sender_id=message.sender_id,
+        username=message.sender.username,
+        text=message.text,
+        reply_to_id=message.reply_to.id if message.reply_to else None,
+        created_at=message.created_at,
+        file_id=file.id if file else None,
+        filename=file.filename if file else None,
+        mime_type=file.mime_type if file else None,
+        size=file.size if file else None,
+    )
+
+
+async def _stream_ndjson(db: AsyncSession, chat_id: int, with_attachments: bool = False) -> AsyncIterator[bytes]:
+    # Plain column rows through a server-side cursor: nothing lands in the
+    # identity map, so memory is bounded by one batch however long the chat is.
+    stmt = (
+        select(
+            Message.id, Message.chat_id, Message.sender_id, User.username, Message.text,
+            Message.reply_to_id, Message.created_at,
+            File.id.label("file_id"), File.filename, File.mime_type, File.size,
+        )
+        .outerjoin(User, User.id == Message.sender_id)
+        .outerjoin(File, File.id == Message.file_id)
+        .where(Message.chat_id == chat_id)
+        .order_by(Message.id.asc())
+        .execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+    )
+    async for messages in archive_service.iter_archived_messages(db, chat_id):
+        yield "".join(
+            json.dumps(_message_record(_archived_row(m), with_attachments), ensure_ascii=False) + "\n"
+            for m in messages
+        ).encode()
+
+    result = await db.stream(stmt)
+    async for rows in result.partitions():
+        yield "".join(
+            json.dumps(_message_record(row, with_attachments), ensure_ascii=False) + "\n" for row in rows
+        ).encode()
+
+
+async def export_ndjson(chat_id: int) -> AsyncIterator[bytes]:
+    """One JSON object per message, oldest first.
+
+    Runs on its own session: the request's session is closed before a
+    StreamingResponse body is iterated.
+    """
+    async with AsyncSessionLocal(bind=read_engine()) as db:
+        async for chunk in _stream_ndjson(db, chat_id):
+            yield chunk
+
+
+class _ZipSink:
+    """Write-only, unseekable file object for zipfile; the bytes are drained as they arrive."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+async def export_zip(chat_id: int) -> AsyncIterator[bytes]:
+    """messages.ndjson plus every attachment still on disk, as a streamed zip."""
+    sink = _ZipSink()
+    async with AsyncSessionLocal(bind=read_engine()) as db:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            with zf.open("messages.ndjson", "w", force_zip64=True) as entry:
+                async for chunk in _stream_ndjson(db, chat_id, with_attachments=True):
+                    entry.write(chunk)
+                    yield sink.drain()
+
+            stmt = (
+                select(File.id, File.filename, File.path)
+                .join(Message, Message.file_id == File.id)
+                .where(Message.chat_id == chat_id)
+                .order_by(File.id.asc())
+                .execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+            )
+            files = await db.stream(stmt)
+            async for row in files:
+                file_path = os.path.join(settings.UPLOAD_DIR, row.path)
+                if not os.path.isfile(file_path):
+                    logger.warning(f"Export of chat {chat_id}: attachment {row.id} missing on disk")
+                    continue
+                # Uploads are mostly already compressed, store them as is
+                info = zipfile.ZipInfo(_attachment_name(row.id, row.filename))
+                info.compress_type = zipfile.ZIP_STORED
+                with zf.open(info, "w", force_zip64=True) as entry:
+                    async with aiofiles.open(file_path, "rb") as f:
+                        while chunk := await f.read(settings.EXPORT_ATTACHMENT_CHUNK_BYTES):
+                            entry.write(chunk)
+                            yield sink.drain()
+    yield sink.drain()
+
+
+def export_response(chat_id: int, format: str = "ndjson") -> StreamingResponse:
+    if format == "zip":
+        body, media_type = export_zip(chat_id), ZIP_MEDIA_TYPE
+    else:
+        body, media_type = export_ndjson(chat_id), NDJSON_MEDIA_TYPE
+    filename = f"chat-{chat_id}.{format}"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
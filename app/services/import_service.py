@@ -0,0 +1,356 @@
+import json
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from ..config import settings
+from ..database import AsyncSessionLocal
+from ..read_cache import read_cache
+from ..read_receipts import recount
+from ..recent_messages import recent_messages
+from . import archive_service, unread_service
+from ..models import Chat, ChatMember, Message, MessageReaction, MessageReactionCount, MessageRead, User
+
+logger = logging.getLogger(__name__)
+
+# Record types in dependency order; flushing a type flushes everything before it
+IMPORT_ORDER = ("user", "chat", "member", "message", "reaction", "read")
+# bcrypt never matches this, imported users have to reset their password
+UNUSABLE_PASSWORD = "!"
+
+
+class ImportFormatError(ValueError):
+    def __init__(self, line: int, message: str):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def _parse_time(value: Optional[str]) -> datetime:
+    if not value:
+        return datetime.now(timezone.utc)
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def iter_lines(read: Callable[[int], Awaitable[bytes]], chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines using large reads (one await per chunk, not per line)."""
+    tail = b""
+    while chunk := await read(chunk_size):
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    if tail:
+        yield tail
+
+
+class HistoryImporter:
+    """Bulk loader for chat history exported from another messenger.
+
+    Input is NDJSON, one record per line with a "type" of user, chat, member,
+    message, reaction or read. Records refer to each other by the source
+    system's ids ("id", "chat", "user", "sender", "message", "reply_to"), which
+    are mapped to the new ids as rows are written. Users whose username already
+    exists are merged into the existing account.
+
+    Rows are buffered per type and written in batches with COPY, each batch
+    in its own transaction. Nothing is
+    broadcast over WebSockets.
+    """
+
+    def __init__(self, db: AsyncSession, batch_size: Optional[int] = None):
+        self.db = db
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.ids: Dict[str, Dict[str, int]] = {"user": {}, "chat": {}, "message": {}}
+        self.pending: Dict[str, List[dict]] = {kind: [] for kind in IMPORT_ORDER}
+        # (new message id, source reply_to) for replies to messages not written yet
+        self.forward_replies: List[Tuple[int, str]] = []
+        self.totals = Counter()
+        self.started = time.monotonic()
+
+    async def add(self, record: dict, line: int = 0) -> List[dict]:
+        kind = record.get("type")
+        if kind not in self.pending:
+            raise ImportFormatError(line, f"unknown record type {kind!r}")
+        record["_line"] = line
+        self.pending[kind].append(record)
+        if len(self.pending[kind]) >= self.batch_size:
+            return await self.flush(kind)
+        return []
+
+    async def flush(self, up_to: str = IMPORT_ORDER[-1]) -> List[dict]:
+        reports = []
+        for kind in IMPORT_ORDER[:IMPORT_ORDER.index(up_to) + 1]:
+            batch, self.pending[kind] = self.pending[kind], []
+            if not batch:
+                continue
+            written = await getattr(self, f"_load_{kind}s")(batch)
+            await self.db.commit()
+            self.totals[kind] += written
+            reports.append(self._report(kind, written))
+        return reports
+
+    def _report(self, kind: str, written: int) -> dict:
+        elapsed = time.monotonic() - self.started
+        rows = sum(self.totals.values())
+        report = {
+            "type": "progress",
+            "kind": kind,
+            "rows": written,
+            "total": self.totals[kind],
+            "elapsed": round(elapsed, 3),
+            "rows_per_second": int(rows / elapsed) if elapsed else rows,
+        }
+        logger.info(f"Import: {written} {kind} rows ({self.totals[kind]} total, {report['rows_per_second']} rows/s)")
+        return report
+
+    def _ref(self, kind: str, record: dict, key: str) -> int:
+        ref = record.get(key)
+        try:
+            return self.ids[kind][str(ref)]
+        except KeyError:
+            raise ImportFormatError(record["_line"], f"unknown {kind} {ref!r} in {key!r}")
+
+    # --- writing -------------------------------------------------------------
+
+    async def _reserve_ids(self, model, count: int) -> List[int]:
+        stmt = text(f"SELECT nextval(pg_get_serial_sequence('{model.__tablename__}', 'id')) FROM generate_series(1, :n)")
+        return list((await self.db.execute(stmt, {"n": count})).scalars().all())
+
+    async def _copy(self, model, columns: List[str], rows: List[dict]):
+        conn = await self.db.connection()
+        raw = await conn.get_raw_connection()
+        records = [tuple(row[c] for c in columns) for row in rows]
+        await raw.driver_connection.copy_records_to_table(model.__tablename__, records=records, columns=columns)
+
+    async def _insert_with_ids(self, model, columns: List[str], rows: List[dict]) -> List[int]:
+        """Write rows and return their new ids in input order."""
+        ids = await self._reserve_ids(model, len(rows))
+        for row, new_id in zip(rows, ids):
+            row["id"] = new_id
+        await self._copy(model, ["id", *columns], rows)
+        return ids
+
+    # --- per type loaders ----------------------------------------------------
+
+    async def _load_users(self, batch: List[dict]) -> int:
+        by_name: Dict[str, List[dict]] = {}
+        for record in batch:
+            if not record.get("username"):
+                raise ImportFormatError(record["_line"], "user without username")
+            by_name.setdefault(record["username"], []).append(record)
+
+        stmt = select(User.id, User.username).where(User.username.in_(list(by_name)))
+        existing = {row.username: row.id for row in (await self.db.execute(stmt)).all()}
+
+        new = [records[0] for name, records in by_name.items() if name not in existing]
+        rows = [
+            {
+                "username": r["username"],
+                "email": r.get("email"),
+                "password_hash": r.get("password_hash") or UNUSABLE_PASSWORD,
+                "avatar_path": None,
+                "is_admin": False,
+                "is_verified": bool(r.get("is_verified", True)),
+                "otp_secret": None,
+                "is_2fa_enabled": False,
+                "created_at": _parse_time(r.get("created_at")),
+            }
+            for r in new
+        ]
+        if rows:
+            ids = await self._insert_with_ids(User, list(rows[0]), rows)
+            existing.update(zip((r["username"] for r in new), ids))
+
+        for name, records in by_name.items():
+            for record in records:
+                self.ids["user"][str(record.get("id"))] = existing[name]
+        return len(rows)
+
+    async def _load_chats(self, batch: List[dict]) -> int:
+        rows = [
+            {
+                "name": r.get("name"),
+                "avatar_path": None,
+                "is_group": bool(r.get("is_group", False)),
+                "created_at": _parse_time(r.get("created_at")),
+            }
+            for r in batch
+        ]
+        ids = await self._insert_with_ids(Chat, list(rows[0]), rows)
+        for record, new_id in zip(batch, ids):
+            self.ids["chat"][str(record.get("id"))] = new_id
+        return len(rows)
+
+    async def _load_members(self, batch: List[dict]) -> int:
+        rows, seen = [], set()
+        for r in batch:
+            key = (self._ref("chat", r, "chat"), self._ref("user", r, "user"))
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append({
+                "chat_id": key[0],
+                "user_id": key[1],
+                "is_admin": bool(r.get("is_admin", False)),
+                "is_owner": bool(r.get("is_owner", False)),
+            })
+        await self._copy(ChatMember, list(rows[0]), rows)
+        return len(rows)
+
+    async def _load_messages(self, batch: List[dict]) -> int:
+        message_ids = self.ids["message"]
+        rows = [
+            {
+                "chat_id": self._ref("chat", r, "chat"),
+                "sender_id": self._ref("user", r, "sender"),
+                "text": r.get("text"),
+                "file_id": None,
+                "reply_to_id": message_ids.get(str(r.get("reply_to"))),
+                "created_at": _parse_time(r.get("created_at")),
+            }
+            for r in batch
+        ]
+
+        # Ids are reserved before COPY, so replies within the batch resolve up front
+        await archive_service.ensure_partitions(self.db, headroom=len(rows))
+        ids = await self._reserve_ids(Message, len(rows))
+        message_ids.update((str(r.get("id")), new_id) for r, new_id in zip(batch, ids))
+        for record, row, new_id in zip(batch, rows, ids):
+            row["id"] = new_id
+            if record.get("reply_to") is not None and row["reply_to_id"] is None:
+                row["reply_to_id"] = message_ids.get(str(record["reply_to"]))
+                if row["reply_to_id"] is None:
+                    self.forward_replies.append((new_id, str(record["reply_to"])))
+        await self._copy(Message, list(rows[0]), rows)
+        return len(rows)
+
+    async def resolve_replies(self) -> List[dict]:
+        """Link replies written before the message they answer; call after the last flush.
+
+        Replies whose target never appeared keep no reply_to and are counted in the report.
+        """
+        if not self.forward_replies:
+            return []
+        message_ids = self.ids["message"]
+        replies = [
+            {"id": new_id, "reply_to_id": message_ids[ref]}
+            for new_id, ref in self.forward_replies
+            if ref in message_ids
+        ]
+        unresolved = len(self.forward_replies) - len(replies)
+        self.forward_replies = []
+        for start in range(0, len(replies), self.batch_size):
+            await self.db.execute(update(Message), replies[start:start + self.batch_size])
+            await self.db.commit()
+        self.totals["reply"] += len(replies)
+        report = self._report("reply", len(replies))
+        report["unresolved"] = unresolved
+        if unresolved:
+            logger.warning(f"Import: {unresolved} replies point to messages missing from the file")
+        return [report]
+
+    async def _load_reactions(self, batch: List[dict]) -> int:
+        rows, seen = [], set()
+        for r in batch:
+            key = (self._ref("message", r, "message"), self._ref("user", r, "user"), r.get("emoji"))
+            if not key[2] or key in seen:
+                continue
+            seen.add(key)
+            rows.append({
+                "message_id": key[0],
+                "user_id": key[1],
+                "emoji": key[2],
+                "created_at": _parse_time(r.get("created_at")),
+            })
+        if not rows:
+            return 0
+        await self._copy(MessageReaction, list(rows[0]), rows)
+
+        counts = Counter((row["message_id"], row["emoji"]) for row in rows)
+        stmt = pg_insert(MessageReactionCount)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MessageReactionCount.message_id, MessageReactionCount.emoji],
+            set_={"count": MessageReactionCount.count + stmt.excluded.count},
+        )
+        await self.db.execute(
+            stmt, [{"message_id": m, "emoji": e, "count": n} for (m, e), n in counts.items()]
+        )
+        return len(rows)
+
+    async def _load_reads(self, batch: List[dict]) -> int:
+        rows, seen = [], set()
+        for r in batch:
+            key = (self._ref("message", r, "message"), self._ref("user", r, "user"))
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append({"message_id": key[0], "user_id": key[1], "read_at": _parse_time(r.get("read_at"))})
+        await self._copy(MessageRead, list(rows[0]), rows)
+        # A message's reads may span batches, so count them all again
+        await recount(self.db, list({row["message_id"] for row in rows}))
+        return len(rows)
+
+
+async def import_history(lines: AsyncIterator[bytes], batch_size: Optional[int] = None) -> AsyncIterator[dict]:
+    """Import NDJSON history, yielding a progress report per written batch.
+
+    Batches are committed as they go, so a failed import keeps what was written
+    before the reported error line.
+    """
+    async with AsyncSessionLocal() as db:
+        importer = HistoryImporter(db, batch_size)
+        line_no = 0
+        try:
+            async for line in lines:
+                line_no += 1
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise ImportFormatError(line_no, f"invalid JSON ({e})")
+                if not isinstance(record, dict):
+                    raise ImportFormatError(line_no, "record is not an object")
+                for report in await importer.add(record, line_no):
+                    yield report
+            for report in await importer.flush():
+                yield report
+            for report in await importer.resolve_replies():
+                yield report
+        except ValueError as e:
+            # Format errors carry their line; bad values (timestamps) surface at the batch being read
+            line = getattr(e, "line", line_no)
+            await db.rollback()
+            logger.error(f"Import stopped at line {line}: {e}")
+            yield {"type": "error", "line": line, "error": str(e), "totals": dict(importer.totals)}
+            return
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Import failed near line {line_no}: {e}")
+            yield {"type": "error", "line": line_no, "error": str(getattr(e, "orig", None) or e), "totals": dict(importer.totals)}
+            return
+        finally:
+            # Committed batches may touch chats that cached reads already cover
+            read_cache.clear()
+            recent_messages.clear()
+            # Imported messages and reads bypass the unread counters
+            unread_service.chats_changed(importer.ids["chat"].values())
+
+        elapsed = time.monotonic() - importer.started
+        rows = sum(importer.totals.values())
+        await unread_service.reconcile_changed()
+        yield {
+            "type": "done",
+            "totals": dict(importer.totals),
+            "elapsed": round(elapsed, 3),
+            "rows_per_second": int(rows / elapsed) if elapsed else rows,
+        }
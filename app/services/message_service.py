@@ -8,9 +8,17 @@ import os
 import logging
 from datetime import datetime, timedelta, timezone
 from sqlalchemy import text, and_, not_, insert
+from ..config import settings
 from ..models import Message, ChatMember, User, File, MessageRead
-from ..schemas import MessageCreate
-from ..websockets import manager
+from ..schemas import MessageCreate, MessageReadOut, ReadReceiptPage
+from .. import outbox
+from ..database import AsyncSessionLocal, read_session
+from ..read_cache import read_cache
+from ..read_receipts import is_large_chat, is_large_group, read_by_loader, read_counter
+from ..recent_messages import recent_messages, viewer_copy
+from ..serializers import message_dict, messages_body
+from .reaction_service import reaction_loader_options, attach_reaction_summary
+from . import archive_service, sync_service, unread_service
 from ..ws_types import WSEventType
 
 logger = logging.getLogger(__name__)
@@ -21,6 +29,21 @@ async def get_messages(db: AsyncSession, chat_id: int, user_id: int, offset: int
     result = await db.execute(stmt)
     if not result.scalars().first():
         return None
+    large = await is_large_chat(db, chat_id)
+
+    # Archived partitions hold the oldest messages, so they come first
+    older = []
+    archived = await archive_service.archived_count(db, chat_id)
+    if offset < archived:
+        older = await archive_service.get_archived_messages(db, chat_id, user_id, offset, limit)
+        if large:
+            for message in older:
+                message.read_by = []
+        offset, limit = 0, limit - len(older)
+        if limit <= 0:
+            return older
+    else:
+        offset -= archived
 
     stmt = (
         select(Message)
@@ -28,16 +51,93 @@ async def get_messages(db: AsyncSession, chat_id: int, user_id: int, offset: int
         .options(
             joinedload(Message.file), 
             joinedload(Message.sender),
-            selectinload(Message.read_by),
-            selectinload(Message.reactions),
+            read_by_loader(large),
+            *reaction_loader_options(user_id),
             joinedload(Message.reply_to).joinedload(Message.sender)
         )
         .order_by(Message.created_at.asc())
         .offset(offset)
         .limit(limit)
+        .execution_options(populate_existing=True)
     )
     result = await db.execute(stmt)
-    return result.unique().scalars().all()
+    messages = result.unique().scalars().all()
+    attach_reaction_summary(messages, user_id)
+    return older + list(messages)
+
+async def get_messages_cached(chat_id: int, user_id: int, offset: int = 0, limit: int = 50) -> Optional[bytes]:
+    """get_messages encoded as a JSON body, through the read cache; concurrent
+    identical requests share one query."""
+    async def load():
+        async with read_session(user_id) as db:
+            messages = await get_messages(db, chat_id, user_id, offset, limit)
+        return None if messages is None else messages_body(messages)
+    return await read_cache.get(("messages", chat_id, user_id, offset, limit), [f"chat:{chat_id}"], load)
+
+async def _load_recent(db: AsyncSession, chat_id: int):
+    stmt = select(ChatMember.user_id).where(ChatMember.chat_id == chat_id)
+    member_ids = (await db.execute(stmt)).scalars().all()
+    if not member_ids:
+        return None
+
+    size = settings.RECENT_MESSAGES_PER_CHAT
+    stmt = (
+        select(Message)
+        .where(Message.chat_id == chat_id)
+        .options(
+            joinedload(Message.file),
+            joinedload(Message.sender),
+            read_by_loader(is_large_group(len(member_ids))),
+            # Every reaction, like archived records; copies are narrowed per viewer
+            selectinload(Message.reaction_counts),
+            selectinload(Message.reactions),
+            joinedload(Message.reply_to).joinedload(Message.sender)
+        )
+        .order_by(Message.id.desc())
+        .limit(size)
+        .execution_options(populate_existing=True)
+    )
+    messages = list(reversed((await db.execute(stmt)).unique().scalars().all()))
+    attach_reaction_summary(messages, None)
+    entries = [message_dict(m) for m in messages]
+    # Only matters when the hot messages don't fill the ring
+    archived = await archive_service.archived_count(db, chat_id) if len(entries) < size else 0
+    return member_ids, entries, archived
+
+async def get_latest_messages(chat_id: int, user_id: int, limit: int = 50) -> Optional[List[dict]]:
+    """The newest `limit` messages, oldest first, from the chat's recent-messages ring.
+
+    Queries run only to fill the ring the first time a chat is read (or after it
+    was evicted). The fill reads the primary: a lagging replica could miss a
+    message whose write-through happened before the fill started.
+    """
+    ring = recent_messages.get(chat_id, limit)
+    if ring is None:
+        token = recent_messages.begin_fill(chat_id)
+        loaded = None
+        try:
+            async with AsyncSessionLocal() as db:
+                loaded = await _load_recent(db, chat_id)
+        finally:
+            if loaded is None:
+                recent_messages.finish_fill(token)
+            else:
+                member_ids, entries, archived = loaded
+                exhaustive = len(entries) < settings.RECENT_MESSAGES_PER_CHAT and not archived
+                recent_messages.finish_fill(token, member_ids, entries, exhaustive)
+        if loaded is None or user_id not in member_ids:
+            return None
+        if exhaustive or len(entries) >= limit:
+            return [viewer_copy(e, user_id) for e in entries[-limit:]]
+        # Fewer hot messages than asked for: the rest are archived
+        total = archived + len(entries)
+        async with read_session(user_id) as db:
+            messages = await get_messages(db, chat_id, user_id, max(total - limit, 0), limit)
+        return None if messages is None else [message_dict(m) for m in messages]
+
+    if user_id not in ring.member_ids:
+        return None
+    return ring.latest(user_id, limit)
 
 async def mark_as_read(db: AsyncSession, message_id: int, user_id: int):
     # Verify message exists and user has access to it
@@ -64,13 +164,16 @@ async def mark_as_read(db: AsyncSession, message_id: int, user_id: int):
     # Mark as read
     db_read = MessageRead(message_id=message_id, user_id=user_id)
     db.add(db_read)
-    await db.commit()
     
     # Prepare broadcast
-    read_at = datetime.now(timezone.utc).isoformat()
+    now = datetime.now(timezone.utc)
+    read_at = now.isoformat()
     stmt = select(ChatMember.user_id).where(ChatMember.chat_id == message.chat_id)
     res = await db.execute(stmt)
     member_ids = list(res.scalars().all())
+    # Large groups only hear about the new read_count from read_counter;
+    # the receipt itself goes to the reader's other devices
+    large = is_large_group(len(member_ids))
 
     ws_msg = {
         "type": WSEventType.MESSAGE_READ,
@@ -82,9 +185,43 @@ async def mark_as_read(db: AsyncSession, message_id: int, user_id: int):
         }
     }
     
-    await manager.broadcast_to_chat(ws_msg, member_ids)
+    outbox.enqueue(db, ws_msg, [user_id] if large else member_ids)
+    # Only the reader's unread count changed; others get the receipt as an event
+    await unread_service.messages_read(db, message.chat_id, user_id)
+    await sync_service.chat_changed(db, message.chat_id, [user_id])
+    await db.commit()
+    if large:
+        read_cache.invalidate(f"user:{user_id}")
+    else:
+        read_cache.invalidate_chat(message.chat_id, member_ids)
+        recent_messages.add_reads(message.chat_id, [message_id], user_id, now)
+    read_counter.touch(message.chat_id, [message_id])
     return True
 
+async def get_read_receipts(
+    db: AsyncSession, message_id: int, user_id: int, limit: int = 50, cursor: Optional[int] = None
+) -> Optional[ReadReceiptPage]:
+    """Page through everyone who read a message, in the order they read it."""
+    stmt = (
+        select(Message.id)
+        .join(ChatMember, ChatMember.chat_id == Message.chat_id)
+        .where(Message.id == message_id, ChatMember.user_id == user_id)
+    )
+    if (await db.execute(stmt)).scalar() is None:
+        return None
+
+    stmt = select(MessageRead).where(MessageRead.message_id == message_id)
+    if cursor:
+        stmt = stmt.where(MessageRead.id > cursor)
+    stmt = stmt.order_by(MessageRead.id.asc()).limit(limit + 1)
+    rows = list((await db.execute(stmt)).scalars().all())
+
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return ReadReceiptPage(
+        reads=[MessageReadOut.model_validate(r) for r in rows[:limit]],
+        next_cursor=next_cursor,
+    )
+
 async def mark_all_as_read(db: AsyncSession, chat_id: int, user_id: int):
     # Verify user is in chat
     stmt = select(ChatMember).where(ChatMember.chat_id == chat_id, ChatMember.user_id == user_id)
@@ -109,16 +246,20 @@ async def mark_all_as_read(db: AsyncSession, chat_id: int, user_id: int):
     unread_ids = (await db.execute(unread_stmt)).scalars().all()
     
     if not unread_ids:
+        # Nothing to mark, but clear a counter that drifted
+        await unread_service.chat_read(db, chat_id, user_id)
+        await db.commit()
         return True
 
     # Bulk insert for N+1 performance improvement
     await db.execute(insert(MessageRead), [{"message_id": msg_id, "user_id": user_id} for msg_id in unread_ids])
-    await db.commit()
 
     # Notify members via WS
-    read_at = datetime.now(timezone.utc).isoformat()
+    now = datetime.now(timezone.utc)
+    read_at = now.isoformat()
     stmt = select(ChatMember.user_id).where(ChatMember.chat_id == chat_id)
     member_ids = list((await db.execute(stmt)).scalars().all())
+    large = is_large_group(len(member_ids))
 
     for msg_id in unread_ids:
         ws_msg = {
@@ -130,10 +271,37 @@ async def mark_all_as_read(db: AsyncSession, chat_id: int, user_id: int):
                 "read_at": read_at
             }
         }
-        await manager.broadcast_to_chat(ws_msg, member_ids)
+        outbox.enqueue(db, ws_msg, [user_id] if large else member_ids)
+    await unread_service.chat_read(db, chat_id, user_id)
+    await sync_service.chat_changed(db, chat_id, [user_id])
+    await db.commit()
+    if large:
+        read_cache.invalidate(f"user:{user_id}")
+    else:
+        read_cache.invalidate_chat(chat_id, member_ids)
+        recent_messages.add_reads(chat_id, unread_ids, user_id, now)
+    read_counter.touch(chat_id, unread_ids)
 
     return True
 
+async def _load_sent(db: AsyncSession, message_id: int, sender_id: int, large: bool = False) -> Message:
+    stmt = (
+        select(Message)
+        .where(Message.id == message_id)
+        .options(
+            joinedload(Message.file), 
+            joinedload(Message.sender),
+            read_by_loader(large),
+            *reaction_loader_options(sender_id),
+            joinedload(Message.reply_to).joinedload(Message.sender)
+        )
+        .execution_options(populate_existing=True)
+    )
+    result = await db.execute(stmt)
+    message = result.scalars().first()
+    attach_reaction_summary([message], sender_id)
+    return message
+
 async def send_message(db: AsyncSession, payload: MessageCreate, sender_id: int) -> Message:
     # 2. Verify user is in chat
     stmt = select(ChatMember).where(ChatMember.chat_id == payload.chat_id, ChatMember.user_id == sender_id)
@@ -169,10 +337,10 @@ async def send_message(db: AsyncSession, payload: MessageCreate, sender_id: int)
         dup_result = await db.execute(dup_stmt)
         existing_msg = dup_result.scalars().first()
         if existing_msg:
-            # Already sent, return the existing one to avoid duplicates
-            # We still refetch with eager loading to be safe
-            stmt = select(Message).where(Message.id == existing_msg.id).options(joinedload(Message.file), joinedload(Message.sender))
-            return (await db.execute(stmt)).scalars().first()
+            # Already sent, return the existing one to avoid duplicates; loaded
+            # like a new one so it serializes the same (no lazy loads)
+            large = await is_large_chat(db, payload.chat_id)
+            return await _load_sent(db, existing_msg.id, sender_id, large)
 
     # 4. Create new message
     message = Message(
@@ -183,22 +351,10 @@ async def send_message(db: AsyncSession, payload: MessageCreate, sender_id: int)
         reply_to_id=payload.reply_to_id
     )
     db.add(message)
-    await db.commit()
+    await db.flush()
     
     # Refetch with eager loading
-    stmt = (
-        select(Message)
-        .where(Message.id == message.id)
-        .options(
-            joinedload(Message.file), 
-            joinedload(Message.sender),
-            selectinload(Message.read_by),
-            selectinload(Message.reactions),
-            joinedload(Message.reply_to).joinedload(Message.sender)
-        )
-    )
-    result = await db.execute(stmt)
-    message = result.scalars().first()
+    message = await _load_sent(db, message.id, sender_id)
     
     # Notify via WebSocket
     stmt = select(ChatMember.user_id).where(ChatMember.chat_id == payload.chat_id)
@@ -225,7 +381,9 @@ async def send_message(db: AsyncSession, payload: MessageCreate, sender_id: int)
             } if message.file else None,
             "created_at": message.created_at.isoformat(),
             "read_by": [],
+            "read_count": 0,
             "reactions": [],
+            "reaction_summary": [],
             "reply_to": {
                 "id": message.reply_to.id,
                 "text": message.reply_to.text,
@@ -237,7 +395,12 @@ async def send_message(db: AsyncSession, payload: MessageCreate, sender_id: int)
             } if message.reply_to else None
         }
     }
-    await manager.broadcast_to_chat(ws_msg, list(member_ids))
+    outbox.enqueue(db, ws_msg, member_ids)
+    await unread_service.message_sent(db, payload.chat_id, sender_id)
+    await sync_service.chat_changed(db, payload.chat_id)
+    await db.commit()
+    read_cache.invalidate_chat(payload.chat_id, member_ids)
+    recent_messages.add_message(payload.chat_id, message_dict(message))
     
     return message
 
@@ -266,8 +429,8 @@ async def delete_message(db: AsyncSession, message_id: int, user_id: int) -> boo
                 logger.error(f"Failed to delete file {file_path}: {e}")
         await db.delete(message.file)
 
+    await unread_service.message_deleting(db, message)
     await db.delete(message)
-    await db.commit()
     
     ws_msg = {
         "type": WSEventType.DELETE_MESSAGE,
@@ -276,7 +439,12 @@ async def delete_message(db: AsyncSession, message_id: int, user_id: int) -> boo
             "chat_id": chat_id
         }
     }
-    await manager.broadcast_to_chat(ws_msg, list(member_ids))
+    outbox.enqueue(db, ws_msg, member_ids)
+    # The chat's last message may be the one that went
+    await sync_service.chat_changed(db, chat_id)
+    await db.commit()
+    read_cache.invalidate_chat(chat_id, member_ids)
+    recent_messages.remove_messages(chat_id, [message_id])
     return True
 
 async def delete_messages(db: AsyncSession, message_ids: List[int], user_id: int) -> bool:
@@ -308,10 +476,9 @@ async def delete_messages(db: AsyncSession, message_ids: List[int], user_id: int
                     logger.error(f"Failed to delete file {file_path}: {e}")
             await db.delete(message.file)
         
+        await unread_service.message_deleting(db, message)
         await db.delete(message)
     
-    await db.commit()
-    
     # Broadcast deletions
     for message in messages:
         ws_msg = {
@@ -321,6 +488,12 @@ async def delete_messages(db: AsyncSession, message_ids: List[int], user_id: int
                 "chat_id": message.chat_id
             }
         }
-        await manager.broadcast_to_chat(ws_msg, list(chat_id_to_members[message.chat_id]))
+        outbox.enqueue(db, ws_msg, chat_id_to_members[message.chat_id])
+    for cid in chat_id_to_members:
+        await sync_service.chat_changed(db, cid)
+    await db.commit()
+    for cid, member_ids in chat_id_to_members.items():
+        read_cache.invalidate_chat(cid, member_ids)
+        recent_messages.remove_messages(cid, [m.id for m in messages if m.chat_id == cid])
         
     return True
@@ -1,71 +1,139 @@
+from typing import Iterable, List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from ..models import MessageReaction, Message, ChatMember
-from ..websockets import manager
+from sqlalchemy.orm import selectinload
+from sqlalchemy import text
+from ..models import MessageReaction, MessageReactionCount, Message, ChatMember
+from ..schemas import ReactionSummaryOut, ReactionToggleOut, ReactorPage, MessageReactionOut
+from .. import outbox
+from ..read_cache import read_cache
+from ..recent_messages import recent_messages
 
-async def toggle_reaction(db: AsyncSession, message_id: int, user_id: int, emoji: str):
-    # Check if message exists and user is member of that chat
-    stmt = select(Message.chat_id).where(Message.id == message_id)
-    result = await db.execute(stmt)
-    chat_id = result.scalar()
-    
-    if not chat_id:
-        return None
-        
-    stmt = select(ChatMember).where(ChatMember.chat_id == chat_id, ChatMember.user_id == user_id)
-    result = await db.execute(stmt)
-    if not result.scalars().first():
+def reaction_loader_options(user_id: Optional[int]) -> list:
+    """Eager loads for serializing messages: the per-emoji counts plus only the
+    viewer's own reaction rows, instead of every reaction on the message."""
+    if user_id is None:
+        own = selectinload(Message.reactions.and_(MessageReaction.id.is_(None)))
+    else:
+        own = selectinload(Message.reactions.and_(MessageReaction.user_id == user_id))
+    return [selectinload(Message.reaction_counts), own]
+
+def attach_reaction_summary(messages: Iterable[Message], user_id: Optional[int]):
+    for message in messages:
+        if message is None:
+            continue
+        mine = {r.emoji for r in message.reactions if r.user_id == user_id}
+        message.reaction_summary = [
+            ReactionSummaryOut(emoji=c.emoji, count=c.count, reacted_by_me=c.emoji in mine)
+            for c in sorted(message.reaction_counts, key=lambda c: (-c.count, c.emoji))
+            if c.count > 0
+        ]
+
+# One round trip per tap: membership check, removal of the user's previous
+# reaction, the insert, the count deltas and the resulting totals. Data-modifying
+# CTEs all see the same snapshot, so the totals merge the untouched counts with
+# what the upsert returned. Counts that drop to zero are left in place (and
+# filtered on read) because a sibling CTE can't delete the row it just updated.
+_TOGGLE_SQL = text("""
+WITH target AS (
+    SELECT m.id, m.chat_id,
+           (SELECT array_agg(cm.user_id) FROM chat_members cm WHERE cm.chat_id = m.chat_id) AS member_ids
+    FROM messages m
+    WHERE m.id = :message_id
+      AND EXISTS (SELECT 1 FROM chat_members cm
+                  WHERE cm.chat_id = m.chat_id AND cm.user_id = :user_id)
+),
+removed AS (
+    DELETE FROM message_reactions r
+    USING target t
+    WHERE r.message_id = t.id AND r.user_id = :user_id
+    RETURNING r.emoji
+),
+added AS (
+    INSERT INTO message_reactions (message_id, user_id, emoji)
+    SELECT t.id, CAST(:user_id AS integer), CAST(:emoji AS varchar) FROM target t
+    WHERE NOT EXISTS (SELECT 1 FROM removed WHERE removed.emoji = :emoji)
+    ON CONFLICT ON CONSTRAINT uq_message_reaction_user_emoji DO NOTHING
+    RETURNING id, emoji, created_at
+),
+deltas AS (
+    SELECT emoji, sum(delta) AS delta
+    FROM (SELECT emoji, -1 AS delta FROM removed UNION ALL SELECT emoji, 1 FROM added) d
+    GROUP BY emoji
+),
+changed AS (
+    INSERT INTO message_reaction_counts (message_id, emoji, count)
+    SELECT t.id, d.emoji, d.delta FROM deltas d, target t
+    ON CONFLICT (message_id, emoji)
+    DO UPDATE SET count = message_reaction_counts.count + EXCLUDED.count
+    RETURNING emoji, count
+),
+totals AS (
+    SELECT c.emoji, c.count FROM message_reaction_counts c, target t
+    WHERE c.message_id = t.id AND c.emoji NOT IN (SELECT emoji FROM changed)
+    UNION ALL
+    SELECT emoji, count FROM changed
+)
+SELECT t.chat_id,
+       t.member_ids,
+       (SELECT array_agg(emoji) FROM removed) AS removed,
+       EXISTS (SELECT 1 FROM added) AS added,
+       (SELECT id FROM added) AS added_id,
+       (SELECT created_at FROM added) AS added_at,
+       (SELECT array_agg(emoji ORDER BY count DESC, emoji) FROM totals WHERE count > 0) AS emojis,
+       (SELECT array_agg(count ORDER BY count DESC, emoji) FROM totals WHERE count > 0) AS counts
+FROM target t
+""")
+
+async def _toggle(db: AsyncSession, message_id: int, user_id: int, emoji: str):
+    row = (await db.execute(_TOGGLE_SQL, {"message_id": message_id, "user_id": user_id, "emoji": emoji})).first()
+    if row is None:
         return None
-        
-    # Fetch member IDs for broadcasting
-    stmt = select(ChatMember.user_id).where(ChatMember.chat_id == chat_id)
-    res = await db.execute(stmt)
-    member_ids = list(res.scalars().all())
+    counts = list(zip(row.emojis or [], row.counts or []))
+    reaction = (row.added_id, row.added_at) if row.added else None
+    return row.chat_id, list(row.member_ids or []), list(row.removed or []), reaction, counts
 
-    # Check if a reaction already exists for this user/emoji
-    stmt = select(MessageReaction).where(
-        MessageReaction.message_id == message_id,
-        MessageReaction.user_id == user_id,
-        MessageReaction.emoji == emoji
+async def _reaction_counts(db: AsyncSession, message_id: int) -> List[Tuple[str, int]]:
+    stmt = (
+        select(MessageReactionCount.emoji, MessageReactionCount.count)
+        .where(MessageReactionCount.message_id == message_id, MessageReactionCount.count > 0)
+        .order_by(MessageReactionCount.count.desc(), MessageReactionCount.emoji)
     )
-    result = await db.execute(stmt)
-    existing_reaction = result.scalars().first()
+    return [tuple(r) for r in (await db.execute(stmt)).all()]
 
-    if existing_reaction:
-        # If it's the SAME emoji, toggle it off (standard behavior)
-        await db.delete(existing_reaction)
+async def toggle_reaction(db: AsyncSession, message_id: int, user_id: int, emoji: str) -> Optional[ReactionToggleOut]:
+    toggled = await _toggle(db, message_id, user_id, emoji)
+    if toggled is None:
+        return None
+    chat_id, member_ids, removed, reaction, counts = toggled
+    added = reaction is not None
+    if added:
+        action = "added"
+    elif emoji in removed:
         action = "removed"
     else:
-        # If it's a DIFFERENT emoji, first remove ANY existing reaction by this user
-        # to enforce "one reaction per user" rule
-        delete_stmt = select(MessageReaction).where(
-            MessageReaction.message_id == message_id,
-            MessageReaction.user_id == user_id
-        )
-        delete_result = await db.execute(delete_stmt)
-        for old_react in delete_result.scalars().all():
-            await db.delete(old_react)
-            # We notify clients that the OLD reaction was removed
-            ws_msg_old = {
-                "type": "message_reaction",
-                "data": {
-                    "message_id": message_id,
-                    "chat_id": chat_id,
-                    "user_id": user_id,
-                    "emoji": old_react.emoji,
-                    "action": "removed"
-                }
-            }
-            await manager.broadcast_to_chat(ws_msg_old, member_ids)
+        # An identical tap committed first and our insert hit its row. That
+        # request announces the reaction; the totals are re-read to include it.
+        action = "unchanged"
+        counts = await _reaction_counts(db, message_id)
 
-        # Now add the new one
-        reaction = MessageReaction(message_id=message_id, user_id=user_id, emoji=emoji)
-        db.add(reaction)
-        action = "added"
-    
-    await db.commit()
-    
-    # Broadcast the CURRENT (added) action
+    result = ReactionToggleOut(
+        message_id=message_id,
+        chat_id=chat_id,
+        emoji=emoji,
+        action=action,
+        removed=[e for e in removed if e != emoji],
+        reaction_summary=[
+            ReactionSummaryOut(emoji=e, count=c, reacted_by_me=action != "removed" and e == emoji)
+            for e, c in counts
+        ],
+    )
+    if action == "unchanged" and not result.removed:
+        await db.commit()
+        return result
+
+    # A single frame covers the replaced reaction too: "removed" lists the emojis
+    # the user no longer has and "counts" carries the new totals.
     ws_msg = {
         "type": "message_reaction",
         "data": {
@@ -73,23 +141,50 @@ async def toggle_reaction(db: AsyncSession, message_id: int, user_id: int, emoji
             "chat_id": chat_id,
             "user_id": user_id,
             "emoji": emoji,
-            "action": action
+            "action": result.action,
+            "removed": result.removed,
+            "counts": {e: c for e, c in counts},
         }
     }
-    await manager.broadcast_to_chat(ws_msg, member_ids)
+    outbox.enqueue(db, ws_msg, member_ids)
+    await db.commit()
+    read_cache.invalidate_chat(chat_id, member_ids)
+    if action == "unchanged":
+        # The reaction row we kept isn't ours to describe
+        recent_messages.drop_chat(chat_id)
+        return result
+    if added:
+        reaction = MessageReactionOut(id=reaction[0], user_id=user_id, emoji=emoji, created_at=reaction[1]).model_dump(mode="json")
+    recent_messages.set_reaction(chat_id, message_id, user_id, reaction, counts)
+    return result
+
+async def get_reactors(
+    db: AsyncSession,
+    message_id: int,
+    user_id: int,
+    emoji: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[int] = None,
+) -> Optional[ReactorPage]:
+    """Page through everyone who reacted to a message, oldest reaction first."""
+    stmt = (
+        select(Message.id)
+        .join(ChatMember, ChatMember.chat_id == Message.chat_id)
+        .where(Message.id == message_id, ChatMember.user_id == user_id)
+    )
+    if (await db.execute(stmt)).scalar() is None:
+        return None
+
+    stmt = select(MessageReaction).where(MessageReaction.message_id == message_id)
+    if emoji:
+        stmt = stmt.where(MessageReaction.emoji == emoji)
+    if cursor:
+        stmt = stmt.where(MessageReaction.id > cursor)
+    stmt = stmt.order_by(MessageReaction.id.asc()).limit(limit + 1)
+    rows = list((await db.execute(stmt)).scalars().all())
 
-    # Return eagerly loaded message for Android REST response compatibility
-    from sqlalchemy.orm import joinedload, selectinload
-    
-    msg_stmt = (
-        select(Message)
-        .where(Message.id == message_id)
-        .options(
-            joinedload(Message.file),
-            joinedload(Message.sender),
-            selectinload(Message.read_by),
-            selectinload(Message.reactions)
-        )
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return ReactorPage(
+        reactions=[MessageReactionOut.model_validate(r) for r in rows[:limit]],
+        next_cursor=next_cursor,
     )
-    msg_result = await db.execute(msg_stmt)
-    return msg_result.unique().scalars().first()
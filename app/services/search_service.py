@@ -0,0 +1,113 @@
+import base64
+import html
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, func, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from ..models import Message, ChatMember, User
+from ..schemas import MessageSearchPage, MessageSearchResult
+
+TS_CONFIG = "simple"
+# Matches are marked with private-use characters, then the text is HTML-escaped
+# and only the marks become <b>/</b> (see _markup)
+_START, _STOP = "\ue000", "\ue001"
+HEADLINE_OPTIONS = f'StartSel="{_START}", StopSel="{_STOP}", MaxWords=20, MinWords=6, MaxFragments=2'
+
+
+def _encode_cursor(rank: float, message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{rank!r}:{message_id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        rank, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(rank), int(message_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _markup(snippet: str) -> str:
+    return html.escape(snippet).replace(_START, "<b>").replace(_STOP, "</b>")
+
+
+def _page(results: List[MessageSearchResult], limit: int) -> MessageSearchPage:
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = _encode_cursor(results[-1].rank, results[-1].id)
+    return MessageSearchPage(results=results, next_cursor=next_cursor)
+
+
+async def search_messages(
+    db: AsyncSession,
+    user_id: int,
+    query: str,
+    chat_id: Optional[int] = None,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+) -> MessageSearchPage:
+    """Ranked full-text search over the messages of the caller's chats.
+
+    Results are ordered by (rank desc, id desc) and paginated with an opaque
+    keyset cursor over that pair.
+    """
+    after = _decode_cursor(cursor) if cursor else None
+    if not query.strip():
+        return MessageSearchPage(results=[])
+
+    tsquery = func.websearch_to_tsquery(TS_CONFIG, query)
+    search_vector = literal_column("messages.search_vector")
+    rank = func.ts_rank_cd(search_vector, tsquery)
+
+    # Rank and paginate on the GIN index first; headlines are expensive, so they
+    # are only built for the rows of the page.
+    hits = (
+        select(Message.id.label("id"), rank.label("rank"))
+        .join(ChatMember, and_(ChatMember.chat_id == Message.chat_id, ChatMember.user_id == user_id))
+        .where(search_vector.op("@@")(tsquery))
+    )
+    if chat_id is not None:
+        hits = hits.where(Message.chat_id == chat_id)
+    if after:
+        hits = hits.where(or_(rank < after[0], and_(rank == after[0], Message.id < after[1])))
+    hits = hits.order_by(rank.desc(), Message.id.desc()).limit(limit + 1).subquery()
+
+    stmt = (
+        select(
+            Message.id,
+            Message.chat_id,
+            Message.sender_id,
+            User.username,
+            Message.text,
+            Message.created_at,
+            hits.c.rank,
+            func.ts_headline(
+                TS_CONFIG,
+                # Marks typed into a message must not turn into tags
+                func.replace(func.replace(func.coalesce(Message.text, ""), _START, ""), _STOP, ""),
+                tsquery,
+                HEADLINE_OPTIONS,
+            ).label("snippet"),
+        )
+        .join(hits, hits.c.id == Message.id)
+        .join(User, User.id == Message.sender_id)
+        .order_by(hits.c.rank.desc(), Message.id.desc())
+    )
+    rows = (await db.execute(stmt)).all()
+    results = [
+        MessageSearchResult(
+            id=row.id,
+            chat_id=row.chat_id,
+            sender_id=row.sender_id,
+            sender_username=row.username,
+            text=row.text,
+            snippet=_markup(row.snippet),
+            rank=row.rank,
+            created_at=row.created_at,
+        )
+        for row in rows
+    ]
+    return _page(results, limit)
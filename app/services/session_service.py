@@ -0,0 +1,98 @@
+import hashlib
+import secrets
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from ..auth import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from ..config import settings
+from ..models import RefreshToken, RevokedSession, User
+from ..revocation import revocation_list
+from ..websockets import manager
+
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def _issue(db: AsyncSession, user: User, session_id: str) -> dict:
+    refresh_token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        user_id=user.id,
+        session_id=session_id,
+        token_hash=_hash_token(refresh_token),
+        expires_at=datetime.now(timezone.utc) + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    access_token = create_access_token(
+        data={"sub": user.username, "user_id": user.id, "sid": session_id},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "username": user.username,
+    }
+
+async def create_session(db: AsyncSession, user: User) -> dict:
+    """Start a login session: a short-lived access token plus its refresh token."""
+    tokens = _issue(db, user, str(uuid.uuid4()))
+    await db.commit()
+    return tokens
+
+async def rotate_session(db: AsyncSession, refresh_token: str) -> Optional[dict]:
+    """Trade a refresh token for a new pair; each refresh token works once.
+
+    Presenting an already used token means it was copied, so the whole session
+    is revoked for the legitimate client and the thief alike.
+    """
+    result = await db.execute(select(RefreshToken).where(RefreshToken.token_hash == _hash_token(refresh_token)))
+    row = result.scalars().first()
+    if not row:
+        return None
+
+    now = datetime.now(timezone.utc)
+    # Claim it atomically so two concurrent refreshes can't both succeed
+    claimed = await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.id == row.id, RefreshToken.used_at.is_(None))
+        .values(used_at=now)
+    )
+    if claimed.rowcount != 1:
+        await revoke_session(db, row.session_id, row.user_id)
+        return None
+
+    expires_at = row.expires_at if row.expires_at.tzinfo else row.expires_at.replace(tzinfo=timezone.utc)
+    if expires_at <= now or revocation_list.is_revoked(row.session_id):
+        await db.commit()
+        return None
+
+    user = (await db.execute(select(User).where(User.id == row.user_id))).scalars().first()
+    if not user or not user.is_verified:
+        await db.commit()
+        return None
+
+    # Only the token just used is kept, to detect its reuse
+    await db.execute(
+        delete(RefreshToken)
+        .where(RefreshToken.session_id == row.session_id, RefreshToken.id != row.id, RefreshToken.used_at.is_not(None))
+    )
+    tokens = _issue(db, user, row.session_id)
+    await db.commit()
+    return tokens
+
+async def revoke_session(db: AsyncSession, session_id: str, user_id: int):
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    await db.execute(delete(RefreshToken).where(RefreshToken.session_id == session_id))
+    await db.merge(RevokedSession(session_id=session_id, user_id=user_id, expires_at=expires_at))
+    await db.commit()
+    revocation_list.add(session_id, expires_at)
+    manager.close_session(session_id)
+
+async def revoke_user_sessions(db: AsyncSession, user_id: int):
+    stmt = select(RefreshToken.session_id).where(RefreshToken.user_id == user_id).distinct()
+    for session_id in (await db.execute(stmt)).scalars().all():
+        await revoke_session(db, session_id, user_id)
@@ -0,0 +1,99 @@
+from typing import Iterable, List, Optional
+
+from sqlalchemy import BigInteger, Text, cast, delete, func, insert, literal, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from ..models import Chat, ChatMember, ChatTombstone, User
+
+# Versions come from a clock instead of per-user counters, so a change writes
+# one row and locks nothing beyond it: chats.version for changes every member
+# sees (messages, name, membership), chat_members.version for changes to one
+# member's view (their reads), chat_tombstones.version for lost chats.
+#
+# A change is stamped with its transaction id, and a sync cursor is the xmin
+# of the current snapshot: every transaction below it has finished, so rows
+# stamped >= cursor hold everything a client holding that cursor may not have
+# seen yet. Clients get a chat again at worst, never miss one.
+#
+# The flip side: a transaction left open holds xmin back, and every sync in the
+# meantime resends the chats changed since it began. Keep transactions short
+# (imports commit per batch) and set idle_in_transaction_session_timeout.
+
+
+def _xid(value):
+    return cast(cast(value, Text), BigInteger)
+
+
+def _stamp():
+    return _xid(func.pg_current_xact_id())
+
+
+async def chat_changed(db: AsyncSession, chat_id: int, user_ids: Optional[Iterable[int]] = None):
+    """Record that the chat changed for the given members (default: all); call before committing."""
+    if user_ids is None:
+        await db.execute(
+            update(Chat)
+            .where(Chat.id == chat_id)
+            .values(version=_stamp())
+            .execution_options(synchronize_session=False)
+        )
+        return
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    await db.execute(
+        update(ChatMember)
+        .where(ChatMember.chat_id == chat_id, ChatMember.user_id.in_(user_ids))
+        .values(version=_stamp())
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def chat_removed(db: AsyncSession, chat_id: int, user_ids: Iterable[int]):
+    """Leave tombstones for users who lost the chat (left, removed or deleted)."""
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    await db.execute(delete(ChatTombstone).where(ChatTombstone.chat_id == chat_id, ChatTombstone.user_id.in_(user_ids)))
+    await db.execute(
+        insert(ChatTombstone).from_select(
+            ["user_id", "chat_id", "version"],
+            select(User.id, literal(chat_id), _stamp()).where(User.id.in_(user_ids)),
+        )
+    )
+
+
+async def chat_joined(db: AsyncSession, chat_id: int, user_id: int):
+    await db.execute(delete(ChatTombstone).where(ChatTombstone.chat_id == chat_id, ChatTombstone.user_id == user_id))
+
+
+async def get_chat_version(db: AsyncSession) -> int:
+    """Cursor for the next sync: changes stamped at or after it."""
+    return (await db.execute(select(_xid(func.pg_snapshot_xmin(func.pg_current_snapshot()))))).scalar()
+
+
+async def get_newest_change(db: AsyncSession, user_id: int) -> int:
+    """Newest stamp on anything the user syncs: their memberships, their chats
+    and their tombstones. Index lookups only, for the nothing-changed case."""
+    newest = [
+        select(func.max(ChatMember.version)).where(ChatMember.user_id == user_id),
+        select(func.max(Chat.version)).join(ChatMember, ChatMember.chat_id == Chat.id).where(ChatMember.user_id == user_id),
+        select(func.max(ChatTombstone.version)).where(ChatTombstone.user_id == user_id),
+    ]
+    stmt = select(*(func.coalesce(q.scalar_subquery(), 0) for q in newest))
+    return max((await db.execute(stmt)).one())
+
+
+def changed_since(since: int):
+    """Filter for a query joining Chat and the user's ChatMember row."""
+    return (ChatMember.version >= since) | (Chat.version >= since)
+
+
+async def get_removed_chats(db: AsyncSession, user_id: int, since: int) -> List[int]:
+    stmt = (
+        select(ChatTombstone.chat_id)
+        .where(ChatTombstone.user_id == user_id, ChatTombstone.version >= since)
+        .order_by(ChatTombstone.version)
+    )
+    return list((await db.execute(stmt)).scalars().all())
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import and_, bindparam, case, func, not_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from ..config import settings
+from ..database import AsyncSessionLocal
+from ..models import ChatMember, Message, MessageRead
+
+logger = logging.getLogger(__name__)
+
+# chat_members.unread_count is kept up to date by the writers below, each a
+# single set-based UPDATE in the caller's transaction. It counts the same thing
+# the old per-request query did: messages in the hot table from someone else
+# that the member hasn't read. The reconciliation job recomputes it to repair
+# drift (bulk imports, archived partitions, races), but only for chats written
+# to since its last pass, and only counting past each member's read_through:
+# everything at or below it was read by a mark-all. A message committed below
+# the id a concurrent mark-all saw as newest would be missed by the recount;
+# the next mark-all clears it either way.
+
+# Chats whose counters moved since the last reconciliation pass
+_changed: Set[int] = set()
+
+
+def chats_changed(chat_ids: Iterable[int]):
+    """Queue chats for the next reconciliation pass."""
+    _changed.update(chat_ids)
+
+
+def _unread_query(chat_id, user_id):
+    return (
+        select(func.count(Message.id))
+        .where(Message.chat_id == chat_id, Message.sender_id != user_id)
+        .where(not_(
+            select(MessageRead.id)
+            .where(MessageRead.message_id == Message.id, MessageRead.user_id == user_id)
+            .correlate_except(MessageRead)
+            .exists()
+        ))
+    )
+
+
+async def message_sent(db: AsyncSession, chat_id: int, sender_id: int):
+    _changed.add(chat_id)
+    await db.execute(
+        update(ChatMember)
+        .where(ChatMember.chat_id == chat_id, ChatMember.user_id != sender_id)
+        .values(unread_count=ChatMember.unread_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def messages_read(db: AsyncSession, chat_id: int, user_id: int, count: int = 1):
+    _changed.add(chat_id)
+    await db.execute(
+        update(ChatMember)
+        .where(ChatMember.chat_id == chat_id, ChatMember.user_id == user_id)
+        .values(unread_count=case((ChatMember.unread_count > count, ChatMember.unread_count - count), else_=0))
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def chat_read(db: AsyncSession, chat_id: int, user_id: int):
+    _changed.add(chat_id)
+    newest = func.coalesce(select(func.max(Message.id)).where(Message.chat_id == chat_id).scalar_subquery(), 0)
+    await db.execute(
+        update(ChatMember)
+        .where(ChatMember.chat_id == chat_id, ChatMember.user_id == user_id)
+        .where((ChatMember.unread_count != 0) | (ChatMember.read_through < newest))
+        .values(unread_count=0, read_through=newest)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def message_deleting(db: AsyncSession, message: Message):
+    """Drop the message from its unread counts; call before deleting it (its reads go with it)."""
+    _changed.add(message.chat_id)
+    read = (
+        select(MessageRead.id)
+        .where(MessageRead.message_id == message.id, MessageRead.user_id == ChatMember.user_id)
+        .correlate_except(MessageRead)
+        .exists()
+    )
+    await db.execute(
+        update(ChatMember)
+        .where(
+            ChatMember.chat_id == message.chat_id,
+            ChatMember.user_id != message.sender_id,
+            ChatMember.unread_count > 0,
+            not_(read),
+        )
+        .values(unread_count=ChatMember.unread_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def member_added(db: AsyncSession, chat_id: int, user_id: int):
+    """A new member hasn't read anything that is already in the chat."""
+    await db.execute(
+        update(ChatMember)
+        .where(ChatMember.chat_id == chat_id, ChatMember.user_id == user_id)
+        .values(unread_count=_unread_query(chat_id, user_id).scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def _actual_counts(db: AsyncSession, chat_ids: List[int]) -> Dict[int, int]:
+    """Unread count per chat_members.id, from the messages past each member's read_through.
+
+    Three grouped queries instead of one count per member: messages past each
+    distinct read_through (members who never read share 0), minus the member's
+    own messages past it, minus their reads of others' messages past it.
+    """
+    members = (await db.execute(
+        select(ChatMember.id, ChatMember.chat_id, ChatMember.read_through).where(ChatMember.chat_id.in_(chat_ids))
+    )).all()
+
+    marks = (
+        select(ChatMember.chat_id, ChatMember.read_through)
+        .where(ChatMember.chat_id.in_(chat_ids))
+        .distinct()
+        .subquery()
+    )
+    stmt = (
+        select(marks.c.chat_id, marks.c.read_through, func.count(Message.id))
+        .join(Message, and_(Message.chat_id == marks.c.chat_id, Message.id > marks.c.read_through))
+        .group_by(marks.c.chat_id, marks.c.read_through)
+    )
+    after: Dict[Tuple[int, int], int] = {(c, w): n for c, w, n in (await db.execute(stmt)).all()}
+
+    past_mark = and_(Message.chat_id == ChatMember.chat_id, Message.id > ChatMember.read_through)
+    stmt = (
+        select(ChatMember.id, func.count(Message.id))
+        .join(Message, and_(past_mark, Message.sender_id == ChatMember.user_id))
+        .where(ChatMember.chat_id.in_(chat_ids))
+        .group_by(ChatMember.id)
+    )
+    own = dict((await db.execute(stmt)).all())
+    stmt = (
+        select(ChatMember.id, func.count(MessageRead.id))
+        .join(Message, and_(past_mark, Message.sender_id != ChatMember.user_id))
+        .join(MessageRead, and_(MessageRead.message_id == Message.id, MessageRead.user_id == ChatMember.user_id))
+        .where(ChatMember.chat_id.in_(chat_ids))
+        .group_by(ChatMember.id)
+    )
+    read = dict((await db.execute(stmt)).all())
+
+    return {
+        member_id: after.get((chat_id, mark), 0) - own.get(member_id, 0) - read.get(member_id, 0)
+        for member_id, chat_id, mark in members
+    }
+
+
+async def reconcile(db: AsyncSession, chat_ids: Iterable[int]) -> int:
+    """Recompute the counters of these chats; returns how many were wrong."""
+    chat_ids = list(chat_ids)
+    actual = await _actual_counts(db, chat_ids)
+    stored = (await db.execute(
+        select(ChatMember.id, ChatMember.unread_count).where(ChatMember.chat_id.in_(chat_ids))
+    )).all()
+    wrong = [
+        {"member_id": member_id, "count": actual[member_id]}
+        for member_id, count in stored
+        if member_id in actual and actual[member_id] != count
+    ]
+    if wrong:
+        await db.execute(
+            update(ChatMember.__table__)
+            .where(ChatMember.__table__.c.id == bindparam("member_id"))
+            .values(unread_count=bindparam("count")),
+            wrong,
+        )
+    return len(wrong)
+
+
+async def reconcile_changed():
+    """Recount the chats queued since the last pass, in batches. Chats with a
+    message in the last UNREAD_RECONCILE_QUIET_SECONDS stay queued: their
+    counters are moving anyway, and a recount racing a send could itself be
+    off by one."""
+    if not _changed:
+        return
+    taken = sorted(_changed)
+    _changed.difference_update(taken)
+    quiet_since = datetime.now(timezone.utc) - timedelta(seconds=settings.UNREAD_RECONCILE_QUIET_SECONDS)
+    size = settings.UNREAD_RECONCILE_BATCH_SIZE
+    fixed = 0
+    try:
+        for start in range(0, len(taken), size):
+            chat_ids = taken[start:start + size]
+            async with AsyncSessionLocal() as db:
+                stmt = (
+                    select(Message.chat_id)
+                    .where(Message.chat_id.in_(chat_ids), Message.created_at >= quiet_since)
+                    .distinct()
+                )
+                busy = set((await db.execute(stmt)).scalars().all())
+                _changed.update(busy)
+                quiet = [chat_id for chat_id in chat_ids if chat_id not in busy]
+                if quiet:
+                    fixed += await reconcile(db, quiet)
+                    await db.commit()
+    except Exception:
+        _changed.update(taken)
+        raise
+    finally:
+        if fixed:
+            logger.warning(f"Unread reconciliation corrected {fixed} counters")
+
+
+async def run_reconciliation():
+    while True:
+        await asyncio.sleep(settings.UNREAD_RECONCILE_INTERVAL_SECONDS)
+        try:
+            await reconcile_changed()
+        except Exception as e:
+            logger.error(f"Unread reconciliation failed: {e}")
@@ -1,15 +1,16 @@
 import aiofiles
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from datetime import timedelta
 from typing import Optional
 import os
 import uuid
 from fastapi import HTTPException
 from ..models import User
 from ..schemas import UserCreate
-from ..auth import get_password_hash, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from ..auth import get_password_hash, verify_password, password_needs_rehash
 from ..config import settings
+from ..read_cache import read_cache
+from ..recent_messages import recent_messages
 
 from jose import jwt, JWTError
 from sqlalchemy import update
@@ -25,7 +26,7 @@ async def check_user_exists(db: AsyncSession, username: str, email: Optional[str
 
 async def register_user(db: AsyncSession, user_in: UserCreate, secret: str, is_verified: bool = False) -> Optional[User]:
     
-    hashed_password = get_password_hash(user_in.password)
+    hashed_password = await get_password_hash(user_in.password)
     
     user = User(
         username=user_in.username, 
@@ -51,9 +52,13 @@ async def authenticate_user(db: AsyncSession, username: str, password: str) -> d
     if not user or not user.is_verified:
         return {"user": None, "requires_2fa": False}
         
-    if not verify_password(password, user.password_hash):
+    if not await verify_password(password, user.password_hash):
         return {"user": None, "requires_2fa": False}
 
+    if password_needs_rehash(user.password_hash):
+        user.password_hash = await get_password_hash(password)
+        await db.commit()
+
     if user.is_2fa_enabled:
         return {"user": user, "requires_2fa": True}
         
@@ -71,13 +76,6 @@ async def verify_passwordless_2fa(db: AsyncSession, username: str, code: str) ->
     return None
 
 
-def create_user_token(user: User):
-    access_token = create_access_token(
-        data={"sub": user.username, "user_id": user.id},
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
-
 async def update_user_avatar(db: AsyncSession, user: User, file_content, filename: str) -> User:
     file_ext = os.path.splitext(filename)[1].lower()
     if file_ext not in [".jpg", ".jpeg", ".png"]:
@@ -114,6 +112,9 @@ async def update_user_avatar(db: AsyncSession, user: User, file_content, filenam
     user.avatar_path = unique_filename
     await db.commit()
     await db.refresh(user)
+    # Avatars appear in other users' chat lists too
+    read_cache.clear()
+    recent_messages.clear()
     return user
 
 async def delete_user_avatar(db: AsyncSession, user: User) -> User:
@@ -127,6 +128,9 @@ async def delete_user_avatar(db: AsyncSession, user: User) -> User:
         user.avatar_path = None
         await db.commit()
         await db.refresh(user)
+        # Avatars appear in other users' chat lists too
+        read_cache.clear()
+        recent_messages.clear()
     return user
 
 async def clear_all_avatars(db: AsyncSession):
@@ -143,4 +147,6 @@ async def clear_all_avatars(db: AsyncSession):
     # 2. Reset avatar_path for all users in DB
     await db.execute(update(User).values(avatar_path=None))
     await db.commit()
+    read_cache.clear()
+    recent_messages.clear()
     return {"status": "success", "message": "All avatars cleared"}
@@ -1,11 +1,18 @@
 from fastapi import WebSocket
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
 import json
 import logging
+from datetime import datetime, timezone
 from sqlalchemy import select
+from .config import settings
 from .database import AsyncSessionLocal
 from .models import User as DBUser, ChatMember
-from .ws_types import WSEventType
+from .ws_types import WSEventType, WSCloseCode
+from .event_log import event_log, is_replayable
+from .rate_limit import MemoryBucketStore, TokenBucket
+from .revocation import revocation_list
+from . import ws_protocol
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +22,22 @@ class ConnectionManager:
         self.active_connections: Dict[int, Dict[WebSocket, str]] = {}
         # user_id -> currently broadcasted aggregated status
         self.user_statuses: Dict[int, str] = {}
+        # user_id -> (publish task, loop time it fires) for a debounced status change
+        self._pending_status: Dict[int, Tuple[asyncio.Task, float]] = {}
+        # user_id -> last moment the user had a live connection
+        self.last_seen: Dict[int, datetime] = {}
+        # websocket -> loop time of the last frame received from it
+        self.last_activity: Dict[WebSocket, float] = {}
+        self.connection_count = 0
+        # websocket -> negotiated frame encoding (see ws_protocol)
+        self.connection_encoding: Dict[WebSocket, str] = {}
+        # websocket -> (session id, expiry) of the access token it connected with
+        self.connection_session: Dict[WebSocket, Tuple[str, Optional[datetime]]] = {}
+        # websocket -> budget for all inbound frames / for typing and status updates
+        self.frame_budget: Dict[WebSocket, TokenBucket] = {}
+        self.chatter_budget: Dict[WebSocket, TokenBucket] = {}
+        # "typing:<chat_id>" -> budget shared by all members of a large group
+        self.typing_budget = MemoryBucketStore()
 
     def _get_aggregated_status(self, user_id: int) -> str:
         if user_id not in self.active_connections or not self.active_connections[user_id]:
@@ -25,55 +48,197 @@ class ConnectionManager:
             return "online"
         return "away"
 
-    async def connect(self, user_id: int, websocket: WebSocket):
-        await websocket.accept()
+    def _schedule_status(self, user_id: int):
+        """Debounce a change of the aggregated status before it is broadcast.
+
+        Offline is published only after PRESENCE_OFFLINE_GRACE_SECONDS, so a client
+        that drops and reconnects is invisible to everyone else, and online/away
+        flips are coalesced into at most one event per PRESENCE_COALESCE_SECONDS.
+        """
+        new_agg_status = self._get_aggregated_status(user_id)
+        old_agg_status = self.user_statuses.get(user_id, "offline")
+        pending = self._pending_status.get(user_id)
+
+        if new_agg_status == old_agg_status:
+            # Flapped back to what the others already see
+            if pending:
+                pending[0].cancel()
+                del self._pending_status[user_id]
+            return
+
+        if new_agg_status == "offline":
+            delay = settings.PRESENCE_OFFLINE_GRACE_SECONDS
+        else:
+            delay = settings.PRESENCE_COALESCE_SECONDS
+
+        loop = asyncio.get_running_loop()
+        fires_at = loop.time() + delay
+        if pending:
+            # An earlier flush re-reads the status when it fires, so keep it
+            if pending[1] <= fires_at:
+                return
+            pending[0].cancel()
+
+        task = asyncio.create_task(self._publish_status_later(user_id, delay))
+        self._pending_status[user_id] = (task, fires_at)
+
+    async def _publish_status_later(self, user_id: int, delay: float):
+        await asyncio.sleep(delay)
+
+        pending = self._pending_status.get(user_id)
+        if pending and pending[0] is asyncio.current_task():
+            del self._pending_status[user_id]
+
+        status = self._get_aggregated_status(user_id)
+        if status == "offline":
+            # A coalesced flush may fire before the grace window has passed
+            last_seen = self.last_seen.get(user_id)
+            if last_seen:
+                elapsed = (datetime.now(timezone.utc) - last_seen).total_seconds()
+                remaining = settings.PRESENCE_OFFLINE_GRACE_SECONDS - elapsed
+                if remaining > 0:
+                    task = asyncio.create_task(self._publish_status_later(user_id, remaining))
+                    self._pending_status[user_id] = (task, asyncio.get_running_loop().time() + remaining)
+                    return
+
+        if status == self.user_statuses.get(user_id, "offline"):
+            return
+
+        if status == "offline":
+            self.user_statuses.pop(user_id, None)
+        else:
+            self.user_statuses[user_id] = status
+        await self.broadcast_status(user_id, status)
+
+    def allow_frame(self, websocket: WebSocket) -> bool:
+        budget = self.frame_budget.get(websocket)
+        return budget is None or budget.take()
+
+    def touch(self, websocket: WebSocket):
+        if websocket in self.last_activity:
+            self.last_activity[websocket] = asyncio.get_running_loop().time()
+
+    def _remove_connection(self, user_id: int, websocket: WebSocket) -> bool:
+        connections = self.active_connections.get(user_id)
+        if not connections or websocket not in connections:
+            return False
+
+        del connections[websocket]
+        self.last_activity.pop(websocket, None)
+        self.connection_encoding.pop(websocket, None)
+        self.connection_session.pop(websocket, None)
+        self.frame_budget.pop(websocket, None)
+        self.chatter_budget.pop(websocket, None)
+        self.connection_count -= 1
+        if not connections:
+            del self.active_connections[user_id]
+            self.last_seen[user_id] = datetime.now(timezone.utc)
+        return True
+
+    async def _close_quietly(self, websocket: WebSocket, code: int):
+        try:
+            await asyncio.wait_for(websocket.close(code=code), timeout=settings.WS_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+    def _evict(self, user_id: int, websocket: WebSocket, code: int):
+        """Forget a socket, publish the resulting status and close it without waiting on the peer."""
+        if self._remove_connection(user_id, websocket):
+            self._schedule_status(user_id)
+        asyncio.create_task(self._close_quietly(websocket, code))
+
+    async def connect(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        subprotocol: Optional[str] = None,
+        encoding: str = ws_protocol.ENCODING_JSON,
+        session_id: Optional[str] = None,
+        expires_at: Optional[datetime] = None,
+    ) -> bool:
+        await websocket.accept(subprotocol=subprotocol)
+
+        if self.connection_count >= settings.WS_MAX_CONNECTIONS:
+            logger.warning(f"Rejecting WS for user {user_id}: global connection limit reached")
+            await websocket.close(code=WSCloseCode.TRY_AGAIN_LATER)
+            return False
         
         if user_id not in self.active_connections:
             self.active_connections[user_id] = {}
+        connections = self.active_connections[user_id]
         
         # New connection defaults to online
-        self.active_connections[user_id][websocket] = "online"
-        
-        new_agg_status = self._get_aggregated_status(user_id)
-        old_agg_status = self.user_statuses.get(user_id, "offline")
-        
-        self.user_statuses[user_id] = new_agg_status
+        connections[websocket] = "online"
+        self.last_activity[websocket] = asyncio.get_running_loop().time()
+        self.connection_encoding[websocket] = encoding
+        if session_id is not None:
+            self.connection_session[websocket] = (session_id, expires_at)
+        self.frame_budget[websocket] = TokenBucket(settings.WS_FRAME_RATE_PER_SECOND, settings.WS_FRAME_BURST)
+        self.chatter_budget[websocket] = TokenBucket(settings.WS_CHATTER_RATE_PER_SECOND, settings.WS_CHATTER_BURST)
+        self.connection_count += 1
+        self.last_seen[user_id] = datetime.now(timezone.utc)
+
+        # Over the per-user cap the least recently active socket is the likeliest zombie
+        while len(connections) > settings.WS_MAX_CONNECTIONS_PER_USER:
+            stale = min(connections, key=lambda ws: self.last_activity.get(ws, 0.0))
+            logger.info(f"Evicting least recently active connection of user {user_id}")
+            self._remove_connection(user_id, stale)
+            asyncio.create_task(self._close_quietly(stale, WSCloseCode.TOO_MANY_CONNECTIONS))
         
-        logger.info(f"User {user_id} connected. Total connections for user: {len(self.active_connections[user_id])}")
+        logger.info(f"User {user_id} connected. Total connections for user: {len(connections)}")
         
-        if new_agg_status != old_agg_status:
-            await self.broadcast_status(user_id, new_agg_status)
+        self._schedule_status(user_id)
+        return True
 
     async def disconnect(self, user_id: int, websocket: WebSocket):
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                del self.active_connections[user_id][websocket]
-            
-            logger.info(f"User {user_id} disconnected. Remaining connections: {len(self.active_connections[user_id])}")
-            
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
-                if user_id in self.user_statuses:
-                    del self.user_statuses[user_id]
-                await self.broadcast_status(user_id, "offline")
-            else:
-                new_agg_status = self._get_aggregated_status(user_id)
-                old_agg_status = self.user_statuses.get(user_id)
-                if new_agg_status != old_agg_status:
-                    self.user_statuses[user_id] = new_agg_status
-                    await self.broadcast_status(user_id, new_agg_status)
+        if self._remove_connection(user_id, websocket):
+            logger.info(f"User {user_id} disconnected. Remaining connections: {len(self.active_connections.get(user_id, {}))}")
+            self._schedule_status(user_id)
+
+    def close_session(self, session_id: str):
+        """Close the sockets opened with this session's access tokens."""
+        for user_id, connections in list(self.active_connections.items()):
+            for websocket in list(connections):
+                session = self.connection_session.get(websocket)
+                if session and session[0] == session_id:
+                    logger.info(f"Closing WS of user {user_id}: session revoked")
+                    self._evict(user_id, websocket, WSCloseCode.AUTH_FAILED)
+
+    def _session_ended(self, websocket: WebSocket, now: datetime) -> bool:
+        session = self.connection_session.get(websocket)
+        if session is None:
+            return False
+        session_id, expires_at = session
+        return revocation_list.is_revoked(session_id) or (expires_at is not None and expires_at <= now)
+
+    def _forget_offline(self):
+        """Drop last_seen of users who are gone and whose offline status is published."""
+        for user_id in [u for u in self.last_seen if u not in self.active_connections and u not in self._pending_status]:
+            del self.last_seen[user_id]
+
+    async def run_heartbeat(self):
+        """Close sockets whose access token expired or whose session was revoked
+        on another worker, and forget users who went offline.
+
+        Liveness is left to uvicorn's protocol-level pings (--ws-ping-interval):
+        every client library answers them, and a peer that stops doing so is
+        disconnected and cleaned up like any other disconnect.
+        """
+        while True:
+            await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL_SECONDS)
+            now = datetime.now(timezone.utc)
+            for user_id, connections in list(self.active_connections.items()):
+                for websocket in list(connections):
+                    if self._session_ended(websocket, now):
+                        logger.info(f"Closing WS of user {user_id}: access token expired or revoked")
+                        self._evict(user_id, websocket, WSCloseCode.AUTH_FAILED)
+            self._forget_offline()
 
     async def update_user_status(self, user_id: int, status: str, websocket: WebSocket):
         if user_id in self.active_connections and websocket in self.active_connections[user_id]:
             if status in ["online", "away"]:
                 self.active_connections[user_id][websocket] = status
-                
-                new_agg_status = self._get_aggregated_status(user_id)
-                old_agg_status = self.user_statuses.get(user_id)
-                
-                if new_agg_status != old_agg_status:
-                    self.user_statuses[user_id] = new_agg_status
-                    await self.broadcast_status(user_id, new_agg_status)
+                self._schedule_status(user_id)
 
     async def broadcast_status(self, user_id: int, status: str):
         status_msg = {
@@ -81,14 +246,16 @@ class ConnectionManager:
             "data": {
                 "user_id": user_id,
                 "status": status,
-                "online": status != "offline"
+                "online": status != "offline",
+                "last_seen": self.last_seen[user_id].isoformat() if user_id in self.last_seen else None
             }
         }
         # In a real app, only broadcast to contacts/members of mutual chats
         # For simplicity, we broadcast to all current online users
+        frames = {}
         for other_user_id in list(self.active_connections.keys()):
             if other_user_id != user_id:
-                await self.send_personal_message(status_msg, other_user_id)
+                await self.send_personal_message(status_msg, other_user_id, frames)
 
     async def broadcast_user_update(self, user_id: int, username: str, avatar_path: str = None):
         update_msg = {
@@ -99,44 +266,67 @@ class ConnectionManager:
                 "avatar_path": avatar_path
             }
         }
+        frames = {}
         for other_user_id in list(self.active_connections.keys()):
-            await self.send_personal_message(update_msg, other_user_id)
+            await self.send_personal_message(update_msg, other_user_id, frames)
 
     def get_online_users(self) -> Dict[int, str]:
         return self.user_statuses
 
-    async def send_personal_message(self, message: dict, user_id: int):
+    async def send_to_connection(self, user_id: int, websocket: WebSocket, message: dict, frames: Optional[dict] = None) -> bool:
+        """Send to one socket in its negotiated encoding.
+
+        `frames` caches the encoded message per encoding, so a broadcast serializes
+        each event once per encoding rather than once per socket.
+        """
+        encoding = self.connection_encoding.get(websocket, ws_protocol.ENCODING_JSON)
+        if frames is None:
+            frames = {}
+        frame = frames.get(encoding)
+        if frame is None:
+            frame = frames[encoding] = ws_protocol.encode(message, encoding)
+        send = websocket.send_bytes(frame) if isinstance(frame, bytes) else websocket.send_text(frame)
+
+        try:
+            await asyncio.wait_for(send, timeout=settings.WS_SEND_TIMEOUT_SECONDS)
+            return True
+        except asyncio.TimeoutError:
+            # The peer isn't draining its buffer; drop it instead of stalling every broadcast
+            logger.warning(f"Closing slow WS consumer for user {user_id}")
+            self._evict(user_id, websocket, WSCloseCode.SLOW_CONSUMER)
+        except Exception as e:
+            logger.error(f"Failed to send message to user {user_id}: {str(e)}")
+            if self._remove_connection(user_id, websocket):
+                # The status broadcast runs later from its own task, so dead sockets
+                # of other users can't recurse back into this send path.
+                self._schedule_status(user_id)
+        return False
+
+    async def send_personal_message(self, message: dict, user_id: int, frames: Optional[dict] = None):
         if user_id in self.active_connections:
+            if frames is None:
+                frames = {}
             # Create a copy of sockets to avoid dict mutation during iteration
-            sockets = list(self.active_connections[user_id].keys())
-            dead_sockets = []
-            for connection in sockets:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    logger.error(f"Failed to send message to user {user_id}: {str(e)}")
-                    dead_sockets.append(connection)
-            
-            for connection in dead_sockets:
-                if user_id in self.active_connections and connection in self.active_connections[user_id]:
-                    del self.active_connections[user_id][connection]
-            
-            if user_id in self.active_connections and not self.active_connections[user_id]:
-                del self.active_connections[user_id]
-                if user_id in self.user_statuses:
-                    del self.user_statuses[user_id]
-                
-                # IMPORTANT: we don't broadcast offline status here to prevent recursion
-                # if other users' sockets are also dead. The offline status will be organically
-                # calculated or broadcasted by explicit disconnects instead.
+            for connection in list(self.active_connections[user_id].keys()):
+                await self.send_to_connection(user_id, connection, message, frames)
 
     async def broadcast_to_chat(self, message: dict, member_ids: List[int]):
         logger.info(f"ConnectionManager: Broadcasting to members {member_ids}")
+        if is_replayable(message):
+            # Same seq for every recipient so the frame stays identical for all of them
+            message = {**message, "seq": event_log.next_seq()}
+            event_log.append(member_ids, message["seq"], message)
+        frames = {}
         for user_id in member_ids:
-            await self.send_personal_message(message, user_id)
+            await self.send_personal_message(message, user_id, frames)
 
     async def handle_message(self, user_id: int, msg: dict, websocket: WebSocket):
         msg_type = msg.get("type")
+        if msg_type in (WSEventType.TYPING, WSEventType.USER_STATUS_UPDATE):
+            # Each of these costs a fan-out; past the budget they're silently dropped
+            budget = self.chatter_budget.get(websocket)
+            if budget is not None and not budget.take():
+                return
         if msg_type == WSEventType.TYPING:
             chat_id = msg.get("chat_id")
             is_typing = msg.get("is_typing", False)
@@ -146,6 +336,15 @@ class ConnectionManager:
                         member_ids_stmt = select(ChatMember.user_id).where(ChatMember.chat_id == chat_id)
                         member_ids_result = await db.execute(member_ids_stmt)
                         member_ids = member_ids_result.scalars().all()
+                        if is_typing and len(member_ids) > settings.LARGE_GROUP_THRESHOLD:
+                            # Every frame reaches all members, so the group as a whole
+                            # gets a few per second; "stopped typing" always goes out
+                            if not await self.typing_budget.hit(
+                                f"typing:{chat_id}",
+                                settings.LARGE_GROUP_TYPING_RATE_PER_SECOND,
+                                settings.LARGE_GROUP_TYPING_BURST,
+                            ):
+                                return
 
                         user_name_stmt = select(DBUser.username).where(DBUser.id == user_id)
                         user_name_result = await db.execute(user_name_stmt)
@@ -171,4 +370,13 @@ class ConnectionManager:
             if new_status:
                 await self.update_user_status(user_id, new_status, websocket)
 
+        elif msg_type in (WSEventType.SEND_MESSAGE, WSEventType.MARK_READ, WSEventType.TOGGLE_REACTION):
+            # Imported here: the commands go through services that import this module
+            from .ws_commands import handle_command
+            await handle_command(self, user_id, msg, websocket)
+
+        elif msg_type == WSEventType.PING:
+            await self.send_to_connection(user_id, websocket, {"type": WSEventType.PONG, "data": {}})
+
+
 manager = ConnectionManager()
@@ -0,0 +1,91 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import WebSocket
+from pydantic import BaseModel, ValidationError
+
+from .database import AsyncSessionLocal, mark_write
+from .rate_limit import allow_user
+from .schemas import MessageCreate, MessageOut, ReactionToggle
+from .services import message_service, reaction_service
+from .ws_types import WSEventType
+
+logger = logging.getLogger(__name__)
+
+
+class CommandError(Exception):
+    pass
+
+
+class MarkReadCommand(BaseModel):
+    message_id: Optional[int] = None
+    chat_id: Optional[int] = None
+
+
+class ReactionCommand(ReactionToggle):
+    message_id: int
+
+
+async def _send_message(user_id: int, data: dict) -> Any:
+    payload = MessageCreate.model_validate(data)
+    async with AsyncSessionLocal() as db:
+        message = await message_service.send_message(db, payload, user_id)
+        if not message:
+            raise CommandError("Not a member of this chat")
+        return MessageOut.model_validate(message).model_dump(mode="json")
+
+
+async def _mark_read(user_id: int, data: dict) -> Any:
+    payload = MarkReadCommand.model_validate(data)
+    async with AsyncSessionLocal() as db:
+        if payload.message_id is not None:
+            success = await message_service.mark_as_read(db, payload.message_id, user_id)
+        elif payload.chat_id is not None:
+            success = await message_service.mark_all_as_read(db, payload.chat_id, user_id)
+        else:
+            raise CommandError("message_id or chat_id is required")
+    if not success:
+        raise CommandError("Forbidden or message not found")
+    return {"status": "ok"}
+
+
+async def _toggle_reaction(user_id: int, data: dict) -> Any:
+    payload = ReactionCommand.model_validate(data)
+    async with AsyncSessionLocal() as db:
+        result = await reaction_service.toggle_reaction(db, payload.message_id, user_id, payload.emoji)
+        if not result:
+            raise CommandError("Forbidden or message not found")
+        return result.model_dump(mode="json")
+
+
+COMMANDS: Dict[WSEventType, Callable[[int, dict], Awaitable[Any]]] = {
+    WSEventType.SEND_MESSAGE: _send_message,
+    WSEventType.MARK_READ: _mark_read,
+    WSEventType.TOGGLE_REACTION: _toggle_reaction,
+}
+
+
+async def handle_command(manager, user_id: int, msg: dict, websocket: WebSocket):
+    """Run a client command over the socket and answer the sending connection.
+
+    Replies carry the client-generated "id" so the client can match them to the
+    request; the usual broadcasts (new_message, message_read, ...) go out as well.
+    """
+    command_id = msg.get("id")
+    handler = COMMANDS[WSEventType(msg.get("type"))]
+    if not await allow_user(user_id):
+        reply = {"type": WSEventType.NACK, "id": command_id, "error": "Too many requests"}
+        await manager.send_to_connection(user_id, websocket, reply)
+        return
+    try:
+        result = await handler(user_id, msg.get("data") or {})
+        mark_write(user_id)
+        reply = {"type": WSEventType.ACK, "id": command_id, "data": result}
+    except ValidationError as e:
+        reply = {"type": WSEventType.NACK, "id": command_id, "error": "Invalid payload", "details": e.errors(include_url=False, include_context=False, include_input=False)}
+    except CommandError as e:
+        reply = {"type": WSEventType.NACK, "id": command_id, "error": str(e)}
+    except Exception as e:
+        logger.error(f"WS command {msg.get('type')} failed for user {user_id}: {e}", exc_info=True)
+        reply = {"type": WSEventType.NACK, "id": command_id, "error": "Internal Server Error"}
+    await manager.send_to_connection(user_id, websocket, reply)
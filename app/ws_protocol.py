@@ -0,0 +1,45 @@
+import json
+from typing import Iterable, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, JSON keeps working without it
+    msgpack = None
+
+# Sec-WebSocket-Protocol values a client may offer, in server preference order.
+# Clients that offer none get the original JSON text frames.
+JSON_PROTOCOL = "messenger.json"
+MSGPACK_PROTOCOL = "messenger.msgpack"
+
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+
+
+def negotiate(offered: Iterable[str]) -> Tuple[Optional[str], str]:
+    """Pick (subprotocol to echo back, frame encoding) from what the client offered."""
+    offered = list(offered)
+    if MSGPACK_PROTOCOL in offered and msgpack is not None:
+        return MSGPACK_PROTOCOL, ENCODING_MSGPACK
+    if JSON_PROTOCOL in offered:
+        return JSON_PROTOCOL, ENCODING_JSON
+    return None, ENCODING_JSON
+
+
+def encode(message: dict, encoding: str) -> Union[str, bytes]:
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.packb(message)
+    # Same output as WebSocket.send_json, so old clients see identical frames
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def decode(frame: dict) -> dict:
+    """Decode an ASGI websocket.receive event; raises ValueError on garbage."""
+    if frame.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("Binary frames need msgpack")
+        msg = msgpack.unpackb(frame["bytes"])
+    else:
+        msg = json.loads(frame.get("text") or "")
+    if not isinstance(msg, dict):
+        raise ValueError("Frame is not an object")
+    return msg
@@ -1,9 +1,10 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 class WSEventType(str, Enum):
     NEW_MESSAGE = "new_message"
     DELETE_MESSAGE = "delete_message"
     MESSAGE_READ = "message_read"
+    MESSAGE_READ_COUNT = "message_read_count"
     MESSAGE_REACTION = "message_reaction"
     NEW_CHAT = "new_chat"
     CHAT_UPDATED = "chat_updated"
@@ -13,3 +14,20 @@ class WSEventType(str, Enum):
     USER_UPDATED = "user_updated"
     TYPING = "typing"
     USER_STATUS_UPDATE = "user_status_update"
+    PING = "ping"
+    PONG = "pong"
+    RESYNC_REQUIRED = "resync_required"
+    REPLAY_COMPLETE = "replay_complete"
+    # Client commands answered with ack/nack carrying the client's "id"
+    SEND_MESSAGE = "send_message"
+    MARK_READ = "mark_read"
+    TOGGLE_REACTION = "toggle_reaction"
+    ACK = "ack"
+    NACK = "nack"
+
+class WSCloseCode(IntEnum):
+    TRY_AGAIN_LATER = 1013
+    AUTH_FAILED = 4003
+    TOO_MANY_CONNECTIONS = 4008
+    SLOW_CONSUMER = 4011
+    RATE_LIMITED = 4029
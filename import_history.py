@@ -0,0 +1,16 @@
+import asyncio
+import json
+import aiofiles
+from app.services.import_service import import_history, iter_lines
+
+async def run_import(path: str, batch_size: int = None):
+    async with aiofiles.open(path, "rb") as f:
+        async for report in import_history(iter_lines(f.read), batch_size):
+            print(json.dumps(report), flush=True)
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Usage: python import_history.py <history.ndjson> [batch size]")
+    else:
+        asyncio.run(run_import(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None))
@@ -0,0 +1,40 @@
+"""add user_events for WS replay spill
+
+Revision ID: 7c1d2e3f4a5b
+Revises: 06a53294ad46
+Create Date: 2026-10-19 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1d2e3f4a5b'
+down_revision: Union[str, Sequence[str], None] = '06a53294ad46'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_events',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.BigInteger(), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_user_events_user_seq', 'user_events', ['user_id', 'seq'], unique=False)
+    op.create_index(op.f('ix_user_events_created_at'), 'user_events', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_user_events_created_at'), table_name='user_events')
+    op.drop_index('ix_user_events_user_seq', table_name='user_events')
+    op.drop_table('user_events')
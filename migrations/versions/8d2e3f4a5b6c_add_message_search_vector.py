@@ -0,0 +1,34 @@
+"""add full-text search vector to messages
+
+Revision ID: 8d2e3f4a5b6c
+Revises: 7c1d2e3f4a5b
+Create Date: 2026-10-19 09:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2e3f4a5b6c'
+down_revision: Union[str, Sequence[str], None] = '7c1d2e3f4a5b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 'simple' config: no stemming or stop words, chats are multilingual
+    op.execute(
+        "ALTER TABLE messages ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(text, ''))) STORED"
+    )
+    op.execute("CREATE INDEX ix_messages_search_vector ON messages USING gin (search_vector)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS ix_messages_search_vector")
+    op.drop_column('messages', 'search_vector')
@@ -0,0 +1,32 @@
+"""add trigram index on users.username and chat_members.user_id index
+
+Revision ID: 9e3f4a5b6c7d
+Revises: 8d2e3f4a5b6c
+Create Date: 2026-10-19 10:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e3f4a5b6c7d'
+down_revision: Union[str, Sequence[str], None] = '8d2e3f4a5b6c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE INDEX ix_users_username_trgm ON users USING gin (username gin_trgm_ops)")
+    # Contact lookups ("chats shared with the caller") go through user_id
+    op.create_index(op.f('ix_chat_members_user_id'), 'chat_members', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_chat_members_user_id'), table_name='chat_members')
+    op.execute("DROP INDEX IF EXISTS ix_users_username_trgm")
@@ -0,0 +1,35 @@
+"""add chat_members.unread_count
+
+Revision ID: a0b1c2d3e4f5
+Revises: f9a0b1c2d3e4
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a0b1c2d3e4f5'
+down_revision: Union[str, Sequence[str], None] = 'f9a0b1c2d3e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chat_members', sa.Column('unread_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute("""
+        UPDATE chat_members cm SET unread_count = (
+            SELECT count(*) FROM messages m
+            WHERE m.chat_id = cm.chat_id AND m.sender_id != cm.user_id
+              AND NOT EXISTS (SELECT 1 FROM message_reads r WHERE r.message_id = m.id AND r.user_id = cm.user_id)
+        )
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('chat_members', 'unread_count')
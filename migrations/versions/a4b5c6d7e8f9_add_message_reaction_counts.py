@@ -0,0 +1,38 @@
+"""add message_reaction_counts
+
+Revision ID: a4b5c6d7e8f9
+Revises: 9e3f4a5b6c7d
+Create Date: 2026-10-19 10:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4b5c6d7e8f9'
+down_revision: Union[str, Sequence[str], None] = '9e3f4a5b6c7d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('message_reaction_counts',
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('emoji', sa.String(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('message_id', 'emoji')
+    )
+    op.execute(
+        "INSERT INTO message_reaction_counts (message_id, emoji, count) "
+        "SELECT message_id, emoji, count(*) FROM message_reactions GROUP BY message_id, emoji"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('message_reaction_counts')
@@ -0,0 +1,33 @@
+"""add messages.read_count
+
+Revision ID: b1c2d3e4f5a6
+Revises: a0b1c2d3e4f5
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b1c2d3e4f5a6'
+down_revision: Union[str, Sequence[str], None] = 'a0b1c2d3e4f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column('read_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute("""
+        UPDATE messages m SET read_count = r.n
+        FROM (SELECT message_id, count(*) AS n FROM message_reads GROUP BY message_id) r
+        WHERE r.message_id = m.id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('messages', 'read_count')
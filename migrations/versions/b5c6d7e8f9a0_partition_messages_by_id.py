@@ -0,0 +1,125 @@
+"""partition messages by id range, add archive catalog
+
+Revision ID: b5c6d7e8f9a0
+Revises: a4b5c6d7e8f9
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5c6d7e8f9a0'
+down_revision: Union[str, Sequence[str], None] = 'a4b5c6d7e8f9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Keep in step with MESSAGE_PARTITION_SIZE / MESSAGE_PARTITIONS_AHEAD; the
+# maintenance task continues from whatever bounds exist.
+PARTITION_SIZE = 5_000_000
+PARTITIONS_AHEAD = 2
+
+DROP_MESSAGE_FKS = """
+DO $$
+DECLARE r record;
+BEGIN
+    FOR r IN SELECT conname, conrelid::regclass AS tbl FROM pg_constraint
+             WHERE contype = 'f' AND (conrelid = 'messages'::regclass OR confrelid = 'messages'::regclass)
+    LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', r.tbl, r.conname);
+    END LOOP;
+END $$;
+"""
+
+
+def _create_message_fks() -> None:
+    op.create_foreign_key('messages_chat_id_fkey', 'messages', 'chats', ['chat_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('messages_sender_id_fkey', 'messages', 'users', ['sender_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('messages_file_id_fkey', 'messages', 'files', ['file_id'], ['id'], ondelete='SET NULL')
+    for table in ('message_reads', 'message_reactions', 'message_reaction_counts'):
+        op.create_foreign_key(f'{table}_message_id_fkey', table, 'messages', ['message_id'], ['id'], ondelete='CASCADE')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+
+    # The existing table becomes the first partition, so no rows are copied.
+    # reply_to_id loses its FK: hot replies must not pin archived partitions.
+    op.execute(DROP_MESSAGE_FKS)
+    op.execute("ALTER TABLE messages RENAME TO messages_legacy")
+    op.execute("ALTER INDEX messages_pkey RENAME TO messages_legacy_pkey")
+    op.execute("ALTER INDEX ix_messages_id RENAME TO ix_messages_legacy_id")
+    op.execute("ALTER INDEX ix_messages_search_vector RENAME TO ix_messages_legacy_search_vector")
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('messages_legacy', 'id')")).scalar()
+
+    op.execute(
+        "CREATE TABLE messages (LIKE messages_legacy INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE) "
+        "PARTITION BY RANGE (id)"
+    )
+    op.execute("ALTER TABLE messages ADD CONSTRAINT messages_pkey PRIMARY KEY (id)")
+    op.execute("CREATE INDEX ix_messages_id ON messages (id)")
+    op.execute("CREATE INDEX ix_messages_search_vector ON messages USING gin (search_vector)")
+    op.execute("CREATE INDEX ix_messages_chat_id_id ON messages (chat_id, id)")
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY messages.id")
+
+    max_id = bind.execute(sa.text("SELECT coalesce(max(id), 0) FROM messages_legacy")).scalar()
+    start = (max_id // PARTITION_SIZE + 1) * PARTITION_SIZE
+    op.execute(f"ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO ({start})")
+    for _ in range(PARTITIONS_AHEAD):
+        op.execute(
+            f"CREATE TABLE messages_p{start} PARTITION OF messages "
+            f"FOR VALUES FROM ({start}) TO ({start + PARTITION_SIZE})"
+        )
+        start += PARTITION_SIZE
+
+    _create_message_fks()
+
+    op.create_table('message_archive_segments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('first_message_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('path', sa.String(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_message_archive_segments_chat_first', 'message_archive_segments', ['chat_id', 'first_message_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema.
+
+    Archived segments live outside the database and are not restored.
+    """
+    bind = op.get_bind()
+    op.drop_index('ix_message_archive_segments_chat_first', table_name='message_archive_segments')
+    op.drop_table('message_archive_segments')
+
+    op.execute(DROP_MESSAGE_FKS)
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('messages', 'id')")).scalar()
+    op.execute("ALTER TABLE messages RENAME TO messages_partitioned")
+    op.execute("ALTER INDEX messages_pkey RENAME TO messages_partitioned_pkey")
+    op.execute("ALTER INDEX ix_messages_id RENAME TO ix_messages_partitioned_id")
+    op.execute("ALTER INDEX ix_messages_search_vector RENAME TO ix_messages_partitioned_search_vector")
+    op.execute("DROP INDEX ix_messages_chat_id_id")
+
+    op.execute("CREATE TABLE messages (LIKE messages_partitioned INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE)")
+    op.execute(
+        "INSERT INTO messages (id, chat_id, sender_id, text, file_id, reply_to_id, created_at) "
+        "SELECT id, chat_id, sender_id, text, file_id, reply_to_id, created_at FROM messages_partitioned"
+    )
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY messages.id")
+    op.execute("DROP TABLE messages_partitioned")
+    op.execute("ALTER TABLE messages ADD CONSTRAINT messages_pkey PRIMARY KEY (id)")
+    op.execute("CREATE INDEX ix_messages_id ON messages (id)")
+    op.execute("CREATE INDEX ix_messages_search_vector ON messages USING gin (search_vector)")
+
+    op.execute("UPDATE messages SET reply_to_id = NULL WHERE reply_to_id NOT IN (SELECT id FROM messages)")
+    _create_message_fks()
+    op.create_foreign_key('fk_messages_reply_to_id', 'messages', 'messages', ['reply_to_id'], ['id'], ondelete='SET NULL')
@@ -0,0 +1,32 @@
+"""stamp chat list versions by transaction instead of per-user counters
+
+Revision ID: c2d3e4f5a6b7
+Revises: b1c2d3e4f5a6
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2d3e4f5a6b7'
+down_revision: Union[str, Sequence[str], None] = 'b1c2d3e4f5a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Old counter values stay below every transaction id, so clients holding
+    # an old version just get the chats changed since the upgrade
+    op.add_column('chats', sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'))
+    op.drop_column('users', 'chat_version')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('users', sa.Column('chat_version', sa.BigInteger(), nullable=False, server_default='0'))
+    op.drop_column('chats', 'version')
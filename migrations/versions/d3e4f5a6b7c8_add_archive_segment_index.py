@@ -0,0 +1,32 @@
+"""add block offsets and last record to message_archive_segments
+
+Revision ID: d3e4f5a6b7c8
+Revises: c2d3e4f5a6b7
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3e4f5a6b7c8'
+down_revision: Union[str, Sequence[str], None] = 'c2d3e4f5a6b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('message_archive_segments', sa.Column('block_lines', sa.Integer(), nullable=True))
+    op.add_column('message_archive_segments', sa.Column('block_offsets', sa.JSON(), nullable=True))
+    op.add_column('message_archive_segments', sa.Column('last_message', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('message_archive_segments', 'last_message')
+    op.drop_column('message_archive_segments', 'block_offsets')
+    op.drop_column('message_archive_segments', 'block_lines')
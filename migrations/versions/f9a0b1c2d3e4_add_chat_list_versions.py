@@ -0,0 +1,42 @@
+"""add chat list versions and tombstones
+
+Revision ID: f9a0b1c2d3e4
+Revises: e8f9a0b1c2d3
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f9a0b1c2d3e4'
+down_revision: Union[str, Sequence[str], None] = 'e8f9a0b1c2d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('chat_version', sa.BigInteger(), nullable=False, server_default='0'))
+    op.add_column('chat_members', sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'))
+    op.create_index('ix_chat_members_user_id_version', 'chat_members', ['user_id', 'version'], unique=False)
+    op.create_table('chat_tombstones',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'chat_id')
+    )
+    op.create_index('ix_chat_tombstones_user_id_version', 'chat_tombstones', ['user_id', 'version'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chat_tombstones_user_id_version', table_name='chat_tombstones')
+    op.drop_table('chat_tombstones')
+    op.drop_index('ix_chat_members_user_id_version', table_name='chat_members')
+    op.drop_column('chat_members', 'version')
+    op.drop_column('users', 'chat_version')